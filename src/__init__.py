@@ -1,8 +1,13 @@
 import os
+import glob
+import math
+import time
 import httpx
 import asyncio
+import numpy as np
 import osmnx as ox
 import networkx as nx
+import shapely
 import matplotlib.pyplot as plt
 import logging
 from warnings import filterwarnings
@@ -13,16 +18,339 @@ from functools import lru_cache
 import json
 from datetime import datetime
 
+from . import storage
+from .batch import RoutingPool
+from .cache import MemoryCache, SQLiteCache, cached
+from .ch import ContractionHierarchy, build_contraction_hierarchy, benchmark, hierarchy_path
+from .csr import CSRGraph, ROUTING_ATTRIBUTES
+from .derived import derived
+from .geocoding import GeocodeCache, RateLimiter, StreetIndex, geocode_many, nominatim_reverse, osmnx_geocoder
+from .isochrones import reach_polygons, reach_samples
+from .matching import GPS_SIGMA, SEARCH_RADIUS, MapMatcher, match_to_ids
+from .metrics import Metrics, timed, timed_static
+from .osrm import OSRMClient
+from .pipeline import TRIP_COLUMNS, log_progress, route_file, tile_groups
+from .render import render_image, render_tiles
+from .speeds import SPEED_PROFILES, prepare_graph
+from .spatial import METERS_PER_DEGREE, EdgeIndex, NodeIndex, corridor
+from .tiles import GraphTileCache, graph_from_bbox
+from .tours import solve_tours
+from .versions import apply_diff, diff_graphs, fetch_bbox
+
 
 
 filterwarnings("ignore")
 
 
-class Index:
-    def __init__(self):
+def _as_points(points) -> tuple:
+    """coerces one lat-long point or a sequence of them to an (N, 2) float array
+
+    Rows that cannot be read as a (lat, long) pair are set to NaN and flagged as invalid
+    so batch methods can return the -1 sentinel for them alone.
+
+    Args:
+        points (array-like): a single lat-long point or a list/array of them. example: [(37.7749, -122.4194), ...]
+
+    Returns:
+        points (np.ndarray): (N, 2) array of lat-long points
+        valid (np.ndarray): (N,) boolean mask of rows that were parsed successfully
+    """
+    try:
+        array = np.asarray(points, dtype=float)
+        if array.ndim == 1 and array.shape[0] == 2:
+            array = array.reshape(1, 2)
+        if array.ndim == 2 and array.shape[1] == 2:
+            return array, np.ones(len(array), dtype=bool)
+    except (TypeError, ValueError):
         pass
 
-    @lru_cache(maxsize=None)
+    rows = []
+    for point in points:
+        try:
+            rows.append((float(point[0]), float(point[1])))
+        except (TypeError, ValueError, IndexError, KeyError):
+            rows.append((np.nan, np.nan))
+    array = np.array(rows, dtype=float).reshape(-1, 2)
+    return array, ~np.isnan(array).any(axis=1)
+
+
+def _pairwise(origins, destinations) -> tuple:
+    """broadcasts origins against destinations for the batch geometry methods
+
+    Either side may be a single point, in which case it is paired with every point on the other side.
+
+    Returns:
+        lat1, lon1, lat2, lon2 (np.ndarray): coordinate columns of equal length
+        valid (np.ndarray): boolean mask of pairs where both points are valid
+    """
+    origins, origins_valid = _as_points(origins)
+    destinations, destinations_valid = _as_points(destinations)
+    if len(origins) != len(destinations) and 1 not in (len(origins), len(destinations)):
+        raise ValueError(f"origins ({len(origins)}) and destinations ({len(destinations)}) must have the same length")
+
+    size = max(len(origins), len(destinations))
+    origins = np.broadcast_to(origins, (size, 2))
+    destinations = np.broadcast_to(destinations, (size, 2))
+    valid = np.broadcast_to(origins_valid, size) & np.broadcast_to(destinations_valid, size)
+    return origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1], valid
+
+
+# maps the weight names accepted by Index methods to the edge attribute that holds them
+WEIGHT_ATTRIBUTES = {
+    "time": "travel_time",
+    "length": "length",
+}
+
+
+# the fastest a mode is assumed to travel, in meters per second, to size the graph an isochrone needs
+REACH_SPEEDS = {
+    "walk": 2.0,
+    "bike": 8.0,
+    "drive": 36.0,
+}
+
+
+@lru_cache(maxsize=8)
+def _saved_csr_graph(graph_name: str, network_type: str) -> CSRGraph:
+    """memory-maps the routing arrays of a saved graph once per process"""
+    return Index.load_csr_graph(graph_name, network_type)
+
+
+@lru_cache(maxsize=16)
+def _saved_hierarchy(graph_name: str, network_type: str, weight: str) -> ContractionHierarchy:
+    """loads the contraction hierarchy of a saved graph once per process, None when it was never built"""
+    path = hierarchy_path(os.path.join("Graph_Network", graph_name, network_type), graph_name, weight)
+    if not os.path.exists(path):
+        return None
+    return ContractionHierarchy.load(path)
+
+
+@lru_cache(maxsize=8)
+def _saved_edge_index(graph_name: str, network_type: str) -> EdgeIndex:
+    """builds the edge snapping index of a saved graph once per process, from its stored geometries"""
+    directory = os.path.join("Graph_Network", graph_name, network_type)
+    _, arrays, _ = storage.load_arrays(storage.arrays_path(directory, graph_name))
+    return EdgeIndex.from_csr(_saved_csr_graph(graph_name, network_type), arrays["geometry_coords"], arrays["geometry_offsets"])
+
+
+@lru_cache(maxsize=8)
+def _saved_matcher(graph_name: str, network_type: str, radius: float, sigma: float) -> MapMatcher:
+    """the map matcher of a saved graph, kept per process so its shortest-path cache serves every trace"""
+    return MapMatcher(_saved_csr_graph(graph_name, network_type), _saved_edge_index(graph_name, network_type), radius=radius, sigma=sigma)
+
+
+def _snapped_length(csr: CSRGraph, edges: EdgeIndex, origin: tuple, destination: tuple, weight: str, hierarchy=None) -> float:
+    """route length in meters between two points snapped onto their nearest edges, -1 when there is no route"""
+    snap = edges.snap([origin[0], destination[0]], [origin[1], destination[1]])
+    if (snap.edges < 0).any():
+        return -1
+    source = (int(snap.edges[0]), float(snap.fractions[0]))
+    target = (int(snap.edges[1]), float(snap.fractions[1]))
+    if hierarchy is None:
+        cost, length, _ = csr.snapped_route(source, target, weight=weight, metric="length")
+    else:
+        # at most two nodes on each side, so four hierarchy queries cover every way in and out
+        cost, length = csr.along_edge(source, target, weight, "length")
+        arriving = csr.edge_seeds(*target, weight, "length", leaving=False)
+        for s, (s_cost, s_length) in csr.edge_seeds(*source, weight, "length", leaving=True).items():
+            for t, (t_cost, t_length) in arriving.items():
+                middle_cost, middle_length = hierarchy.query(s, t)
+                if s_cost + middle_cost + t_cost < cost:
+                    cost, length = s_cost + middle_cost + t_cost, s_length + middle_length + t_length
+    return -1 if math.isinf(cost) else length
+
+
+def _edge_bounds(graph) -> tuple:
+    """every edge's geometry in CSR order (None for straight edges) and its (west, south, east, north) bounds"""
+    csr = Index.get_csr_graph(graph)
+    geometries = csr.edge_attribute(graph, "geometry")
+    ends = np.column_stack((csr.x[csr.tails], csr.y[csr.tails], csr.x[csr.heads], csr.y[csr.heads]))
+    bounds = np.column_stack((
+        np.minimum(ends[:, 0], ends[:, 2]), np.minimum(ends[:, 1], ends[:, 3]),
+        np.maximum(ends[:, 0], ends[:, 2]), np.maximum(ends[:, 1], ends[:, 3])))
+    curved = ~shapely.is_missing(geometries)
+    bounds[curved] = shapely.bounds(geometries[curved])
+    return geometries, bounds
+
+
+def _store_graph(graph, graph_name: str, network_type: str, fmt: str, change: dict, bbox: tuple = None, source: str = None) -> dict:
+    """writes a graph as the next version of a saved graph, see Index.save_graph
+
+    change is recorded in the history; its 'stale_weights' are the weights whose contraction hierarchies
+    are dropped, every one ('*') by default.
+    """
+    if graph is None:
+        raise ValueError("The graph object is None. Please ensure it was created successfully.")
+    if fmt not in ("binary", "graphml", "all"):
+        raise ValueError(f"Unknown graph format '{fmt}'. Options: 'binary', 'graphml', 'all'.")
+    
+    # Create directory path
+    directory = os.path.join("Graph_Network", graph_name, network_type)
+    
+    # Ensure the directory exists
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    
+    # Define file paths
+    graph_file_path = os.path.join(directory, f"{graph_name}.graphml")
+    arrays_file_path = storage.arrays_path(directory, graph_name)
+
+    # Keep what an earlier save recorded, e.g. the other format's path
+    metadata = _read_metadata(directory, graph_name)
+    formats = metadata.get("formats", {})
+    if not formats and os.path.exists(metadata.get("file_path", "")):
+        formats["graphml"] = metadata["file_path"]
+    
+    # Travel times are computed once here and stored with the graph, so loading never recomputes them
+    prepare_graph(graph, network_type)
+
+    # Save the graph
+    if fmt in ("binary", "all"):
+        storage.save_arrays(graph, arrays_file_path)
+        formats["binary"] = arrays_file_path
+    if fmt in ("graphml", "all"):
+        ox.save_graphml(graph, filepath=graph_file_path)
+        formats["graphml"] = graph_file_path
+    
+    # Hierarchies of the weights the change affected, and cached arrays, describe the graph that was just replaced
+    hierarchies = metadata.get("contraction_hierarchies", {})
+    for weight in change.get("stale_weights", ["*"]):
+        for path in glob.glob(hierarchy_path(directory, graph_name, weight)):
+            os.remove(path)
+        for name in (list(hierarchies) if weight == "*" else [weight]):
+            hierarchies.pop(name, None)
+    if not hierarchies:
+        metadata.pop("contraction_hierarchies", None)
+    _saved_csr_graph.cache_clear()
+    # diffs of only speeds and closures keep every edge in place, and so the edge index over them
+    if change["change"] != "diff" or any(change.get(key) for key in ("add_nodes", "remove_nodes", "add_edges", "remove_edges")):
+        _saved_edge_index.cache_clear()
+    _saved_hierarchy.cache_clear()
+    _saved_matcher.cache_clear()
+    
+    # Create metadata, as the next version
+    version = metadata.get("version", 0) + 1
+    now = datetime.now().isoformat()
+    metadata.update({
+        "graph_name": graph_name,
+        "network_type": network_type,
+        "file_path": formats.get("binary", graph_file_path),
+        "formats": formats,
+        "nodes": graph.number_of_nodes(),
+        "edges": graph.number_of_edges(),
+        "version": version,
+        "bbox": list(bbox or (metadata.get("bbox") if change["change"] == "diff" else None) or _node_bounds(graph)),
+        "source": source or metadata.get("source", "osm"),
+        "date_created": metadata.get("date_created", now),
+        "date_updated": now,
+    })
+    metadata.setdefault("history", []).append({"version": version, "date": now, **change})
+    
+    # Save metadata to JSON
+    _write_metadata(directory, graph_name, metadata)
+    
+    return metadata
+
+
+def _metadata_path(directory: str, graph_name: str) -> str:
+    return os.path.join(directory, f"{graph_name}_metadata.json")
+
+
+def _read_metadata(directory: str, graph_name: str) -> dict:
+    """the metadata of a saved graph, {} when it was never saved"""
+    metadata_file_path = _metadata_path(directory, graph_name)
+    if not os.path.exists(metadata_file_path):
+        return {}
+    with open(metadata_file_path) as metadata_file:
+        return json.load(metadata_file)
+
+
+def _write_metadata(directory: str, graph_name: str, metadata: dict):
+    """replaces the metadata of a saved graph, the one place it is written"""
+    with open(_metadata_path(directory, graph_name), 'w') as metadata_file:
+        json.dump(metadata, metadata_file, indent=4)
+
+
+def _saved_format(metadata: dict) -> str:
+    """the fmt that rewrites every format a graph was saved in"""
+    formats = metadata.get("formats", {})
+    return "all" if len(formats) > 1 else "graphml" if "graphml" in formats else "binary"
+
+
+def _node_bounds(graph) -> tuple:
+    """(north, south, east, west) of a graph's nodes"""
+    lats = [data["y"] for _, data in graph.nodes(data=True)]
+    lngs = [data["x"] for _, data in graph.nodes(data=True)]
+    return (max(lats), min(lats), max(lngs), min(lngs)) if lats else ()
+
+
+@lru_cache(maxsize=1)
+def _default_osrm_client() -> OSRMClient:
+    """the OSRM client Index.get_route shares when it is not given one, started on first use"""
+    return OSRMClient()
+
+
+# graphs downloaded for routing are shared by every Index that is not given its own cache
+DEFAULT_TILE_CACHE = GraphTileCache()
+
+# so are geocoding results, in memory only; pass a GeocodeCache with a path to keep them between runs
+DEFAULT_GEOCODE_CACHE = GeocodeCache(":memory:")
+
+# street data changes, so downloaded graphs and routes on them are refreshed daily; pure geometry never expires
+DEFAULT_TTLS = {
+    "get_graph": 24 * 3600,
+    "get_graph_from_points": 24 * 3600,
+    "get_graph_from_bbox": 24 * 3600,
+    "get_shortest_route": 24 * 3600,
+}
+
+# method results are shared by every Index that is not given its own cache, within about 1 GB of graphs
+DEFAULT_CACHE = MemoryCache(max_entries=4096, max_bytes=1 << 30, ttls=DEFAULT_TTLS)
+
+
+# the static methods have no instance to find metrics on, so they record in the class-wide ones
+_timed_static = timed_static(lambda: Index.metrics)
+
+
+class Index:
+    # calls of the hot methods are recorded here when it is set to a Metrics, for the static methods and
+    # every instance not given its own; None, the default, records nothing
+    metrics: Metrics = None
+
+    def __init__(
+        self,
+        tile_cache: GraphTileCache = None,
+        geocoder=None,
+        geocode_cache: GeocodeCache = None,
+        cache: MemoryCache = None,
+        reverse_geocoder=None,
+        metrics: Metrics = None,
+        geocode_rate: float = 1.0):
+
+        self.cache = cache or DEFAULT_CACHE
+        self.tile_cache = tile_cache or DEFAULT_TILE_CACHE
+        self.geocoder = geocoder or osmnx_geocoder
+        self.geocode_cache = geocode_cache or DEFAULT_GEOCODE_CACHE
+        self.reverse_geocoder = reverse_geocoder or nominatim_reverse
+        # one limiter for every geocoder request of this Index, so separate and concurrent calls share the rate
+        self.geocode_limiter = RateLimiter(geocode_rate)
+        if metrics is not None:
+            self.metrics = metrics
+
+    @property
+    def cache_scope(self) -> tuple:
+        """the sources cached results depend on besides the arguments, None for each shared default
+
+        Instances that share a method cache but download graphs or geocode through different sources
+        get their own entries in it.
+        """
+        return tuple(None if source is default else source for source, default in (
+            (self.tile_cache, DEFAULT_TILE_CACHE),
+            (self.geocoder, osmnx_geocoder),
+            (self.reverse_geocoder, nominatim_reverse)))
+
+    @timed
+    @cached
     def get_bearing(self, origin: tuple, destination: tuple) -> float:
         """returns the bearing between two lat-long points as a single value in degrees
 
@@ -40,7 +368,8 @@ class Index:
             return -1
 
 
-    @lru_cache(maxsize=None)
+    @timed
+    @cached
     def get_euclidean_distance(self, origin: tuple, destination: tuple) -> float:
         """returns the distance between two lat-long points as a single value in meters
 
@@ -59,7 +388,8 @@ class Index:
 
 
 
-    @lru_cache(maxsize=None)
+    @timed
+    @cached
     def get_great_circle_distance(self, origin: tuple, destination: tuple) -> float:
         """returns the distance between two lat-long points as a single value in meters
 
@@ -77,7 +407,8 @@ class Index:
             return -1
 
 
-    @lru_cache(maxsize=None)
+    @timed
+    @cached
     def get_distance(self, origin: tuple, destination: tuple, kind:str) -> float:
         """returns the distance between two lat-long points as a single value in meters
 
@@ -99,7 +430,75 @@ class Index:
             return -1
 
 
-    @lru_cache(maxsize=None)
+    @timed
+    def get_bearings(self, origins, destinations) -> np.ndarray:
+        """returns the bearings between pairs of lat-long points in one vectorized pass
+
+        Args:
+            origins (array-like): origin lat-long points, or a single point. example: [(37.7749, -122.4194), ...]
+            destinations (array-like): destination lat-long points, or a single point
+
+        Returns:
+            bearings (np.ndarray): the bearings in decimal degrees, -1 where a pair could not be computed
+        """
+        lat1, lon1, lat2, lon2, valid = _pairwise(origins, destinations)
+        bearings = np.asarray(ox.bearing.calculate_bearing(lat1, lon1, lat2, lon2), dtype=float)
+        return np.where(valid, bearings, -1.0)
+
+
+    @timed
+    def get_euclidean_distances(self, origins, destinations) -> np.ndarray:
+        """returns the euclidean distances between pairs of lat-long points in one vectorized pass
+
+        Args:
+            origins (array-like): origin lat-long points, or a single point. example: [(37.7749, -122.4194), ...]
+            destinations (array-like): destination lat-long points, or a single point
+
+        Returns:
+            distances (np.ndarray): the distances, -1 where a pair could not be computed
+        """
+        lat1, lon1, lat2, lon2, valid = _pairwise(origins, destinations)
+        distances = np.asarray(ox.distance.euclidean(lat1, lon1, lat2, lon2), dtype=float)
+        return np.where(valid, distances, -1.0)
+
+
+    @timed
+    def get_great_circle_distances(self, origins, destinations) -> np.ndarray:
+        """returns the great circle distances between pairs of lat-long points in one vectorized pass
+
+        Args:
+            origins (array-like): origin lat-long points, or a single point. example: [(37.7749, -122.4194), ...]
+            destinations (array-like): destination lat-long points, or a single point
+
+        Returns:
+            distances (np.ndarray): the distances in meters, -1 where a pair could not be computed
+        """
+        lat1, lon1, lat2, lon2, valid = _pairwise(origins, destinations)
+        distances = np.asarray(ox.distance.great_circle(lat1, lon1, lat2, lon2, earth_radius=6371009), dtype=float)
+        return np.where(valid, distances, -1.0)
+
+
+    @timed
+    def get_distances(self, origins, destinations, kind:str) -> np.ndarray:
+        """returns the distances between pairs of lat-long points in one vectorized pass
+
+        Args:
+            origins (array-like): origin lat-long points, or a single point. example: [(37.7749, -122.4194), ...]
+            destinations (array-like): destination lat-long points, or a single point
+            kind (str): the kind of distance to calculate. options: 'euclidean', 'great_circle'
+
+        Returns:
+            distances (np.ndarray): the distances in meters, -1 where a pair could not be computed. like the other
+                batch methods it raises ValueError for an unknown kind or origins and destinations of different lengths
+        """
+        if kind == 'euclidean':
+            return self.get_euclidean_distances(origins, destinations)
+        elif kind == 'great_circle':
+            return self.get_great_circle_distances(origins, destinations)
+        raise ValueError(f"Unknown distance kind '{kind}'. Options: 'euclidean', 'great_circle'.")
+
+
+    @cached
     def get_center(self, origin:tuple, destination:tuple) -> tuple:
         """returns the center of two lat-long points
 
@@ -115,9 +514,9 @@ class Index:
         return (latitude_center, longitude_center)
 
 
-    @lru_cache(maxsize=None)
+    @timed
     def geocode(self, place_name:str) -> tuple:
-        """returns the latitude and longitude of a place name
+        """returns the latitude and longitude of a place name, from the geocode cache when it is there
 
         Args:
             place_name (str): the name of the place. example: 'San Francisco, California'
@@ -125,14 +524,96 @@ class Index:
         Returns:
             location (tuple): the latitude and longitude of the place. example: (37.7749, -122.4194)
         """
+        return self.geocode_many([place_name])[0]
+
+
+    @timed
+    def geocode_many(self, place_names: list, rate: float = None, max_concurrency: int = 4) -> list:
+        """returns the latitude and longitude of every place name, geocoding each distinct place at most once
+
+        Cached places are answered straight away and the rest are sent to the geocoder concurrently,
+        within the Index's geocode_rate across all its calls, then cached for next time.
+
+        Args:
+            place_names (list): the names of the places. example: ['San Francisco, California', ...]
+            rate (float): optional requests per second for this call alone instead of the Index's shared limit,
+                0 for no limit
+            max_concurrency (int): the most geocoder requests in flight at once
+
+        Returns:
+            locations (list): the latitude and longitude of every place in input order, () where it was not found
+        """
+        try:
+            limiter = self.geocode_limiter if rate is None else None
+            return geocode_many(
+                place_names, self.geocoder, self.geocode_cache, rate=rate, max_concurrency=max_concurrency, limiter=limiter)
+        except Exception as e:
+            logging.error(f"Failed to geocode {len(place_names)} places : {e}")
+            return [() for _ in place_names]
+
+
+    @timed
+    def reverse_geocode(self, point: tuple, graph=None, max_distance: float = 100, remote: bool = False) -> dict:
+        """returns the nearest named street to a lat-long point
+
+        Args:
+            point (tuple): lat-long point. example: (37.7749, -122.4194)
+            graph (object): street network to look the point up in, e.g. from load_graph
+            max_distance (float): how far from the point a street may be, in meters
+            remote (bool): ask the reverse geocoder (Nominatim by default) when the graph has no street in range
+
+        Returns:
+            street (dict): {'name', 'highway', 'location', 'distance', 'edge'}, {} when no street was found
+        """
+        return self.reverse_geocode_many([point], graph, max_distance=max_distance, remote=remote)[0]
+
+
+    @timed
+    def reverse_geocode_many(self, points, graph=None, max_distance: float = 100, remote: bool = False, rate: float = None) -> list:
+        """returns the nearest named street to every lat-long point, resolved in one batch from the graph's street index
+
+        Args:
+            points (array-like): lat-long points, a list of tuples or an (N, 2) array
+            graph (object): street network to look the points up in, e.g. from load_graph
+            max_distance (float): how far from a point a street may be, in meters
+            remote (bool): ask the reverse geocoder for points the graph has no street in range for
+            rate (float): optional remote requests per second for this call alone instead of the Index's shared
+                geocode_rate limit, which forward and reverse lookups count against together
+
+        Returns:
+            streets (list): {'name', 'highway', 'location', 'distance', 'edge'} per point, {} where none was found
+                or the point was invalid. 'edge' is the (u, v, key) of the street's edge in the graph
+        """
         try:
-            return ox.geocoder.geocode(place_name)
+            points, valid = _as_points(points)
+            streets = [{} for _ in range(len(points))]
+            if graph is not None:
+                found = self.get_street_index(graph).lookup(points[valid, 0], points[valid, 1], max_distance=max_distance)
+                for position, street in zip(np.flatnonzero(valid).tolist(), found):
+                    streets[position] = street
+            if remote:
+                limiter = self.geocode_limiter if rate is None else RateLimiter(rate)
+                for position in np.flatnonzero(valid).tolist():
+                    if not streets[position]:
+                        try:
+                            limiter.wait()
+                            streets[position] = self.reverse_geocoder(*points[position]) or {}
+                        except Exception as e:
+                            logging.error(f"Failed to reverse geocode {tuple(points[position])} : {e}")
+            return streets
         except Exception as e:
-            logging.error(f"Failed to geocode {place_name} : {e}")
-            return ()
+            logging.error(f"Failed to reverse geocode {len(points)} points : {e}")
+            return [{} for _ in range(len(points))]
+
+
+    @staticmethod
+    def get_street_index(graph) -> StreetIndex:
+        """returns the reverse geocoding index over a graph's named streets, built on first use and kept until the graph is dropped"""
+        return derived(graph, "street_index", lambda G: StreetIndex(G, Index.get_csr_graph(G)))
 
 
-    @lru_cache(maxsize=None)
+    @timed
+    @cached
     def get_graph(self, place_name:str, network_type:str, kind:str = "address") -> object:
         """returns the street network for a place
 
@@ -145,15 +626,16 @@ class Index:
         """
         try:
             if kind == "address":
-                return ox.graph_from_address(place_name, network_type=network_type)
+                return prepare_graph(ox.graph_from_address(place_name, network_type=network_type), network_type)
             elif kind == "place":
-                return ox.graph_from_place(place_name, network_type=network_type)
+                return prepare_graph(ox.graph_from_place(place_name, network_type=network_type), network_type)
         except Exception as e:
             logging.error(f"Error while retrieving Graph for {place_name}: {e}")
             return None
 
 
-    @lru_cache(maxsize=None)
+    @timed
+    @cached
     def get_graph_from_points(self, points: list[tuple], network_type:str, mode:str) -> object:
         """returns the street network for a place
 
@@ -175,19 +657,20 @@ class Index:
                 # Calculate the radius from the center to the farthest point
                 radius = max(ox.utils.euclidean_dist_vec(center_point[0], center_point[1], point[0], point[1]) for point in points)
                 # Retrieve the graph from point with the specified radius and network type
-                return ox.graph_from_point(center_point, dist=radius, network_type=mode)
+                return prepare_graph(ox.graph_from_point(center_point, dist=radius, network_type=mode), mode)
             elif network_type == "bbox":
                 # Calculate the bounding box from the points
                 north, south = max(point[0] for point in points), min(point[0] for point in points)
                 east, west = max(point[1] for point in points), min(point[1] for point in points)
                 # Retrieve the graph from the bounding box and network type
-                return ox.graph_from_bbox(north, south, east, west, network_type=mode)
+                return prepare_graph(graph_from_bbox(north, south, east, west, network_type=mode), mode)
         except Exception as e:
             logging.error(f"Error occurred while getting graph from points: {e}")
             return None
 
 
-    @lru_cache(maxsize=None)
+    @timed
+    @cached
     def get_graph_from_bbox(self, north:float, south:float, east:float, west:float, network_type:str="drive") -> object:
         """returns the street network for a place
 
@@ -202,13 +685,14 @@ class Index:
             G (object): the street network object
         """
         try:
-            return ox.graph_from_bbox(north, south, east, west, network_type=network_type)
+            return prepare_graph(graph_from_bbox(north, south, east, west, network_type=network_type), network_type)
         except Exception as e:
             logging.error(f"Error occurred while getting graph from bbox: {e}")
             return None
 
-    @lru_cache(maxsize=None)
-    def get_shortest_route(self, origin: tuple, destination:tuple, mode:str, weight:str) -> any:
+    @timed
+    @cached
+    def get_shortest_route(self, origin: tuple, destination:tuple, mode:str, weight:str, method:str = "bidirectional") -> any:
         """returns the shortest route between two lat-long points
 
         Args:
@@ -216,35 +700,106 @@ class Index:
             destination (tuple): destination lat-long point example: (37.7749, -122.4194)
             mode (str): the type of street network to retrieve. options: 'drive', 'walk', 'bike', 'all'
             weight (str): 'time', 'length', 'cost', 'speed', 'elevation'
+            method (str): the search to run on the graph's CSR arrays. options: 'bidirectional', 'astar'
 
         Returns:
             route (list): the shortest route as a list of lat-long points
         """
         try:
-            G = ox.graph_from_point(
-                self.get_center(
-                    origin=origin,
-                    destination=destination),
-                dist=self.get_distance(
-                    origin=origin,
-                    destination=destination,
-                    kind='great_circle'),
-                network_type=mode)
-
-            node_point1=ox.nearest_nodes(G,origin[1],origin[0])
-            node_point2=ox.nearest_nodes(G,destination[1],destination[0])
-            return G, ox.shortest_path(G, node_point1, node_point2, weight=weight)
+            G = self._graph_around(origin, destination, mode)
+            node_point1, node_point2 = self.get_node_index(G).nearest(
+                [origin[0], destination[0]], [origin[1], destination[1]]).tolist()
+            attribute = WEIGHT_ATTRIBUTES.get(weight, weight)
+            csr = self.get_csr_graph(G, attribute)
+            _, path = csr.shortest_path(csr.node_index[node_point1], csr.node_index[node_point2], weight=attribute, method=method)
+            return G, None if path is None else csr.nodes[path].tolist()
         except Exception as e:
             logging.error(f"Error occurred while getting shortest distance from {origin}, to {destination}: {e}")
             return None, None
 
 
+    def _graph_around(self, origin: tuple, destination: tuple, mode: str) -> object:
+        """returns a cached graph covering two points with room for detours"""
+        # leave as much room for detours as the old radius around the center did
+        span = max(abs(origin[0] - destination[0]), abs(origin[1] - destination[1]))
+        return prepare_graph(self.tile_cache.graph_for([origin, destination], network_type=mode, buffer=max(span / 2, 0.005)), mode)
+
+
+    @staticmethod
+    def get_csr_graph(graph, weight:str = "length") -> CSRGraph:
+        """returns the CSR routing arrays of a graph, built on first use and kept until the graph is dropped
+
+        Args:
+            graph (object): the street network object
+            weight (str): the edge attribute that will be routed on. example: 'length', 'travel_time'
+
+        Returns:
+            csr (CSRGraph): the routing arrays of the graph
+        """
+        if weight in ROUTING_ATTRIBUTES:
+            return derived(graph, "csr", CSRGraph.from_graph)
+        return derived(graph, ("csr", weight), lambda G: CSRGraph.from_graph(G, attributes=ROUTING_ATTRIBUTES + (weight,)))
+
+
+    @staticmethod
+    def get_node_index(graph) -> NodeIndex:
+        """returns the spatial index over a graph's nodes, built on first use and kept until the graph is dropped
+
+        Args:
+            graph (object): the street network object
+
+        Returns:
+            index (NodeIndex): nearest, k-nearest, radius and bounding box queries over the graph's nodes
+        """
+        return derived(graph, "node_index", NodeIndex.from_graph)
+
+
+    @staticmethod
+    def get_edge_index(graph) -> EdgeIndex:
+        """returns the R-tree over a graph's edge segments, built on first use and kept until the graph is dropped
+
+        Args:
+            graph (object): the street network object
+
+        Returns:
+            index (EdgeIndex): snaps points onto the nearest edge, with edges numbered as in get_csr_graph(graph)
+        """
+        return derived(graph, "edge_index", lambda G: EdgeIndex.from_graph(G, Index.get_csr_graph(G)))
+
+
+    @staticmethod
+    @_timed_static
+    def snap_to_roads(graph, points, max_distance: float = None) -> tuple:
+        """
+        Static method to move a batch of lat-long points onto the nearest point of the nearest road, e.g. to clean up a GPS trace.
+
+        Parameters:
+        - graph: The street network object.
+        - points: Lat-long points, a list of tuples or an (N, 2) array.
+        - max_distance: Optional search radius in meters. Points with no road inside it are left unsnapped.
+
+        Returns:
+        - snapped: (N, 2) array of snapped lat-long points, NaN where a point was invalid or not snapped.
+        - distances: (N,) meters each point moved, -1 where it was invalid or not snapped.
+        """
+        points, valid = _as_points(points)
+        snap = Index.get_edge_index(graph).snap(points[valid, 0], points[valid, 1], max_distance=max_distance)
+        snapped = np.full((len(points), 2), np.nan)
+        distances = np.full(len(points), -1.0)
+        snapped[valid] = np.column_stack((snap.lats, snap.lngs))
+        distances[valid] = np.where(snap.edges >= 0, snap.distances, -1.0)
+        return snapped, distances
+
+
+    @timed
     def get_road_distance(
         self,
         origin: tuple,
         destination:tuple,
         mode:str,
-        weight:str) -> float:
+        weight:str,
+        graph_name:str = None,
+        snap:str = "node") -> float:
 
         """returns the distance between two lat-long points by following roads
 
@@ -253,10 +808,45 @@ class Index:
             destination (tuple): destination lat-long point example: (37.7749, -122.4194)
             mode (str): the type of street network to retrieve. options: 'drive', 'walk', 'bike', 'all'
             weight (str): 'time', 'length', 'cost', 'speed', 'elevation'
+            graph_name (str): optional saved graph under Graph_Network/<graph_name>/<mode> to route on instead of
+                downloading one. its contraction hierarchy for the weight is used when one was built
+            snap (str): 'node' to start and end at the nearest intersections, 'edge' to start and end at the nearest
+                point on the nearest road, counting only the part of the first and last edge actually driven
 
         Returns:
             distance (float): the distance in meters
         """
+        if snap not in ("node", "edge"):
+            logging.error(f"Unknown snap '{snap}'. Options: 'node', 'edge'.")
+            return -1
+
+        attribute = WEIGHT_ATTRIBUTES.get(weight, weight)
+        if graph_name is not None:
+            try:
+                csr = _saved_csr_graph(graph_name, mode)
+                if snap == "edge":
+                    return _snapped_length(
+                        csr, _saved_edge_index(graph_name, mode), origin, destination, attribute,
+                        hierarchy=_saved_hierarchy(graph_name, mode, attribute))
+                source, target = csr.nearest_nodes([origin[0], destination[0]], [origin[1], destination[1]]).tolist()
+                hierarchy = _saved_hierarchy(graph_name, mode, attribute)
+                if hierarchy is not None:
+                    cost, length = hierarchy.query(source, target)
+                    return -1 if math.isinf(cost) else length
+                _, path = csr.shortest_path(source, target, weight=attribute)
+                return -1 if path is None else csr.path_metric(path, attribute, "length")
+            except Exception as e:
+                logging.error(f"Error occurred while routing on saved graph {graph_name}/{mode}: {e}")
+                return -1
+
+        if snap == "edge":
+            try:
+                G = self._graph_around(origin, destination, mode)
+                return _snapped_length(self.get_csr_graph(G, attribute), self.get_edge_index(G), origin, destination, attribute)
+            except Exception as e:
+                logging.error(f"Error occurred while getting road distance from {origin}, to {destination}: {e}")
+                return -1
+
         G, shortest_path = self.get_shortest_route(origin, destination, mode, weight)
         if shortest_path is None:
             return -1
@@ -267,75 +857,650 @@ class Index:
             total_distance += G[u][v][0]['length']
 
         return total_distance
+
+
+    @timed
+    def get_distance_matrix(
+        self,
+        origins: list,
+        destinations: list,
+        mode:str,
+        weight:str = "length",
+        graph:object = None) -> tuple:
+
+        """returns the road distance and travel time matrices between every origin and destination
+
+        All points share one graph: either the one passed in or a single download covering every point.
+        Each point is snapped to its nearest node once and one compiled shortest-path tree is grown per
+        distinct origin node, so the cost grows with the number of origins rather than the number of pairs.
+
+        Args:
+            origins (list): origin lat-long points. example: [(37.7749, -122.4194), ...]
+            destinations (list): destination lat-long points. example: [(37.7749, -122.4194), ...]
+            mode (str): the type of street network to retrieve. options: 'drive', 'walk', 'bike', 'all'
+            weight (str): the cost the routes minimize. options: 'length', 'time'
+            graph (object): optional street network object to route on instead of downloading one
+
+        Returns:
+            distances (np.ndarray): (len(origins), len(destinations)) matrix of route lengths in meters
+            durations (np.ndarray): matching matrix of travel times in seconds. both are -1 where no route exists
+        """
+        try:
+            points = list(origins) + list(destinations)
+            G = self._graph_covering(points, mode) if graph is None else prepare_graph(graph, mode)
+            nodes = self.get_node_index(G).nearest([point[0] for point in points], [point[1] for point in points])
+            csr = self.get_csr_graph(G)
+            indices = csr.indices_of(nodes)
+            costs, sums = csr.cost_matrix(
+                sources=indices[:len(origins)],
+                targets=indices[len(origins):],
+                weight=WEIGHT_ATTRIBUTES.get(weight, weight))
+
+            unreachable = np.isinf(costs)
+            distances = np.where(unreachable, -1.0, sums["length"])
+            durations = np.where(unreachable, -1.0, sums["travel_time"])
+            return distances, durations
+        except Exception as e:
+            logging.error(f"Error occurred while building distance matrix: {e}")
+            return None, None
+
+
+    def _graph_covering(self, points: list, mode: str) -> object:
+        """downloads one prepared graph covering every point, with a margin for routes that leave their bounds"""
+        lats = [point[0] for point in points]
+        lngs = [point[1] for point in points]
+        buffer = max(0.01, 0.1 * max(max(lats) - min(lats), max(lngs) - min(lngs)))
+        G = self.get_graph_from_bbox(
+            north=max(lats) + buffer,
+            south=min(lats) - buffer,
+            east=max(lngs) + buffer,
+            west=min(lngs) - buffer,
+            network_type=mode)
+        if G is None:
+            raise ValueError("no graph covering the points could be retrieved")
+        return prepare_graph(G, mode)
+
+
+    @timed
+    def optimize_route(
+        self,
+        depot: tuple,
+        stops: list,
+        mode: str = "drive",
+        weight: str = "time",
+        capacities: list = None,
+        demands: list = None,
+        time_windows: list = None,
+        service_times: list = None,
+        graph: object = None,
+        time_budget: float = 2.0) -> dict:
+
+        """orders stops into delivery tours that start and end at a depot, e.g. one van's round or a fleet's day
+
+        The depot and stops are snapped to their nearest nodes and the matrix of costs between all of them is
+        computed once, one shortest-path tree per point. The tours are then built on the matrix alone, by
+        nearest insertion improved with 2-opt and Or-opt moves for at most time_budget seconds (see
+        tours.solve_tours), and each tour's legs are finally routed for its node path. 500 stops take seconds.
+
+        Args:
+            depot (tuple): lat-long point the tours start and end at. example: (37.7749, -122.4194)
+            stops (list): lat-long points to visit. example: [(37.7749, -122.4194), ...]
+            mode (str): the type of street network to retrieve. options: 'drive', 'walk', 'bike', 'all'
+            weight (str): the cost the tours minimize. options: 'time', 'length'
+            capacities (list): the load each vehicle carries, one tour per vehicle. one vehicle without a limit by default
+            demands (list): the load of every stop, counted against capacities
+            time_windows (list): (earliest, latest) arrival at every stop in seconds after leaving the depot, None
+                for a stop without one. a list one longer starts with the depot's (departure, latest return)
+            service_times (list): the seconds spent at every stop
+            graph (object): optional street network object to route on instead of downloading one
+            time_budget (float): the seconds the tours may be improved for
+
+        Returns:
+            tours (dict): 'routes', one per vehicle with its 'stops' (indices into stops, in visiting order), 'path'
+                (node ids from depot back to depot), 'distance' (meters), 'duration' (seconds driving), 'load' and
+                'arrivals' (when each stop is served, in seconds after leaving the depot as time_windows are);
+                'unassigned' (stops no vehicle can serve) and the totals 'distance' and 'duration'. {} on failure
+        """
+        try:
+            points = [tuple(depot)] + [tuple(stop) for stop in stops]
+            G = self._graph_covering(points, mode) if graph is None else prepare_graph(graph, mode)
+            attribute = WEIGHT_ATTRIBUTES.get(weight, weight)
+            csr = self.get_csr_graph(G, attribute)
+            indices = csr.indices_of(self.get_node_index(G).nearest([point[0] for point in points], [point[1] for point in points]))
+            costs, sums = csr.cost_matrix(sources=indices, targets=indices, weight=attribute)
+            solution = solve_tours(
+                costs,
+                durations=np.where(np.isinf(costs), np.inf, sums["travel_time"]),
+                demands=demands,
+                capacities=capacities,
+                windows=time_windows,
+                service_times=service_times,
+                time_budget=time_budget)
+
+            service = np.zeros(len(points)) if service_times is None else np.concatenate(([0.0], service_times))
+            routes = []
+            for vehicle, route in enumerate(solution["routes"]):
+                tour = [0] + route + [0]
+                path = [indices[0]]
+                for a, b in zip(tour, tour[1:]):
+                    if indices[a] != indices[b]:
+                        path += csr.shortest_path(indices[a], indices[b], weight=attribute)[1][1:]
+                legs = sums["travel_time"][tour[:-1], tour[1:]]
+                if solution["starts"] is not None:
+                    arrivals = solution["starts"][vehicle]
+                else:
+                    # no windows, so no waiting: each stop is reached after the legs and service before it
+                    arrivals = np.cumsum(legs[:-1] + service[tour[:-2]]).tolist()
+                routes.append({
+                    "stops": [stop - 1 for stop in route],
+                    "path": csr.nodes[path].tolist(),
+                    "distance": float(sums["length"][tour[:-1], tour[1:]].sum()),
+                    "duration": float(legs.sum()),
+                    "load": float(sum(demands[stop - 1] for stop in route)) if demands is not None else 0.0,
+                    "arrivals": arrivals,
+                })
+            return {
+                "routes": routes,
+                "unassigned": [stop - 1 for stop in solution["unassigned"]],
+                "distance": sum(route["distance"] for route in routes),
+                "duration": sum(route["duration"] for route in routes),
+            }
+        except Exception as e:
+            logging.error(f"Error occurred while optimizing a route over {len(stops)} stops: {e}")
+            return {}
+
+
+    @timed
+    def match_trace(
+        self,
+        trace,
+        mode: str = "drive",
+        graph: object = None,
+        graph_name: str = None,
+        radius: float = SEARCH_RADIUS,
+        sigma: float = GPS_SIGMA) -> dict:
+
+        """returns the roads a noisy GPS trace was driven on and the distance actually travelled along them
+
+        The pings are matched with a hidden Markov model decoded by Viterbi a window at a time (see
+        matching.MapMatcher): candidates come from the edge index and the routes between them from bounded
+        shortest-path trees, cached per graph, so later traces over the same streets reuse them.
+
+        Args:
+            trace (list): lat-long pings in time order, or an (N, 2) array. example: [(37.7749, -122.4194), ...]
+            mode (str): the type of street network to retrieve. options: 'drive', 'walk', 'bike', 'all'
+            graph (object): optional street network object to match on instead of downloading one
+            graph_name (str): optional saved graph under Graph_Network/<graph_name>/<mode> to match on instead
+            radius (float): meters from a ping its candidate roads may be
+            sigma (float): the GPS error in meters
+
+        Returns:
+            match (dict): 'edges' (the (u, v, key) edges driven, in order), 'distance' (meters driven from the first
+                matched ping to the last), 'points' ((N, 2) matched lat-longs, NaN where no road was in range) and
+                'breaks' (the pings where no route joined the match to the one before, which restarted there).
+                {} on failure
+        """
+        try:
+            points = np.asarray(trace, dtype=float).reshape(-1, 2)
+            if graph_name is not None:
+                matcher = _saved_matcher(graph_name, mode, radius, sigma)
+            else:
+                G = self._graph_covering(points.tolist(), mode) if graph is None else graph
+                # kept with the routing arrays, so whatever changes those drops it too
+                matcher = derived(G, ("csr", "map_matcher", radius, sigma), lambda G: MapMatcher(
+                    self.get_csr_graph(G), self.get_edge_index(G), radius=radius, sigma=sigma))
+            return match_to_ids(matcher.csr, matcher.match(points[:, 0], points[:, 1]))
+        except Exception as e:
+            logging.error(f"Error occurred while matching a trace of {len(trace)} points: {e}")
+            return {}
+
+
+    @timed
+    def get_isochrones(
+        self,
+        origin: tuple,
+        thresholds: list,
+        mode: str,
+        weight: str = "time",
+        graph: object = None,
+        buffer: float = 50) -> dict:
+
+        """returns what can be reached from a lat-long point within each of several costs, from one bounded search
+
+        The origin is snapped to its nearest node and a single search runs out to the largest threshold. Every
+        threshold then reads its nodes and area off the same costs. The area covers the reached stretch of each
+        road, edges only partly reached included, buffered by some meters, traced as a filled contour of a raster
+        of the costs so every threshold comes out of one pass.
+
+        Args:
+            origin (tuple): origin lat-long point. example: (37.7749, -122.4194)
+            thresholds (list): the costs to reach within, seconds for 'time' and meters for 'length'. example: [600, 1200, 1800]
+            mode (str): the type of street network to retrieve. options: 'drive', 'walk', 'bike', 'all'
+            weight (str): the cost the thresholds are in. options: 'time', 'length'
+            graph (object): optional street network object to search instead of downloading one around the origin
+            buffer (float): meters on each side of the reached roads the areas cover
+
+        Returns:
+            isochrones (dict): {threshold: {"nodes": np.ndarray of node ids, "polygon": lng-lat shapely geometry}},
+                {} if the search failed
+        """
+        isochrones = self.get_isochrones_many([origin], thresholds, mode, weight=weight, graph=graph, buffer=buffer)
+        return isochrones[0] if isochrones else {}
+
+
+    @timed
+    def get_isochrones_many(
+        self,
+        origins: list,
+        thresholds: list,
+        mode: str,
+        weight: str = "time",
+        graph: object = None,
+        buffer: float = 50,
+        chunk_size: int = 64) -> list:
+
+        """returns the isochrones of many lat-long points, searching a chunk of origins at a time on one graph
+
+        Args:
+            origins (list): origin lat-long points. example: [(37.7749, -122.4194), ...]
+            thresholds (list): the costs to reach within, seconds for 'time' and meters for 'length'
+            mode (str): the type of street network to retrieve. options: 'drive', 'walk', 'bike', 'all'
+            weight (str): the cost the thresholds are in. options: 'time', 'length'
+            graph (object): optional street network object covering every origin, downloaded when not given
+            buffer (float): meters on each side of the reached roads the areas cover
+            chunk_size (int): how many searches to hold in memory at once
+
+        Returns:
+            isochrones (list): one get_isochrones result per origin, {} for invalid points, [] if the search failed
+        """
+        try:
+            points, valid = _as_points(origins)
+            attribute = WEIGHT_ATTRIBUTES.get(weight, weight)
+            thresholds = sorted(float(threshold) for threshold in thresholds)
+            G = graph if graph is not None else self._graph_within_reach(points[valid], thresholds[-1], mode, attribute)
+            if G is None:
+                raise ValueError("no graph covering the origins could be retrieved")
+
+            prepare_graph(G, mode)
+
+            csr = self.get_csr_graph(G, attribute)
+            sources = csr.nearest_nodes(points[valid, 0], points[valid, 1])
+            isochrones = [{} for _ in range(len(points))]
+            rows = np.flatnonzero(valid)
+            for start in range(0, len(sources), chunk_size):
+                costs = csr.bounded_costs(sources[start:start + chunk_size], thresholds[-1], attribute)
+                for row, row_costs in zip(rows[start:start + chunk_size], costs):
+                    lats, lngs, sample_costs = reach_samples(csr, row_costs, thresholds[-1], attribute, spacing=buffer / 2)
+                    polygons = reach_polygons(lats, lngs, sample_costs, thresholds, buffer)
+                    isochrones[row] = {
+                        threshold: {"nodes": csr.nodes[row_costs <= threshold], "polygon": polygons[threshold]}
+                        for threshold in thresholds
+                    }
+            return isochrones
+        except Exception as e:
+            logging.error(f"Error occurred while computing isochrones: {e}")
+            return []
+
+
+    def _graph_within_reach(self, points: np.ndarray, limit: float, mode: str, attribute: str) -> object:
+        """downloads a graph covering everything within a cost of the points, at the fastest speed of the mode"""
+        meters = limit if attribute == "length" else limit * REACH_SPEEDS.get(mode, REACH_SPEEDS["drive"])
+        lat_buffer = meters / METERS_PER_DEGREE
+        lng_buffer = lat_buffer / max(0.01, math.cos(math.radians(float(np.abs(points[:, 0]).max()))))
+        return self.get_graph_from_bbox(
+            north=float(points[:, 0].max()) + lat_buffer,
+            south=float(points[:, 0].min()) - lat_buffer,
+            east=float(points[:, 1].max()) + lng_buffer,
+            west=float(points[:, 1].min()) - lng_buffer,
+            network_type=mode)
     
     
     @staticmethod
-    def save_graph(graph, graph_name: str, network_type: str) -> dict:
+    def prepare_graph(graph, network_type: str, profile: dict = None, overwrite: bool = False):
+        """
+        Static method to add speed_kph and travel_time (seconds) to every edge, in one vectorized pass.
+        Graphs from get_graph*, load_graph and the tile cache are prepared already, and save_graph stores the results.
+
+        Parameters:
+        - graph: The street network object, changed in place.
+        - network_type: The type of network (e.g., 'walk', 'drive'), which picks the speed profile in SPEED_PROFILES.
+        - profile: Optional {highway type: km/h} to use instead, with a 'default' entry for other types.
+        - overwrite: Recompute edges that already have a travel time, e.g. after changing a profile.
+
+        Returns:
+        - graph: The same graph.
+        """
+        return prepare_graph(graph, network_type, profile=profile, overwrite=overwrite)
+
+
+    @staticmethod
+    @_timed_static
+    def save_graph(graph, graph_name: str, network_type: str, fmt: str = "binary", bbox: tuple = None, source: str = None) -> dict:
         """
         Static method to save graph to local memory in directory <network_type>/graph_name
-        and create a metadata file.
+        and create or update its metadata file. Every save is a new version of the graph, recorded in the metadata's history.
 
         Parameters:
         - graph: The graph to be saved.
         - graph_name: The name of the graph file (without extension).
         - network_type: The type of network (e.g., 'walk', 'drive').
+        - fmt: 'binary' for memory-mappable CSR arrays, 'graphml' for interop, or 'all' for both.
+        - bbox: The (north, south, east, west) area the graph covers, by default the bounds of its nodes.
+        - source: Where the graph came from, e.g. 'osm' (the default) or the name of a data vendor.
+
+        Returns:
+        - metadata: The metadata written next to the graph, with its version, bbox, source and history.
+        """
+        return _store_graph(graph, graph_name, network_type, fmt, {"change": "save"}, bbox=bbox, source=source)
+
+
+    @staticmethod
+    @_timed_static
+    def apply_graph_diff(graph_name: str, network_type: str, diff: dict, profile: dict = None) -> dict:
+        """
+        Static method to apply a diff (added or removed nodes and edges, speed changes, closures) to a saved graph as a new version, without downloading it again.
+        Only what the diff affects is invalidated: a speed change keeps the contraction hierarchy by length, for example.
+        The diff itself is appended to <graph_name>_changes.jsonl next to the graph.
+
+        Parameters:
+        - graph_name: The name of the graph file (without extension).
+        - network_type: The type of network (e.g., 'walk', 'drive').
+        - diff: The changes, see versions.apply_diff. Example: {'speeds': [(12, 13, 20)], 'close': [(13, 14)]}.
+        - profile: Optional {highway type: km/h} for the travel times of added edges.
+
+        Returns:
+        - metadata: The updated metadata; its history ends with what the diff changed.
         """
-        if graph is None:
-            raise ValueError("The graph object is None. Please ensure it was created successfully.")
-        
-        # Create directory path
         directory = os.path.join("Graph_Network", graph_name, network_type)
-        
-        # Ensure the directory exists
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        
-        # Define file paths
-        graph_file_path = os.path.join(directory, f"{graph_name}.graphml")
-        metadata_file_path = os.path.join(directory, f"{graph_name}_metadata.json")
-        
-        # Save the graph
-        ox.save_graphml(graph, filepath=graph_file_path)
-        
-        # Create metadata
-        metadata = {
-            "graph_name": graph_name,
-            "network_type": network_type,
-            "file_path": graph_file_path,
-            "date_created": datetime.now().isoformat()
-        }
-        
-        # Save metadata to JSON
-        with open(metadata_file_path, 'w') as metadata_file:
-            json.dump(metadata, metadata_file, indent=4)
-        
+        metadata = _read_metadata(directory, graph_name)
+        graph = Index.load_graph(graph_name, network_type)
+        summary = apply_diff(graph, diff, network_type, profile=profile)
+        metadata = _store_graph(graph, graph_name, network_type, _saved_format(metadata), {"change": "diff", **summary})
+        with open(os.path.join(directory, f"{graph_name}_changes.jsonl"), "a") as changes_file:
+            changes_file.write(json.dumps({"version": metadata["version"], "date": metadata["date_updated"], "diff": diff}, default=str) + "\n")
         return metadata
-    
+
 
     @staticmethod
-    def load_graph(graph_name: str, network_type: str):
+    @_timed_static
+    def refresh_graph(graph_name: str, network_type: str, bbox: tuple = None, tile_size: float = 0.05, workers: int = 8, loader=None) -> dict:
+        """
+        Static method to download a saved graph's area again as a new version, as tiles fetched in parallel and merged.
+        The history records how many nodes and edges changed since the previous version.
+
+        Parameters:
+        - graph_name: The name of the graph file (without extension).
+        - network_type: The type of network (e.g., 'walk', 'drive').
+        - bbox: The (north, south, east, west) area to download, by default the one recorded in the metadata.
+        - tile_size: The tile edge length in degrees.
+        - workers: How many tiles are downloaded at once.
+        - loader: Optional loader(north, south, east, west, network_type) -> graph, osmnx by default.
+
+        Returns:
+        - metadata: The updated metadata.
+        """
+        directory = os.path.join("Graph_Network", graph_name, network_type)
+        metadata = _read_metadata(directory, graph_name)
+        bbox = tuple(bbox or metadata.get("bbox") or ())
+        if len(bbox) != 4:
+            raise ValueError(f"No bbox was given or recorded for '{graph_name}', pass one to refresh it.")
+
+        graph = Index.get_subgraph(
+            fetch_bbox(*bbox, network_type, tile_size=tile_size, workers=workers, loader=loader),
+            bbox=bbox, edges="touching", output="graph")
+        prepare_graph(graph, network_type)
+        change = {"change": "refresh"}
+        if metadata.get("formats"):
+            diff = diff_graphs(Index.load_graph(graph_name, network_type), graph)
+            change.update({key: len(diff[key]) for key in diff})
+        return _store_graph(graph, graph_name, network_type, _saved_format(metadata), change, bbox=bbox)
+
+
+    @staticmethod
+    @_timed_static
+    def load_graph(graph_name: str, network_type: str, fmt: str = None):
         """
         Static method to load a graph from local memory from directory <network_type>/graph_name
         
         Parameters:
         - graph_name: The name of the graph file (without extension).
         - network_type: The type of network (e.g., 'walk', 'drive').
+        - fmt: 'binary' or 'graphml'. By default the binary arrays are used when they exist.
 
         Returns:
         - graph: The loaded graph object.
         """
         directory = os.path.join("Graph_Network", graph_name, network_type)
         graph_file_path = os.path.join(directory, f"{graph_name}.graphml")
-        
-        if not os.path.exists(graph_file_path):
-            raise FileNotFoundError(f"The graph file '{graph_file_path}' does not exist.")
-        graph = ox.load_graphml(filepath=graph_file_path)
-        
+        arrays_file_path = storage.arrays_path(directory, graph_name)
+
+        if fmt is None:
+            fmt = "binary" if os.path.exists(arrays_file_path) else "graphml"
+        if fmt == "binary":
+            graph = storage.arrays_to_graph(*storage.load_arrays(arrays_file_path))
+        else:
+            if not os.path.exists(graph_file_path):
+                raise FileNotFoundError(f"The graph file '{graph_file_path}' does not exist.")
+            graph = ox.load_graphml(filepath=graph_file_path)
+
+        # graphs saved before travel times were stored get them here, in memory only
+        prepare_graph(graph, network_type)
+
+        # build the spatial index once here so snapping and extraction never scan the nodes
+        Index.get_node_index(graph)
         return graph
+
+
+    @staticmethod
+    @_timed_static
+    def load_csr_graph(graph_name: str, network_type: str) -> CSRGraph:
+        """
+        Static method to open the routing arrays of a graph saved in the binary format, without building a networkx graph.
+        The arrays are memory-mapped, so opening is near-instant and processes loading the same graph share its pages.
+
+        Parameters:
+        - graph_name: The name of the graph file (without extension).
+        - network_type: The type of network (e.g., 'walk', 'drive').
+
+        Returns:
+        - csr: The CSRGraph of the saved graph.
+        """
+        directory = os.path.join("Graph_Network", graph_name, network_type)
+        csr = storage.arrays_to_csr(*storage.load_arrays(storage.arrays_path(directory, graph_name)))
+        csr.spatial_index  # build the snapping index up front, like load_graph does
+        return csr
     
     
     @staticmethod
-    def visualize_network(graph,  file_name: str="graph_visualization", output_dir: str="samples"):
+    def build_contraction_hierarchy(graph_name: str, network_type: str, weight: str = "length", benchmark_queries: int = 200) -> dict:
+        """
+        Static method to preprocess a saved graph into a contraction hierarchy, stored next to the graph.
+        get_road_distance(..., graph_name=graph_name) picks it up for the same weight.
+
+        Parameters:
+        - graph_name: The name of the saved graph (saved with the binary format).
+        - network_type: The type of network (e.g., 'walk', 'drive').
+        - weight: The weight the hierarchy minimizes ('length' or 'time').
+        - benchmark_queries: How many random queries to time against plain Dijkstra, 0 to skip.
+
+        Returns:
+        - report: Preprocessing time, index size, shortcut count and query latencies, also recorded in the metadata.
+        """
+        directory = os.path.join("Graph_Network", graph_name, network_type)
+        attribute = WEIGHT_ATTRIBUTES.get(weight, weight)
+        csr = Index.load_csr_graph(graph_name, network_type)
+
+        start = time.perf_counter()
+        hierarchy = build_contraction_hierarchy(csr, attribute)
+        report = {"weight": attribute, "preprocessing_seconds": time.perf_counter() - start}
+        if benchmark_queries:
+            report.update(benchmark(csr, hierarchy, queries=benchmark_queries))
+        else:
+            report.update({"index_bytes": hierarchy.nbytes, "shortcuts": hierarchy.shortcut_count})
+
+        path = hierarchy_path(directory, graph_name, attribute)
+        hierarchy.save(path)
+        report["file_path"] = path
+        _saved_hierarchy.cache_clear()
+
+        metadata = _read_metadata(directory, graph_name)
+        metadata.setdefault("contraction_hierarchies", {})[attribute] = report
+        _write_metadata(directory, graph_name, metadata)
+
+        return report
+
+
+    @staticmethod
+    @_timed_static
+    def route_many(graph_name: str, network_type: str, pairs, weight: str = "length", workers: int = None):
+        """
+        Static method to route many origin/destination pairs on a saved graph in parallel, over a pool of worker processes.
+        Each worker memory-maps the graph's binary arrays once (and its contraction hierarchy for the weight, when built).
+
+        Parameters:
+        - graph_name: The name of the saved graph (saved in the binary format).
+        - network_type: The type of network (e.g., 'walk', 'drive').
+        - pairs: (origin, destination) lat-long pairs.
+        - weight: 'length' or 'time'.
+        - workers: How many processes to use, one per core by default.
+
+        Yields:
+        - (distance, duration): Meters and seconds per pair in input order, -1 where there is no route.
+        """
+        with RoutingPool(graph_name, network_type, WEIGHT_ATTRIBUTES.get(weight, weight), workers) as pool:
+            yield from pool.routes(pairs)
+
+
+    @staticmethod
+    @_timed_static
+    def stream_distance_matrix(graph_name: str, network_type: str, origins: list, destinations: list, weight: str = "length", workers: int = None):
+        """
+        Static method to compute a distance matrix on a saved graph in parallel, streaming it back one origin row at a time.
+
+        Parameters:
+        - graph_name: The name of the saved graph (saved in the binary format).
+        - network_type: The type of network (e.g., 'walk', 'drive').
+        - origins, destinations: Lists of lat-long points.
+        - weight: 'length' or 'time'.
+        - workers: How many processes to use, one per core by default.
+
+        Yields:
+        - (distances, durations): One row of meters and seconds per origin in input order, -1 where there is no route.
+        """
+        with RoutingPool(graph_name, network_type, WEIGHT_ATTRIBUTES.get(weight, weight), workers) as pool:
+            yield from pool.matrix_rows(origins, destinations)
+
+
+    @staticmethod
+    @_timed_static
+    def match_traces(graph_name: str, network_type: str, traces, workers: int = None, radius: float = SEARCH_RADIUS, sigma: float = GPS_SIGMA):
+        """
+        Static method to map-match many GPS traces on a saved graph in parallel, over a pool of worker processes.
+        Each worker builds the edge index once and keeps its shortest-path cache across all the traces it matches.
+
+        Parameters:
+        - graph_name: The name of the saved graph (saved in the binary format).
+        - network_type: The type of network (e.g., 'walk', 'drive').
+        - traces: One list or (N, 2) array of lat-long pings per trace, in time order.
+        - workers: How many processes to use, one per core by default.
+        - radius: Meters from a ping its candidate roads may be.
+        - sigma: The GPS error in meters.
+
+        Yields:
+        - match: One match_trace result per trace, in input order.
+        """
+        with RoutingPool(graph_name, network_type, workers=workers) as pool:
+            yield from pool.match_traces(traces, radius=radius, sigma=sigma)
+
+
+    @timed
+    def route_trips(
+        self,
+        input_path: str,
+        output_path: str,
+        mode: str,
+        weight: str = "length",
+        graph_name: str = None,
+        columns: tuple = TRIP_COLUMNS,
+        chunk_size: int = 100_000,
+        workers: int = None,
+        progress=log_progress) -> dict:
+
+        """routes every trip in a CSV or Parquet file, streaming the results to another file with flat memory use
+
+        Rows are read chunk_size at a time, grouped by the tiles of their origin and destination so each
+        group routes on one graph, and appended to the output in input order with 'distance' (meters) and
+        'duration' (seconds) columns, -1 where there is no route or a point is invalid.
+
+        Args:
+            input_path (str): the trips file, CSV or Parquet (.parquet, .pq, needs pyarrow)
+            output_path (str): the results file, CSV or Parquet by extension, overwritten
+            mode (str): the type of street network. options: 'drive', 'walk', 'bike', 'all'
+            weight (str): the cost the routes minimize. options: 'length', 'time'
+            graph_name (str): optional saved graph under Graph_Network/<graph_name>/<mode> to route on over a pool
+                of worker processes, instead of graphs from the tile cache
+            columns (tuple): the origin lat, origin lng, destination lat and destination lng column names
+            chunk_size (int): how many rows are held in memory at a time
+            workers (int): how many processes route on the saved graph, one per core by default
+            progress (callable): progress(report) after every chunk, logs rows/s by default
+
+        Returns:
+            report (dict): rows, chunks, unrouted, seconds and rows_per_second, {} if the job failed
+        """
+        attribute = WEIGHT_ATTRIBUTES.get(weight, weight)
+        try:
+            if graph_name is None:
+                return route_file(
+                    input_path, output_path,
+                    lambda origins, destinations: self._route_pairs(origins, destinations, mode, attribute),
+                    columns=columns, chunk_size=chunk_size, tile_size=self.tile_cache.tile_size, progress=progress)
+
+            with RoutingPool(graph_name, mode, attribute, workers) as pool:
+                def route(origins, destinations):
+                    routes = np.array(list(pool.routes(np.stack((origins, destinations), axis=1))), dtype=float)
+                    return routes[:, 0], routes[:, 1]
+                return route_file(
+                    input_path, output_path, route,
+                    columns=columns, chunk_size=chunk_size, tile_size=self.tile_cache.tile_size, progress=progress)
+        except Exception as e:
+            logging.error(f"Error occurred while routing trips from {input_path}: {e}")
+            return {}
+
+
+    def _route_pairs(self, origins: np.ndarray, destinations: np.ndarray, mode: str, attribute: str) -> tuple:
+        """routes (N, 2) arrays of origins and destinations on tile cache graphs, one graph per tile group
+
+        The trips come in tile_order from route_file, which sorts each chunk once, so the groups are contiguous.
+        """
+        distances = np.full(len(origins), -1.0)
+        durations = np.full(len(origins), -1.0)
+        starts = tile_groups(origins, destinations, self.tile_cache.tile_size)
+        for start, end in zip(starts[:-1], starts[1:]):
+            group = np.arange(start, end)
+            try:
+                # leave as much room for detours as _graph_around does for its longest trip
+                span = np.abs(origins[group] - destinations[group]).max()
+                G = self.tile_cache.graph_for(
+                    np.concatenate((origins[group], destinations[group])).tolist(),
+                    network_type=mode, buffer=max(span / 2, 0.005))
+                csr = self.get_csr_graph(prepare_graph(G, mode), attribute)
+
+                sources = csr.nearest_nodes(origins[group, 0], origins[group, 1]).tolist()
+                targets = csr.nearest_nodes(destinations[group, 0], destinations[group, 1]).tolist()
+                routes = {}
+                for row, source, target in zip(group, sources, targets):
+                    if (source, target) not in routes:
+                        _, path = csr.shortest_path(source, target, weight=attribute)
+                        routes[source, target] = (-1.0, -1.0) if path is None else (
+                            csr.path_metric(path, attribute, "length"), csr.path_metric(path, attribute, "travel_time"))
+                    distances[row], durations[row] = routes[source, target]
+            except Exception as e:
+                logging.error(f"Error occurred while routing {len(group)} trips near {tuple(origins[group[0]])}: {e}")
+        return distances, durations
+
+
+    @staticmethod
+    def visualize_network(graph,  file_name: str="graph_visualization", output_dir: str="samples", layout: str = "spring", size: int = 1200):
         """
         Visualize the network graph using networkx and matplotlib, save it to a file, and return the file path.
 
@@ -343,6 +1508,10 @@ class Index:
         - graph: The network graph to be visualized (a networkx.Graph or similar object).
         - file_name: The name of the file to save the visualization (with extension).
         - output_dir: The directory where the file will be saved.
+        - layout: 'spring' to lay the nodes out with networkx and label them, which suits small graphs only.
+          'geographic' to draw every edge at its stored coordinates as one line collection in web mercator,
+          simplified to the image's resolution, which draws city graphs in seconds.
+        - size: The longer side of a geographic image in pixels.
 
         Returns:
         - file_path: The path to the saved visualization file.
@@ -350,7 +1519,9 @@ class Index:
         # Check if the graph is valid
         if graph is None or len(graph.nodes) == 0:
             raise ValueError("The graph object is None or empty. Please ensure it was loaded successfully.")
-        
+        if layout not in ("spring", "geographic"):
+            raise ValueError(f"Unknown layout '{layout}'. Options: 'spring', 'geographic'.")
+
         # Convert graph to networkx if it's not already
         if isinstance(graph, nx.MultiGraph) or isinstance(graph, nx.Graph):
             G = graph
@@ -364,7 +1535,12 @@ class Index:
         
         # Define the file path
         file_path = os.path.join(output_dir, file_name)
-        
+
+        if layout == "geographic":
+            render_image(Index.get_edge_segments(G), file_path, size=size, title='Network Visualization')
+            print(f"Graph visualization saved to {file_path}")
+            return file_path
+
         # Draw the network
         plt.figure(figsize=(12, 12))
         pos = nx.spring_layout(G, k=0.15, iterations=20)  # Adjust layout parameters as needed
@@ -379,40 +1555,64 @@ class Index:
         return file_path
 
 
+    @staticmethod
+    def get_edge_segments(graph) -> np.ndarray:
+        """
+        Static method to get the straight segments of every edge geometry, for drawing.
+        A two-way street stored as two mirrored edges appears once. They come from the graph's edge index.
+
+        Parameters:
+        - graph: The street network object.
+
+        Returns:
+        - segments: (S, 2, 2) array of lng-lat segment ends.
+        """
+        edges = Index.get_edge_index(graph)
+        return np.stack((edges.starts, edges.ends), axis=1)
+
 
     @staticmethod
-    def get_route(start_coords, end_coords):
+    def render_tiles(graph, north: float, south: float, east: float, west: float, zooms, output_dir: str = "tiles",
+                     workers: int = None, line_width: float = 1.0, color: str = "black") -> dict:
         """
-        Get route information from OSRM using HTTPX.
+        Static method to draw transparent XYZ map tiles of a graph's streets for a bounding box, in parallel.
+        The tiles go to <output_dir>/<zoom>/<x>/<y>.png, ready to serve as a slippy map overlay.
+        Tiles that no street crosses are not written.
+
+        Parameters:
+        - graph: The street network object.
+        - north, south, east, west: The bounding box to cover.
+        - zooms: The zoom levels to draw, e.g. range(12, 17).
+        - output_dir: The directory the tile tree is written to.
+        - workers: How many processes draw tiles, one per core by default.
+        - line_width: Line width in pixels.
+        - color: Line color.
+
+        Returns:
+        - report: A dict with the tiles written, the empty tiles skipped and the seconds taken.
+        """
+        return render_tiles(
+            Index.get_edge_segments(graph), north, south, east, west, zooms, output_dir,
+            workers=workers, line_width=line_width, color=color)
+
+
+    @staticmethod
+    def get_route(start_coords, end_coords, client: OSRMClient = None):
+        """
+        Get route information from OSRM.
 
         Parameters:
         - start_coords: Tuple of (latitude, longitude) for the start point.
         - end_coords: Tuple of (latitude, longitude) for the end point.
+        - client: Optional OSRMClient, e.g. OSRMClient(base_url="http://localhost:5000") for a local server.
+          By default a shared client for the public OSRM server is used, which keeps its connections open between calls.
 
         Returns:
         - distance: The distance of the route in meters.
         - duration: The estimated travel time in seconds.
         """
-        osrm_url = (
-            "http://router.project-osrm.org/route/v1/driving/"
-            f"{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}"
-            "?overview=false"
-        )
-
-        async def fetch_route():
-            async with httpx.AsyncClient() as client:
-                response = await client.get(osrm_url)
-                response.raise_for_status()
-                data = response.json()
-                routes = data.get('routes', [])
-                if routes:
-                    distance = routes[0]['distance']  # Distance in meters
-                    duration = routes[0]['duration']  # Duration in seconds
-                    return distance, duration
-                else:
-                    return None, None
-
-        distance, duration = asyncio.run(fetch_route())
+        client = client or _default_osrm_client()
+        distance, duration = client.route(start_coords, end_coords)
 
         return distance, duration
     
@@ -427,13 +1627,91 @@ class Index:
         - north, south, east, west: Bounding box coordinates defining the area of interest.
 
         Returns:
-        - subgraph: The extracted subgraph within the specified bounding box.
+        - subgraph: The extracted subgraph within the specified bounding box, an independent copy.
+          Use get_subgraph for a view or compact arrays instead.
         """
-        nodes_within_bbox = [
-            node for node, data in graph.nodes(data=True)
-            if (south <= data['y'] <= north) and (west <= data['x'] <= east)
-        ]
-        
-        subgraph = graph.subgraph(nodes_within_bbox).copy()
-        
-        return subgraph
+        return Index.get_subgraph(graph, bbox=(north, south, east, west), output="graph")
+
+
+    @staticmethod
+    @_timed_static
+    def get_subgraph(graph, bbox: tuple = None, polygon=None, route=None, buffer: float = 100, edges: str = "inside", output: str = "view"):
+        """
+        Static method to extract the part of a graph inside a bounding box, a polygon or a corridor along a route.
+        Nodes are found through the graph's spatial index, and nothing is copied unless asked for.
+
+        Parameters:
+        - graph: The original network graph.
+        - bbox: A (north, south, east, west) bounding box.
+        - polygon: A shapely Polygon or MultiPolygon in lng-lat coordinates.
+        - route: Node ids of the graph (as get_shortest_route returns) or lat-long points, extracted with a buffer.
+        - buffer: Width in meters of the corridor on each side of the route.
+        - edges: Which edges to keep. 'inside' keeps edges with both ends in the region. 'touching' also keeps
+          edges with one end in it, together with their outside ends. 'crossing' also keeps edges that pass
+          through the region with both ends outside it.
+        - output: 'view' for a read-only networkx view of the original graph, 'graph' for an independent copy,
+          'csr' for compact routing arrays (a CSRGraph) holding only the region.
+
+        Returns:
+        - subgraph: The extracted region in the requested form, or None if the arguments are invalid.
+        """
+        if sum(region is not None for region in (bbox, polygon, route)) != 1:
+            logging.error("Pass exactly one of bbox, polygon or route.")
+            return None
+        if edges not in ("inside", "touching", "crossing"):
+            logging.error(f"Unknown edges '{edges}'. Options: 'inside', 'touching', 'crossing'.")
+            return None
+        if output not in ("view", "graph", "csr"):
+            logging.error(f"Unknown output '{output}'. Options: 'view', 'graph', 'csr'.")
+            return None
+
+        index = Index.get_node_index(graph)
+        if bbox is not None:
+            north, south, east, west = bbox
+            inside = index.positions_in_bbox(north, south, east, west)
+            polygon = shapely.box(west, south, east, north)
+        else:
+            if route is not None:
+                points = [(graph.nodes[point]["y"], graph.nodes[point]["x"]) if np.isscalar(point) else point for point in route]
+                polygon = corridor([point[0] for point in points], [point[1] for point in points], buffer)
+            inside = index.positions_in_polygon(polygon)
+
+        if edges == "inside" and output != "csr":
+            view = graph.subgraph(index.nodes[inside].tolist())
+            return view if output == "view" else view.copy()
+
+        # node positions in the spatial index and the CSR arrays are both in graph order
+        csr = Index.get_csr_graph(graph)
+        member = np.zeros(csr.node_count, dtype=bool)
+        member[inside] = True
+        if edges == "inside":
+            kept = member[csr.tails] & member[csr.heads]
+        else:
+            kept = member[csr.tails] | member[csr.heads]
+        if edges == "crossing":
+            geometries, bounds = derived(graph, "edge_bounds", _edge_bounds)
+            west, south, east, north = shapely.bounds(polygon)
+            candidates = np.flatnonzero(
+                ~kept & (bounds[:, 0] <= east) & (bounds[:, 2] >= west) & (bounds[:, 1] <= north) & (bounds[:, 3] >= south))
+            geometries = geometries[candidates]
+            straight = np.flatnonzero(shapely.is_missing(geometries))
+            tails, heads = csr.tails[candidates[straight]], csr.heads[candidates[straight]]
+            geometries[straight] = shapely.linestrings(
+                np.stack((np.column_stack((csr.x[tails], csr.y[tails])), np.column_stack((csr.x[heads], csr.y[heads]))), axis=1))
+            shapely.prepare(polygon)
+            kept[candidates[shapely.intersects(polygon, geometries)]] = True
+
+        nodes = np.union1d(inside, np.concatenate((csr.tails[kept], csr.heads[kept])))
+        if output == "csr":
+            return csr.subgraph(nodes, kept)
+
+        node_set = set(csr.nodes[nodes].tolist())
+        edge_set = set(zip(csr.nodes[csr.tails[kept]].tolist(), csr.nodes[csr.heads[kept]].tolist(), csr.keys[kept].tolist()))
+        if not graph.is_directed():
+            edge_set |= {(v, u, key) for u, v, key in edge_set}
+        view = nx.subgraph_view(graph, filter_node=node_set.__contains__, filter_edge=lambda u, v, key: (u, v, key) in edge_set)
+        return view if output == "view" else view.copy()
+
+
+# imported last, as it builds on Index
+from .aio import AsyncIndex
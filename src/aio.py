@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import functools
+import concurrent.futures
+
+import httpx
+import numpy as np
+
+from . import Index
+from .geocoding import AsyncRateLimiter, nominatim_search, normalize_place
+from .osrm import AsyncOSRMClient
+
+
+class AsyncIndex:
+    """awaitable facade over an Index for code running on an event loop, e.g. a FastAPI or uvicorn service
+
+    Geocoding and OSRM requests go out on httpx's async client and never hold the loop. Graph downloads
+    (osmnx only has a blocking client) and the routing on them run on a thread pool, and a tile several
+    threads need at once is downloaded once. Concurrent identical calls share one in-flight computation,
+    whose graphs and results land in the wrapped Index's caches for the calls after it.
+
+    Create it on the loop it is used from, and close it (or use it as an async context manager) when done.
+
+    Args:
+        index (Index): the Index whose caches and settings are used, a new one by default
+        max_workers (int): threads for the blocking work. example: 4
+        osrm (AsyncOSRMClient): client for route(), the public OSRM server by default
+        geocoder (callable): async geocoder(place_name) -> (lat, long), or None when the place does not exist.
+            Nominatim's search API by default
+        geocode_rate (float): the most geocoder requests started per second. Nominatim allows 1, 0 for no limit
+        max_concurrency (int): the most geocoder requests in flight at once
+    """
+
+    def __init__(
+        self,
+        index: Index = None,
+        max_workers: int = None,
+        osrm: AsyncOSRMClient = None,
+        geocoder=None,
+        geocode_rate: float = 1.0,
+        max_concurrency: int = 4):
+
+        self.index = index or Index()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="async-index")
+        self.osrm = osrm or AsyncOSRMClient()
+        self.geocoder = geocoder or self._nominatim
+        self.max_concurrency = max_concurrency
+        self._limiter = AsyncRateLimiter(geocode_rate)
+        self._slots = None
+        self._client = None
+        self._inflight = {}
+
+
+    async def __aenter__(self) -> "AsyncIndex":
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+    async def aclose(self):
+        """closes the HTTP connections and stops the worker threads once their current work is done"""
+        await self.osrm.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self.executor.shutdown(wait=False)
+
+
+    async def run(self, method: str, *args, **kwargs):
+        """runs any Index method on the worker threads, sharing the result with concurrent identical calls
+
+        Args:
+            method (str): the name of the Index method. example: 'get_isochrones'
+            *args, **kwargs: its arguments
+
+        Returns:
+            result: what the method returns
+        """
+        call = functools.partial(getattr(self.index, method), *args, **kwargs)
+        return await self._coalesced(_call_key(method, args, kwargs), lambda: asyncio.get_running_loop().run_in_executor(self.executor, call))
+
+
+    async def geocode(self, place_name: str) -> tuple:
+        """returns the latitude and longitude of a place name, () when it was not found
+
+        Args:
+            place_name (str): the name of the place. example: 'San Francisco, California'
+
+        Returns:
+            location (tuple): the latitude and longitude of the place. example: (37.7749, -122.4194)
+        """
+        return (await self.geocode_many([place_name]))[0]
+
+
+    async def geocode_many(self, place_names: list) -> list:
+        """returns the latitude and longitude of every place name, geocoding each distinct place at most once
+
+        Places in the Index's geocode cache are answered from it and the rest are requested concurrently,
+        within the rate limit, then cached. A place another call is already geocoding is waited for.
+
+        Args:
+            place_names (list): the names of the places. example: ['San Francisco, California', ...]
+
+        Returns:
+            locations (list): the latitude and longitude of every place in input order, () where it was not found
+        """
+        keys = [normalize_place(name) if isinstance(name, str) else None for name in place_names]
+        distinct = list(dict.fromkeys(key for key in keys if key))
+        cache = self.index.geocode_cache
+        results = {}
+        if cache is not None and distinct:
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(self.executor, cache.get_many, distinct)
+            except Exception as e:
+                logging.error(f"Failed to read the geocode cache : {e}")
+
+        misses = [key for key in distinct if key not in results]
+        if misses:
+            # geocode the first spelling seen for each key, the way the caller wrote it
+            spelling = {}
+            for name, key in zip(place_names, keys):
+                if key:
+                    spelling.setdefault(key, name)
+            found = await asyncio.gather(
+                *(self._coalesced(("geocode", key), functools.partial(self._lookup, spelling[key])) for key in misses),
+                return_exceptions=True)
+            fresh = {}
+            for key, location in zip(misses, found):
+                if isinstance(location, Exception):
+                    logging.error(f"Failed to geocode {spelling[key]} : {location}")
+                else:
+                    fresh[key] = tuple(location) if location is not None else None
+            if cache is not None and fresh:
+                await asyncio.get_running_loop().run_in_executor(self.executor, cache.put_many, fresh)
+            results.update(fresh)
+
+        return [(results.get(key) or ()) if key else () for key in keys]
+
+
+    async def route(self, origin: tuple, destination: tuple) -> tuple:
+        """returns the (distance, duration) of the fastest OSRM route between two lat-long points, see Index.get_route
+
+        Returns:
+            distance (float): the distance of the route in meters, None when OSRM found no route
+            duration (float): the estimated travel time in seconds, None when OSRM found no route
+        """
+        key = ("route", tuple(origin), tuple(destination))
+        return await self._coalesced(key, lambda: self.osrm.route(origin, destination))
+
+
+    async def get_shortest_route(self, origin: tuple, destination: tuple, mode: str, weight: str, method: str = "bidirectional") -> tuple:
+        """awaitable Index.get_shortest_route, returning the graph and the route's node ids"""
+        return await self.run("get_shortest_route", origin, destination, mode, weight, method=method)
+
+
+    async def get_road_distance(self, origin: tuple, destination: tuple, mode: str, weight: str, graph_name: str = None, snap: str = "node") -> float:
+        """awaitable Index.get_road_distance, the distance in meters between two lat-long points following roads, -1 on failure"""
+        return await self.run("get_road_distance", origin, destination, mode, weight, graph_name=graph_name, snap=snap)
+
+
+    async def get_distance_matrix(self, origins: list, destinations: list, mode: str, weight: str = "length", graph: object = None) -> tuple:
+        """awaitable Index.get_distance_matrix, the (distances, durations) matrices between every origin and destination"""
+        return await self.run("get_distance_matrix", origins, destinations, mode, weight=weight, graph=graph)
+
+
+    async def _coalesced(self, key, start):
+        """awaits start() once for all concurrent callers with the same key, or on its own when key is None
+
+        The shared computation is shielded, so a caller that is cancelled (a client hanging up) does not
+        cancel it for the others.
+        """
+        if key is None:
+            return await start()
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(start())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._inflight.pop(key) if self._inflight.get(key) is done else None)
+        return await asyncio.shield(task)
+
+
+    async def _lookup(self, place_name: str) -> tuple:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        async with self._slots:
+            await self._limiter.wait()
+            return await self.geocoder(place_name)
+
+
+    async def _nominatim(self, place_name: str) -> tuple:
+        if self._client is None:
+            self._client = httpx.AsyncClient()
+        return await nominatim_search(self._client, place_name)
+
+
+def _call_key(method: str, args: tuple, kwargs: dict):
+    """the key identical calls share, None when an argument cannot be compared (they then run on their own)"""
+    try:
+        key = (method, _frozen(args), tuple(sorted((name, _frozen(value)) for name, value in kwargs.items())))
+        hash(key)
+        return key
+    except TypeError:
+        return None
+
+
+def _frozen(value):
+    """a hashable stand-in for an argument: points in lists, tuples and arrays compare by value, graphs by identity"""
+    if isinstance(value, np.ndarray):
+        return ("array", value.dtype.str, value.shape, value.tobytes())
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(item) for item in value)
+    return value
@@ -0,0 +1,181 @@
+import os
+import math
+import concurrent.futures
+
+import numpy as np
+
+from . import storage
+from .ch import ContractionHierarchy, hierarchy_path
+from .matching import GPS_SIGMA, SEARCH_RADIUS, MapMatcher, match_to_ids
+from .spatial import EdgeIndex
+
+
+# the saved graph each worker process routes on, opened once by _load_worker
+_worker = {}
+
+
+def _load_worker(directory: str, graph_name: str, weight: str):
+    """process pool initializer: memory-maps the saved graph, so every worker shares the same pages"""
+    csr = storage.arrays_to_csr(*storage.load_arrays(storage.arrays_path(directory, graph_name)))
+    path = hierarchy_path(directory, graph_name, weight)
+    _worker.update(
+        directory=directory,
+        graph_name=graph_name,
+        csr=csr,
+        weight=weight,
+        hierarchy=ContractionHierarchy.load(path) if os.path.exists(path) else None,
+        timed=not np.isnan(csr.weights["travel_time"]).all())
+
+
+def _route_chunk(sources: list, targets: list) -> tuple:
+    """routes one chunk of (source, target) node index pairs in a worker, -1 where there is no route"""
+    csr, weight, hierarchy, timed = _worker["csr"], _worker["weight"], _worker["hierarchy"], _worker["timed"]
+    distances, durations = [], []
+    for source, target in zip(sources, targets):
+        if hierarchy is not None:
+            path = hierarchy.path(source, target)
+        else:
+            _, path = csr.shortest_path(source, target, weight=weight)
+        if path is None:
+            distances.append(-1.0)
+            durations.append(-1.0)
+            continue
+        distances.append(csr.path_metric(path, weight, "length"))
+        durations.append(csr.path_metric(path, weight, "travel_time") if timed else -1.0)
+    return distances, durations
+
+
+def _matrix_chunk(sources: list, targets: list) -> tuple:
+    """computes a block of matrix rows in a worker, -1 where there is no route"""
+    csr, weight, timed = _worker["csr"], _worker["weight"], _worker["timed"]
+    costs, sums = csr.cost_matrix(sources, targets, weight=weight)
+    unreachable = np.isinf(costs)
+    durations = np.where(unreachable, -1.0, sums["travel_time"]) if timed else np.full(costs.shape, -1.0)
+    return np.where(unreachable, -1.0, sums["length"]), durations
+
+
+def _match_chunk(traces: list, radius: float, sigma: float) -> list:
+    """matches one chunk of GPS traces in a worker, whose matcher and its shortest-path cache outlive the chunk"""
+    key = ("matcher", radius, sigma)
+    if key not in _worker:
+        if "edge_index" not in _worker:
+            _, arrays, _ = storage.load_arrays(storage.arrays_path(_worker["directory"], _worker["graph_name"]))
+            _worker["edge_index"] = EdgeIndex.from_csr(_worker["csr"], arrays["geometry_coords"], arrays["geometry_offsets"])
+        _worker[key] = MapMatcher(_worker["csr"], _worker["edge_index"], radius=radius, sigma=sigma)
+    matcher = _worker[key]
+    return [match_to_ids(matcher.csr, match) for match in matcher.match_many(traces)]
+
+
+class RoutingPool:
+    """process pool that routes batches on one saved graph, each worker opening the graph once
+
+    Workers memory-map the graph's binary arrays (and its contraction hierarchy for the weight, when one
+    was built), so the operating system shares one copy of the graph between all of them. Points are
+    snapped once in the calling process and only node indices cross the process boundary, in chunks.
+
+    Args:
+        graph_name (str): the saved graph under Graph_Network/<graph_name>/<network_type>
+        network_type (str): the type of network. example: 'walk', 'drive'
+        weight (str): the edge attribute the routes minimize. example: 'length', 'travel_time'
+        workers (int): how many processes to start, one per core by default
+    """
+
+    def __init__(self, graph_name: str, network_type: str, weight: str = "length", workers: int = None):
+        self.directory = os.path.abspath(os.path.join("Graph_Network", graph_name, network_type))
+        self.graph_name = graph_name
+        self.weight = weight
+        self.workers = workers or os.cpu_count() or 1
+        self.csr = storage.arrays_to_csr(*storage.load_arrays(storage.arrays_path(self.directory, graph_name)))
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_load_worker,
+            initargs=(self.directory, graph_name, weight))
+
+
+    def __enter__(self) -> "RoutingPool":
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def close(self):
+        """stops the worker processes"""
+        self._pool.shutdown(cancel_futures=True)
+
+
+    def routes(self, pairs, chunk_size: int = 256):
+        """routes every (origin, destination) pair, yielding results in input order as chunks complete
+
+        Args:
+            pairs (iterable): (origin, destination) lat-long pairs, or an (N, 2, 2) array. example: [((-6.80, 39.28), (-6.79, 39.29)), ...]
+            chunk_size (int): how many pairs a worker routes per task
+
+        Yields:
+            route (tuple): (distance in meters, duration in seconds) per pair, -1 where there is no route
+                or, for the duration, where the graph has no travel times
+        """
+        points = np.asarray(pairs if isinstance(pairs, np.ndarray) else list(pairs), dtype=float).reshape(-1, 2)
+        if not len(points):
+            return
+        nodes = self.csr.nearest_nodes(points[:, 0], points[:, 1])
+        sources, targets = nodes[0::2].tolist(), nodes[1::2].tolist()
+        starts = range(0, len(sources), chunk_size)
+        chunks = self._pool.map(
+            _route_chunk,
+            [sources[i:i + chunk_size] for i in starts],
+            [targets[i:i + chunk_size] for i in starts])
+        for distances, durations in chunks:
+            yield from zip(distances, durations)
+
+
+    def matrix_rows(self, origins: list, destinations: list, chunk_size: int = None):
+        """computes the distance and duration matrices a block of origins at a time, yielding rows in order
+
+        Args:
+            origins (list): origin lat-long points. example: [(37.7749, -122.4194), ...]
+            destinations (list): destination lat-long points
+            chunk_size (int): how many origins a worker handles per task, enough to give every worker a few by default
+
+        Yields:
+            row (tuple): (distances, durations) arrays for one origin, -1 where there is no route
+        """
+        origins, destinations = list(origins), list(destinations)
+        if not origins:
+            return
+        nodes = self.csr.nearest_nodes(
+            [point[0] for point in origins + destinations], [point[1] for point in origins + destinations])
+        sources, targets = nodes[:len(origins)].tolist(), nodes[len(origins):].tolist()
+        chunk_size = chunk_size or max(1, min(64, math.ceil(len(sources) / (4 * self.workers))))
+        starts = range(0, len(sources), chunk_size)
+        blocks = self._pool.map(_matrix_chunk, [sources[i:i + chunk_size] for i in starts], [targets] * len(starts))
+        for distances, durations in blocks:
+            yield from zip(distances, durations)
+
+
+    def match_traces(self, traces, chunk_size: int = 8, radius: float = SEARCH_RADIUS, sigma: float = GPS_SIGMA):
+        """matches GPS traces to the roads driven, see MapMatcher, yielding results in input order as chunks complete
+
+        Each worker builds the edge index once and keeps its matcher, so the shortest-path trees it caches
+        serve every later trace over the same streets.
+
+        Args:
+            traces (iterable): one (N, 2) array or list of lat-long pings per trace, in time order
+            chunk_size (int): how many traces a worker matches per task
+            radius (float): meters from a ping its candidate roads may be
+            sigma (float): the GPS error in meters
+
+        Yields:
+            match (dict): per trace, 'edges' as (u, v, key), 'distance' in meters, 'points' (the matched lat-long of
+                every ping, NaN where no road was in range) and 'breaks' (the pings where the match restarted)
+        """
+        traces = [np.asarray(trace, dtype=float).reshape(-1, 2) for trace in traces]
+        starts = range(0, len(traces), chunk_size)
+        chunks = self._pool.map(
+            _match_chunk,
+            [traces[i:i + chunk_size] for i in starts],
+            [radius] * len(starts),
+            [sigma] * len(starts))
+        for matches in chunks:
+            yield from matches
@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+import numpy as np
+import networkx as nx
+
+from . import Index
+from .cache import MemoryCache
+from .metrics import percentiles
+from .spatial import great_circle
+from .speeds import prepare_graph
+from .tiles import GraphTileCache
+
+
+# every benchmark, in the order they run; run_benchmarks(cases=[...]) picks a subset
+CASES = (
+    "great_circle_scalar",
+    "great_circle_batch",
+    "load_graph",
+    "nearest_nodes",
+    "snap_to_roads",
+    "road_distance",
+    "distance_matrix",
+    "subgraph_view",
+    "subgraph_graph",
+    "subgraph_csr",
+    "map_match",
+)
+
+
+def grid_graph(rows: int = 100, cols: int = 100, spacing: float = 0.001, origin: tuple = (-6.80, 39.28), arterial_every: int = 10) -> nx.MultiDiGraph:
+    """builds an offline street network shaped like a grid, two-way residential streets with a primary every few blocks
+
+    Args:
+        rows, cols (int): the grid's size in intersections. example: 100 x 100 is 10,000 nodes and 39,600 edges
+        spacing (float): degrees between neighbouring intersections
+        origin (tuple): lat-long of the south west corner
+        arterial_every (int): every this many rows and columns is a primary road
+
+    Returns:
+        graph (nx.MultiDiGraph): the street network, lengths in meters
+    """
+    ids = np.arange(rows * cols).reshape(rows, cols)
+    lats = origin[0] + np.repeat(np.arange(rows), cols) * spacing
+    lngs = origin[1] + np.tile(np.arange(cols), rows) * spacing
+    tails = np.concatenate((ids[:, :-1].ravel(), ids[:-1, :].ravel()))
+    heads = np.concatenate((ids[:, 1:].ravel(), ids[1:, :].ravel()))
+    along_row = np.arange(len(tails)) < rows * (cols - 1)
+    lengths = great_circle(lats[tails], lngs[tails], lats[heads], lngs[heads])
+    lines = np.where(along_row, tails // cols, tails % cols)
+
+    graph = nx.MultiDiGraph(crs="epsg:4326")
+    graph.add_nodes_from((node, {"y": lat, "x": lng, "street_count": 4}) for node, lat, lng in zip(range(rows * cols), lats.tolist(), lngs.tolist()))
+    for u, v, row, line, length in zip(tails.tolist(), heads.tolist(), along_row.tolist(), lines.tolist(), lengths.tolist()):
+        data = {
+            "length": length,
+            "name": f"{'Row' if row else 'Column'} {line}",
+            "highway": "primary" if line % arterial_every == 0 else "residential",
+            "oneway": False,
+            "osmid": u * 100_000 + v,
+        }
+        graph.add_edge(u, v, key=0, **data)
+        graph.add_edge(v, u, key=0, **dict(data))
+    return graph
+
+
+def run_benchmarks(graph=None, queries: int = 200, repeats: int = 20, matrix_size: int = 25, cases: list = None, memory: bool = True, seed: int = 0) -> dict:
+    """times the Index hot paths on one graph, offline, and reports latency percentiles and memory per benchmark
+
+    Every benchmark makes one untimed warm-up call, which builds the spatial indexes and routing arrays the
+    graph caches, then its timed calls; the point-to-point ones use a fresh random pair each call, so none
+    is answered from the method cache. Peak memory is what one more call allocates under tracemalloc.
+
+    Args:
+        graph (object): the street network to run on, a 100 x 100 grid_graph by default
+        queries (int): random point pairs, the calls of the per-pair benchmarks and the size of the batches
+        repeats (int): the calls of the batch, load and subgraph benchmarks
+        matrix_size (int): origins and destinations of the distance matrix
+        cases (list): the benchmarks to run, all of CASES by default
+        memory (bool): measure the peak allocation of each benchmark
+        seed (int): seed of the random points
+
+    Returns:
+        report (dict): {'graph': {nodes, edges}, 'cases': {name: {calls, items, warmup_ms, latency_ms,
+            items_per_second, peak_bytes}}, 'max_rss_bytes': ...}
+    """
+    graph = graph if graph is not None else grid_graph()
+    prepare_graph(graph, "drive")
+    rng = np.random.default_rng(seed)
+    lats = np.array([data["y"] for _, data in graph.nodes(data=True)])
+    lngs = np.array([data["x"] for _, data in graph.nodes(data=True)])
+    north, south, east, west = lats.max(), lats.min(), lngs.max(), lngs.min()
+    points = lambda count: np.column_stack((rng.uniform(south, north, count), rng.uniform(west, east, count)))
+    # a pair for every timed call, the warm-up and the memory measurement, so each call routes a new pair
+    origins, destinations = points(queries + 2), points(queries + 2)
+
+    def boxes(count, share=0.1):
+        # random boxes covering a share of the graph's area
+        height, width = (north - south) * share ** 0.5, (east - west) * share ** 0.5
+        corners = np.column_stack((rng.uniform(south, north - height, count), rng.uniform(west, east - width, count)))
+        return [(lat + height, lat, lng + width, lng) for lat, lng in corners.tolist()]
+
+    # one tile as big as the world, so routing never stitches
+    index = Index(tile_cache=GraphTileCache(tile_size=360, loader=lambda *args: graph), cache=MemoryCache(max_entries=4 * queries))
+    directory = tempfile.TemporaryDirectory()
+    with _working_directory(directory.name):
+        Index.save_graph(graph, graph_name="benchmark", network_type="drive")
+    pair = lambda i: (tuple(origins[i]), tuple(destinations[i]))
+    batch = origins[:queries], destinations[:queries]
+    bbox = boxes(repeats + 2)
+
+    def traces(count, steps=50, per_edge=8, noise=8.0):
+        # random drives of some blocks without turning straight back, pinged along the way with GPS noise
+        csr = Index.get_csr_graph(graph)
+        drives = []
+        for _ in range(count):
+            path = [int(rng.integers(csr.node_count))]
+            for _ in range(steps):
+                heads = csr.heads[csr.indptr[path[-1]]:csr.indptr[path[-1] + 1]].tolist()
+                onward = [head for head in heads if len(path) < 2 or head != path[-2]] or heads or [path[-1]]
+                path.append(onward[int(rng.integers(len(onward)))])
+            at = np.linspace(0, steps, steps * per_edge + 1)
+            lats = np.interp(at, np.arange(steps + 1), csr.y[path]) + rng.normal(0, noise / 111_000, len(at))
+            lngs = np.interp(at, np.arange(steps + 1), csr.x[path]) + rng.normal(0, noise / 111_000, len(at))
+            drives.append(np.column_stack((lats, lngs)))
+        return drives
+
+    drives = traces(repeats + 2)
+
+    benchmarks = {
+        "great_circle_scalar": (queries, 1, lambda i: index.get_great_circle_distance(*pair(i))),
+        "great_circle_batch": (repeats, queries, lambda i: index.get_great_circle_distances(*batch)),
+        "load_graph": (repeats, 1, lambda i: Index.load_graph("benchmark", "drive")),
+        "nearest_nodes": (repeats, queries, lambda i: Index.get_node_index(graph).nearest(batch[0][:, 0], batch[0][:, 1])),
+        "snap_to_roads": (repeats, queries, lambda i: Index.snap_to_roads(graph, batch[0])),
+        "road_distance": (queries, 1, lambda i: index.get_road_distance(*pair(i), mode="drive", weight="length")),
+        "distance_matrix": (repeats, matrix_size ** 2, lambda i: index.get_distance_matrix(
+            origins[:matrix_size], destinations[:matrix_size], mode="drive", graph=graph)),
+        "subgraph_view": (repeats, 1, lambda i: Index.get_subgraph(graph, bbox=bbox[i])),
+        "subgraph_graph": (repeats, 1, lambda i: Index.get_subgraph(graph, bbox=bbox[i], output="graph")),
+        "subgraph_csr": (repeats, 1, lambda i: Index.get_subgraph(graph, bbox=bbox[i], output="csr")),
+        "map_match": (repeats, len(drives[0]), lambda i: index.match_trace(drives[i], graph=graph)),
+    }
+
+    report = {"graph": {"nodes": graph.number_of_nodes(), "edges": graph.number_of_edges()}, "cases": {}}
+    try:
+        for name in cases or CASES:
+            calls, items, call = benchmarks[name]
+            with _working_directory(directory.name):
+                report["cases"][name] = _measure(call, calls, items, memory)
+    finally:
+        directory.cleanup()
+    report["max_rss_bytes"] = _max_rss()
+    return report
+
+
+@contextlib.contextmanager
+def _working_directory(path: str):
+    """runs a block in another working directory, where saved graphs are read and written"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def _measure(call, calls: int, items: int, memory: bool) -> dict:
+    """times calls of call(i) after one warm-up, and optionally the peak allocation of one more"""
+    start = time.perf_counter()
+    call(calls)
+    warmup = time.perf_counter() - start
+
+    latencies = []
+    for i in range(calls):
+        start = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            call(calls + 1)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {
+        "calls": calls,
+        "items": items,
+        "warmup_ms": warmup * 1000,
+        "latency_ms": percentiles([latency * 1000 for latency in latencies]),
+        "items_per_second": items * calls / max(sum(latencies), 1e-9),
+        "peak_bytes": peak,
+    }
+
+
+def _max_rss() -> int:
+    """the most resident memory the process has used, in bytes, None where the platform does not say"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def format_report(report: dict) -> str:
+    """lays a run_benchmarks report out as a table, one benchmark per line"""
+    lines = [
+        f"graph: {report['graph']['nodes']} nodes, {report['graph']['edges']} edges",
+        f"{'benchmark':<22}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'items/s':>14}{'peak MB':>10}",
+    ]
+    for name, case in report["cases"].items():
+        latency = case["latency_ms"]
+        peak = "-" if case["peak_bytes"] is None else f"{case['peak_bytes'] / 2**20:.1f}"
+        lines.append(
+            f"{name:<22}{case['calls']:>7}{latency['p50']:>10.3f}{latency['p95']:>10.3f}{latency['p99']:>10.3f}"
+            f"{case['items_per_second']:>14,.0f}{peak:>10}")
+    if report["max_rss_bytes"] is not None:
+        lines.append(f"max rss: {report['max_rss_bytes'] / 2**20:.0f} MB")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Index hot paths offline.")
+    parser.add_argument("--rows", type=int, default=100, help="rows of the synthetic grid")
+    parser.add_argument("--cols", type=int, default=100, help="columns of the synthetic grid")
+    parser.add_argument("--graph-name", help="benchmark a graph saved with Index.save_graph instead of a grid")
+    parser.add_argument("--network-type", default="drive", help="network type of the saved graph")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--cases", nargs="+", choices=CASES, help="benchmarks to run, all by default")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak measurements")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    arguments = parser.parse_args()
+
+    graph = (Index.load_graph(arguments.graph_name, arguments.network_type) if arguments.graph_name
+             else grid_graph(arguments.rows, arguments.cols))
+    report = run_benchmarks(graph, queries=arguments.queries, repeats=arguments.repeats, cases=arguments.cases, memory=not arguments.no_memory)
+    print(json.dumps(report, indent=2) if arguments.json else format_report(report))
@@ -0,0 +1,263 @@
+import os
+import sys
+import time
+import pickle
+import sqlite3
+import hashlib
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import networkx as nx
+
+from .metrics import count_cache_hit
+from .tiles import estimate_graph_bytes
+
+
+class _Missing:
+    def __repr__(self):
+        return "<missing>"
+
+
+MISSING = _Missing()
+
+
+def estimate_size(value) -> int:
+    """rough in-memory size of a cached value in bytes, graphs estimated the same way as the tile cache"""
+    if isinstance(value, nx.Graph):
+        return estimate_graph_bytes(value)
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+    return sys.getsizeof(value)
+
+
+class MemoryCache:
+    """in-process cache with least recently used eviction, bounded by entries and estimated bytes
+
+    Keys start with the name of the cached method, which is how per-method TTLs and clearing work.
+
+    Args:
+        max_entries (int): the most values kept
+        max_bytes (int): optional budget for the estimated size of all values
+        ttls (dict): {method name: seconds a value stays fresh}, methods not listed never expire
+        sizeof (callable): sizeof(value) -> bytes, defaults to estimate_size
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = None, ttls: dict = None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = dict(ttls or {})
+        self.sizeof = sizeof or estimate_size
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+    def get(self, key: tuple):
+        """returns the cached value, or MISSING when there is none or it expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+
+    def set(self, key: tuple, value):
+        ttl = self.ttls.get(key[0])
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, size, None if ttl is None else time.monotonic() + ttl)
+            self._bytes += size
+            while len(self._entries) > 1 and (
+                    len(self._entries) > self.max_entries or
+                    (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+
+    def clear(self, method: str = None):
+        """drops every value, or only those of one method"""
+        with self._lock:
+            for key in [key for key in self._entries if method is None or key[0] == method]:
+                self._drop(key)
+
+
+    def stats(self) -> dict:
+        """returns hits, misses, hit rate, evictions, expirations, entries and estimated bytes"""
+        with self._lock:
+            return _stats(self, entries=len(self._entries), bytes=self._bytes)
+
+
+    def _drop(self, key: tuple):
+        self._bytes -= self._entries.pop(key)[1]
+
+
+class SQLiteCache:
+    """cache shared by every process that opens the same SQLite file, holding pickled values
+
+    Suited to values that are expensive to compute and cheap to unpickle, e.g. downloaded graphs served to
+    several worker processes. Eviction drops the least recently read values first.
+
+    Args:
+        path (str): the database file, created on first use. example: 'cache/index.sqlite'
+        max_entries (int): the most values kept
+        max_bytes (int): optional budget for the pickled size of all values
+        ttls (dict): {method name: seconds a value stays fresh}, methods not listed never expire
+    """
+
+    def __init__(self, path: str = os.path.join("cache", "index.sqlite"), max_entries: int = 4096, max_bytes: int = None, ttls: dict = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = dict(ttls or {})
+        self._connection = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+    def get(self, key: tuple):
+        """returns the cached value, or MISSING when there is none or it expired"""
+        digest = _digest(key)
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT value, expires FROM entries WHERE key = ?", (digest,)).fetchone()
+            if row is not None and row[1] is not None and row[1] < time.time():
+                with connection:
+                    connection.execute("DELETE FROM entries WHERE key = ?", (digest,))
+                self.expirations += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return MISSING
+            with connection:
+                connection.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), digest))
+            self.hits += 1
+        return pickle.loads(row[0])
+
+
+    def set(self, key: tuple, value):
+        ttl = self.ttls.get(key[0])
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (key, method, value, size, used, expires) VALUES (?, ?, ?, ?, ?, ?)",
+                    (_digest(key), key[0], data, len(data), now, None if ttl is None else now + ttl))
+                count, size = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+                while count > 1 and (count > self.max_entries or (self.max_bytes is not None and size > self.max_bytes)):
+                    oldest, oldest_size = connection.execute(
+                        "SELECT key, size FROM entries ORDER BY used LIMIT 1").fetchone()
+                    connection.execute("DELETE FROM entries WHERE key = ?", (oldest,))
+                    count, size = count - 1, size - oldest_size
+                    self.evictions += 1
+
+
+    def clear(self, method: str = None):
+        """drops every value, or only those of one method"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                if method is None:
+                    connection.execute("DELETE FROM entries")
+                else:
+                    connection.execute("DELETE FROM entries WHERE method = ?", (method,))
+
+
+    def stats(self) -> dict:
+        """returns this process's hits, misses, hit rate, evictions and expirations, and the shared entries and bytes"""
+        with self._lock:
+            count, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            return _stats(self, entries=count, bytes=size)
+
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, method TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL, expires REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            self._connection = connection
+        return self._connection
+
+
+def cached(method):
+    """caches an Index method in the instance's cache, keyed on the method name and its arguments
+
+    Arguments are bound to the method's signature with defaults filled in, so f(a, b) and f(a, b=b) share a
+    value. Instances that share a cache share its values only when their cache_scope, the sources their
+    results come from, is the same. Calls with unhashable arguments, and results that are None or all None
+    (the error sentinels of the methods), are passed through without caching.
+    """
+    name = method.__name__
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            bound = signature.bind(self, *args, **kwargs)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (name, getattr(self, "cache_scope", ()), tuple(bound.arguments.items())[1:])
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        value = self.cache.get(key)
+        if value is MISSING:
+            value = method(self, *args, **kwargs)
+            if not _is_failure(value):
+                self.cache.set(key, value)
+        else:
+            count_cache_hit(name)
+        return value
+    return wrapper
+
+
+def _is_failure(value) -> bool:
+    return value is None or (isinstance(value, tuple) and len(value) > 0 and all(item is None for item in value))
+
+
+def _digest(key: tuple) -> str:
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def _stats(cache, **sizes) -> dict:
+    lookups = cache.hits + cache.misses
+    return {
+        "hits": cache.hits,
+        "misses": cache.misses,
+        "hit_rate": cache.hits / lookups if lookups else 0.0,
+        "evictions": cache.evictions,
+        "expirations": cache.expirations,
+        **sizes,
+    }
@@ -0,0 +1,314 @@
+import os
+import math
+import time
+import random
+from heapq import heappush, heappop, heapify
+
+import numpy as np
+
+from .csr import CSRGraph
+from .metrics import percentiles
+
+
+# witness searches give up after settling this many nodes, which only costs an extra shortcut
+WITNESS_SETTLE_LIMIT = 64
+
+
+def hierarchy_path(directory: str, graph_name: str, weight: str) -> str:
+    """returns where the hierarchy of a saved graph for one weight is stored, next to the graph itself"""
+    return os.path.join(directory, f"{graph_name}_ch_{weight}.npz")
+
+
+class ContractionHierarchy:
+    """contraction hierarchy over one weight of a CSRGraph, for sub-millisecond point-to-point queries
+
+    Every node has a rank. Edges (original ones and the shortcuts added while contracting) are split
+    into an upward graph, from lower to higher rank, and a downward graph stored reversed, so a query
+    is two small dijkstra searches that only ever climb in rank and meet at the top.
+
+    Attributes:
+        weight (str): the edge attribute the hierarchy minimizes
+        rank (np.ndarray): (N,) contraction order of every node
+        up (tuple): (indptr, heads, costs, lengths, middles) arrays of upward edges by tail node
+        down (tuple): same layout for downward edges, stored at their head node pointing back to the tail
+    """
+
+    def __init__(self, weight: str, rank, up: tuple, down: tuple):
+        self.weight = weight
+        self.rank = np.asarray(rank)
+        self.up = tuple(np.asarray(array) for array in up)
+        self.down = tuple(np.asarray(array) for array in down)
+        self._lists = (
+            tuple(array.tolist() for array in self.up),
+            tuple(array.tolist() for array in self.down))
+        self._middles = None
+
+
+    @property
+    def shortcut_count(self) -> int:
+        return int((self.up[4] >= 0).sum() + (self.down[4] >= 0).sum())
+
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.rank.nbytes + sum(array.nbytes for array in self.up + self.down))
+
+
+    def query(self, source: int, target: int) -> tuple:
+        """returns the (cost, length) of the cheapest route between two node indices, (inf, inf) when there is none"""
+        cost, length, _ = self._search(source, target)
+        return cost, length
+
+
+    def path(self, source: int, target: int) -> list:
+        """returns the node indices of the cheapest route with every shortcut unpacked, None when there is none"""
+        cost, _, (forward, backward, meeting) = self._search(source, target)
+        if math.isinf(cost):
+            return None
+        hops = []
+        node = meeting
+        while forward[node] != -1:
+            hops.append((forward[node], node))
+            node = forward[node]
+        hops.reverse()
+        node = meeting
+        while backward[node] != -1:
+            hops.append((node, backward[node]))
+            node = backward[node]
+
+        path = [source]
+        for u, v in hops:
+            path.extend(self._unpack(u, v))
+        return path
+
+
+    def save(self, path: str):
+        """writes the hierarchy as one uncompressed .npz file"""
+        names = ("indptr", "heads", "costs", "lengths", "middles")
+        np.savez(
+            path,
+            weight=np.array(self.weight),
+            rank=self.rank,
+            **{f"up_{name}": array for name, array in zip(names, self.up)},
+            **{f"down_{name}": array for name, array in zip(names, self.down)})
+
+
+    @classmethod
+    def load(cls, path: str) -> "ContractionHierarchy":
+        """reads a hierarchy written by save"""
+        names = ("indptr", "heads", "costs", "lengths", "middles")
+        with np.load(path) as data:
+            return cls(
+                weight=str(data["weight"]),
+                rank=data["rank"],
+                up=tuple(data[f"up_{name}"] for name in names),
+                down=tuple(data[f"down_{name}"] for name in names))
+
+
+    def _search(self, source: int, target: int) -> tuple:
+        if source == target:
+            return 0.0, 0.0, ({source: -1}, {source: -1}, source)
+        graphs = self._lists
+        costs = ({source: 0.0}, {target: 0.0})
+        lengths = ({source: 0.0}, {target: 0.0})
+        parents = ({source: -1}, {target: -1})
+        settled = (set(), set())
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best, meeting = math.inf, -1
+
+        while (heaps[0] and heaps[0][0][0] < best) or (heaps[1] and heaps[1][0][0] < best):
+            for side in (0, 1):
+                heap = heaps[side]
+                if not heap or heap[0][0] >= best:
+                    continue
+                cost, u = heappop(heap)
+                if u in settled[side]:
+                    continue
+                settled[side].add(u)
+                other = costs[1 - side]
+                if u in other and cost + other[u] < best:
+                    best, meeting = cost + other[u], u
+                indptr, heads, edge_costs, edge_lengths, _ = graphs[side]
+                own, own_lengths, parent = costs[side], lengths[side], parents[side]
+                for e in range(indptr[u], indptr[u + 1]):
+                    v = heads[e]
+                    v_cost = cost + edge_costs[e]
+                    if v_cost < own.get(v, math.inf):
+                        own[v] = v_cost
+                        own_lengths[v] = own_lengths[u] + edge_lengths[e]
+                        parent[v] = u
+                        heappush(heap, (v_cost, v))
+
+        if meeting < 0:
+            return math.inf, math.inf, None
+        return best, lengths[0][meeting] + lengths[1][meeting], (parents[0], parents[1], meeting)
+
+
+    def _unpack(self, u: int, v: int) -> list:
+        """expands the edge u -> v into the original nodes after u, recursively through shortcut middles"""
+        if self._middles is None:
+            middles = {}
+            for tails_first, (indptr, heads, _, _, middle) in ((True, self.up), (False, self.down)):
+                tails = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+                keys = zip(tails.tolist(), heads.tolist()) if tails_first else zip(heads.tolist(), tails.tolist())
+                middles.update(zip(keys, middle.tolist()))
+            self._middles = middles
+
+        nodes, stack = [], [(u, v)]
+        while stack:
+            a, b = stack.pop()
+            middle = self._middles[(a, b)]
+            if middle < 0:
+                nodes.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+        return nodes
+
+
+def build_contraction_hierarchy(csr: CSRGraph, weight: str = "length") -> ContractionHierarchy:
+    """contracts every node of a graph in edge-difference order, adding shortcuts where no witness path exists
+
+    Args:
+        csr (CSRGraph): the routing arrays of the graph
+        weight (str): the edge attribute to minimize. example: 'length', 'travel_time'
+
+    Returns:
+        ch (ContractionHierarchy): the hierarchy
+    """
+    chosen, _ = csr.routing_edges(weight)
+    costs = csr.edge_weights(weight)[chosen].tolist()
+    lengths = np.nan_to_num(csr.weights.get("length", np.zeros(csr.edge_count)))[chosen].tolist()
+    outgoing = [dict() for _ in range(csr.node_count)]
+    incoming = [dict() for _ in range(csr.node_count)]
+    for u, v, cost, length in zip(csr.tails[chosen].tolist(), csr.heads[chosen].tolist(), costs, lengths):
+        if u != v:
+            outgoing[u][v] = incoming[v][u] = (cost, length, -1)
+
+    rank = [-1] * csr.node_count
+    contracted_neighbours = [0] * csr.node_count
+    edges = []
+
+    def shortcuts_for(v, settle_limit=WITNESS_SETTLE_LIMIT):
+        shortcuts = []
+        for u, (in_cost, in_length, _) in incoming[v].items():
+            targets = set(outgoing[v]) - {u}
+            if not targets:
+                continue
+            limit = in_cost + max(outgoing[v][w][0] for w in targets)
+            reached = _witness_search(outgoing, u, v, limit, targets, settle_limit)
+            for w, (out_cost, out_length, _) in outgoing[v].items():
+                if w != u and reached.get(w, math.inf) > in_cost + out_cost:
+                    shortcuts.append((u, w, in_cost + out_cost, in_length + out_length))
+        return shortcuts
+
+    def priority(v):
+        # a cheaper witness search is good enough to rank nodes
+        shortcuts = len(shortcuts_for(v, settle_limit=WITNESS_SETTLE_LIMIT // 4))
+        return shortcuts - len(incoming[v]) - len(outgoing[v]) + contracted_neighbours[v]
+
+    priorities = [priority(v) for v in range(csr.node_count)]
+    queue = [(priorities[v], v) for v in range(csr.node_count)]
+    heapify(queue)
+    for level in range(csr.node_count):
+        while True:
+            queued, v = heappop(queue)
+            if rank[v] >= 0 or queued != priorities[v]:
+                continue
+            priorities[v] = priority(v)
+            if not queue or priorities[v] <= queue[0][0]:
+                break
+            heappush(queue, (priorities[v], v))
+        neighbours = set(incoming[v]) | set(outgoing[v])
+
+        for u, w, cost, length in shortcuts_for(v):
+            if cost < outgoing[u].get(w, (math.inf,))[0]:
+                outgoing[u][w] = incoming[w][u] = (cost, length, v)
+        rank[v] = level
+        for u, data in incoming[v].items():
+            edges.append((u, v) + data)
+            del outgoing[u][v]
+            contracted_neighbours[u] += 1
+        for w, data in outgoing[v].items():
+            edges.append((v, w) + data)
+            del incoming[w][v]
+            contracted_neighbours[w] += 1
+        incoming[v], outgoing[v] = {}, {}
+        # keep the order honest around the contracted node, whose neighbours just changed
+        for u in neighbours:
+            priorities[u] = priority(u)
+            heappush(queue, (priorities[u], u))
+
+    return ContractionHierarchy(
+        weight=weight,
+        rank=np.array(rank, dtype=np.int64),
+        up=_pack([(u, w, c, l, m) for u, w, c, l, m in edges if rank[u] < rank[w]], csr.node_count),
+        down=_pack([(w, u, c, l, m) for u, w, c, l, m in edges if rank[u] > rank[w]], csr.node_count))
+
+
+def benchmark(csr: CSRGraph, ch: ContractionHierarchy, queries: int = 200, seed: int = 0) -> dict:
+    """times random point-to-point queries on the hierarchy against plain bidirectional dijkstra
+
+    Returns:
+        report (dict): index size, shortcut count and query latency percentiles in milliseconds for both
+    """
+    rng = random.Random(seed)
+    pairs = [(rng.randrange(csr.node_count), rng.randrange(csr.node_count)) for _ in range(queries)]
+
+    def timed(route):
+        latencies = []
+        for source, target in pairs:
+            start = time.perf_counter()
+            route(source, target)
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies
+
+    ch_latencies = timed(ch.query)
+    dijkstra_latencies = timed(lambda s, t: csr.shortest_path(s, t, weight=ch.weight))
+    return {
+        "queries": queries,
+        "index_bytes": ch.nbytes,
+        "shortcuts": ch.shortcut_count,
+        "ch_query_ms": percentiles(ch_latencies),
+        "dijkstra_query_ms": percentiles(dijkstra_latencies),
+        "speedup": float(np.mean(dijkstra_latencies) / max(np.mean(ch_latencies), 1e-9)),
+    }
+
+
+def _witness_search(outgoing: list, source: int, skip: int, limit: float, targets: set, settle_limit: int) -> dict:
+    """bounded dijkstra from source that avoids the node being contracted, stopping once every target is settled"""
+    distances = {source: 0.0}
+    heap = [(0.0, source)]
+    remaining = len(targets)
+    settled = 0
+    while heap and settled < settle_limit:
+        cost, u = heappop(heap)
+        if cost > limit:
+            break
+        if cost > distances[u]:
+            continue
+        settled += 1
+        if u in targets:
+            remaining -= 1
+            if not remaining:
+                break
+        for v, (edge_cost, _, _) in outgoing[u].items():
+            if v == skip:
+                continue
+            v_cost = cost + edge_cost
+            if v_cost < distances.get(v, math.inf):
+                distances[v] = v_cost
+                heappush(heap, (v_cost, v))
+    return distances
+
+
+def _pack(edges: list, node_count: int) -> tuple:
+    """lays (tail, head, cost, length, middle) edges out as CSR arrays sorted by tail"""
+    edges.sort(key=lambda edge: edge[0])
+    tails = np.array([edge[0] for edge in edges], dtype=np.int64)
+    return (
+        np.concatenate(([0], np.cumsum(np.bincount(tails, minlength=node_count)))).astype(np.int64),
+        np.array([edge[1] for edge in edges], dtype=np.int64),
+        np.array([edge[2] for edge in edges], dtype=float),
+        np.array([edge[3] for edge in edges], dtype=float),
+        np.array([edge[4] for edge in edges], dtype=np.int64))
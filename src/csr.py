@@ -0,0 +1,538 @@
+import math
+from heapq import heappush, heappop, heapify
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from .spatial import EARTH_RADIUS, NodeIndex, great_circle
+
+
+# edge attributes copied into the arrays by default, the ones Index routes and reports on
+ROUTING_ATTRIBUTES = ("length", "travel_time")
+
+
+class CSRGraph:
+    """integer-indexed compressed sparse row copy of a street network, built once and routed on many times
+
+    Nodes are renumbered 0..N-1 in graph order and edges are sorted by tail node, so the
+    out-edges of node i are the edges indptr[i]:indptr[i + 1].
+
+    Attributes:
+        nodes (np.ndarray): the original node ids, by index
+        y (np.ndarray): node latitudes
+        x (np.ndarray): node longitudes
+        indptr (np.ndarray): (N + 1,) offsets of each node's out-edges
+        tails (np.ndarray): (E,) tail node index of every edge
+        heads (np.ndarray): (E,) head node index of every edge
+        keys (np.ndarray): (E,) multigraph key of every edge
+        weights (dict): {attribute: (E,) float array}, NaN where an edge lacks the attribute
+    """
+
+    def __init__(self, nodes, y, x, indptr, tails, heads, keys, weights: dict):
+        self.nodes = np.asarray(nodes)
+        self.y = np.asarray(y, dtype=float)
+        self.x = np.asarray(x, dtype=float)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.tails = np.asarray(tails, dtype=np.int64)
+        self.heads = np.asarray(heads, dtype=np.int64)
+        self.keys = np.asarray(keys)
+        self.weights = {name: np.asarray(values, dtype=float) for name, values in weights.items()}
+        self.node_index = {node: i for i, node in enumerate(self.nodes.tolist())}
+        self._routing = {}
+
+
+    @classmethod
+    def from_graph(cls, graph, attributes: tuple = ROUTING_ATTRIBUTES) -> "CSRGraph":
+        """builds the arrays from a networkx street network
+
+        Args:
+            graph (object): the street network object
+            attributes (tuple): the numeric edge attributes to copy. example: ('length', 'travel_time')
+
+        Returns:
+            csr (CSRGraph): the array copy of the graph
+        """
+        nodes = list(graph.nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        y = np.fromiter((data["y"] for _, data in graph.nodes(data=True)), dtype=float, count=len(nodes))
+        x = np.fromiter((data["x"] for _, data in graph.nodes(data=True)), dtype=float, count=len(nodes))
+
+        edges = list(graph.edges(keys=True, data=True))
+        tails = np.fromiter((index[u] for u, _, _, _ in edges), dtype=np.int64, count=len(edges))
+        heads = np.fromiter((index[v] for _, v, _, _ in edges), dtype=np.int64, count=len(edges))
+        keys = np.fromiter((k for _, _, k, _ in edges), dtype=np.int64, count=len(edges))
+        weights = {
+            name: np.fromiter((_as_float(data.get(name)) for _, _, _, data in edges), dtype=float, count=len(edges))
+            for name in attributes
+        }
+        close_edges(weights, np.fromiter((bool(data.get("closed")) for _, _, _, data in edges), dtype=bool, count=len(edges)))
+
+        order = np.argsort(tails, kind="stable")
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(tails, minlength=len(nodes)))))
+        return cls(
+            nodes=np.asarray(nodes) if nodes else np.zeros(0, dtype=np.int64),
+            y=y,
+            x=x,
+            indptr=indptr,
+            tails=tails[order],
+            heads=heads[order],
+            keys=keys[order],
+            weights={name: values[order] for name, values in weights.items()})
+
+
+    @property
+    def node_count(self) -> int:
+        return len(self.nodes)
+
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.heads)
+
+
+    def edge_attribute(self, graph, name: str) -> np.ndarray:
+        """reads one attribute of every edge of the graph these arrays were built from, in CSR edge order, None where missing"""
+        edges = list(graph.edges(keys=True, data=name))
+        tails = np.fromiter((self.node_index[u] for u, _, _, _ in edges), dtype=np.int64, count=len(edges))
+        values = np.empty(len(edges), dtype=object)
+        values[:] = [value for _, _, _, value in edges]
+        # from_graph keeps graph order within each tail, so the same stable sort lines the values up
+        return values[np.argsort(tails, kind="stable")]
+
+
+    def subgraph(self, nodes: np.ndarray, edges: np.ndarray) -> "CSRGraph":
+        """returns compact arrays holding only some nodes and edges, renumbered but in the same order
+
+        Args:
+            nodes (np.ndarray): sorted indices of the nodes to keep, including both ends of every kept edge
+            edges (np.ndarray): (E,) boolean mask of the edges to keep
+
+        Returns:
+            csr (CSRGraph): the smaller arrays, with the original node ids
+        """
+        renumber = np.full(self.node_count, -1, dtype=np.int64)
+        renumber[nodes] = np.arange(len(nodes))
+        tails = renumber[self.tails[edges]]
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(tails, minlength=len(nodes)))))
+        return CSRGraph(
+            nodes=self.nodes[nodes],
+            y=self.y[nodes],
+            x=self.x[nodes],
+            indptr=indptr,
+            tails=tails,
+            heads=renumber[self.heads[edges]],
+            keys=self.keys[edges],
+            weights={name: values[edges] for name, values in self.weights.items()})
+
+
+    def indices_of(self, nodes) -> np.ndarray:
+        """maps original node ids to their integer indices"""
+        return np.fromiter((self.node_index[node] for node in nodes), dtype=np.int64)
+
+
+    def edge_weights(self, weight: str) -> np.ndarray:
+        """returns the per-edge cost of an attribute, using networkx's default of 1 where it is missing"""
+        values = self.weights.get(weight)
+        if values is None:
+            return np.ones(self.edge_count)
+        return np.where(np.isnan(values), 1.0, values)
+
+
+    def routing_edges(self, weight: str) -> tuple:
+        """picks the cheapest of every set of parallel edges, as ox.shortest_path does
+
+        Args:
+            weight (str): the edge attribute to minimize
+
+        Returns:
+            chosen (np.ndarray): positions of the chosen edges, sorted by tail and then head
+            matrix (csr_matrix): (N, N) sparse adjacency matrix of the chosen edge costs
+        """
+        if weight not in self._routing:
+            cost = self.edge_weights(weight)
+            order = np.lexsort((cost, self.heads, self.tails))
+            pairs = self.tails[order] * self.node_count + self.heads[order]
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = pairs[1:] != pairs[:-1]
+            chosen = order[first]
+            matrix = csr_matrix(
+                (cost[chosen], (self.tails[chosen], self.heads[chosen])),
+                shape=(self.node_count, self.node_count))
+            self._routing[weight] = (chosen, matrix)
+        return self._routing[weight]
+
+
+    def incoming_edges(self, weight: str) -> tuple:
+        """lays the chosen edges out as a padded (N, max in-degree) table keyed by head node
+
+        Looking up the edge from a tree predecessor is then one row read and a few comparisons.
+
+        Returns:
+            tails (np.ndarray): (N, D) tail node index of each incoming edge, -1 for padding
+            edges (np.ndarray): (N, D) matching edge positions, -1 for padding
+        """
+        key = ("incoming", weight)
+        if key not in self._routing:
+            chosen, _ = self.routing_edges(weight)
+            heads = self.heads[chosen]
+            order = np.argsort(heads, kind="stable")
+            counts = np.bincount(heads, minlength=self.node_count)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            slots = np.arange(len(order)) - starts[heads[order]]
+            width = max(int(counts.max()) if len(counts) else 0, 1)
+            tails = np.full((self.node_count, width), -1, dtype=np.int64)
+            edges = np.full((self.node_count, width), -1, dtype=np.int64)
+            tails[heads[order], slots] = self.tails[chosen][order]
+            edges[heads[order], slots] = chosen[order]
+            self._routing[key] = (tails, edges)
+        return self._routing[key]
+
+
+    def cost_matrix(self, sources, targets, weight: str, metrics: tuple = ROUTING_ATTRIBUTES, chunk_size: int = 64) -> tuple:
+        """runs one shortest-path tree per distinct source and reads off the cost to every target
+
+        The trees are grown by scipy's compiled dijkstra, a chunk of sources at a time to bound memory.
+        Other metrics are summed along the same trees, so a route picked by travel time still reports its length.
+
+        Args:
+            sources (array-like): source node indices
+            targets (array-like): target node indices
+            weight (str): the edge attribute the routes minimize
+            metrics (tuple): edge attributes to sum along the chosen routes
+            chunk_size (int): how many trees to hold in memory at once
+
+        Returns:
+            costs (np.ndarray): (S, T) route costs, inf where a target is unreachable
+            sums (dict): {metric: (S, T) array} of the metrics summed along each route, NaN where unreachable
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        unique_sources, inverse = np.unique(sources, return_inverse=True)
+        _, matrix = self.routing_edges(weight)
+        incoming_tails, incoming_edges = self.incoming_edges(weight)
+        tables = {
+            metric: np.where(incoming_edges >= 0, np.nan_to_num(self.weights.get(metric, np.zeros(self.edge_count)))[incoming_edges], 0.0)
+            for metric in metrics
+        }
+
+        costs = np.empty((len(unique_sources), len(targets)))
+        sums = {metric: np.empty((len(unique_sources), len(targets))) for metric in metrics}
+        for start in range(0, len(unique_sources), chunk_size):
+            chunk = unique_sources[start:start + chunk_size]
+            distances, predecessors = dijkstra(matrix, directed=True, indices=chunk, return_predecessors=True)
+            costs[start:start + len(chunk)] = distances[:, targets]
+            chunk_sums = self._path_sums(predecessors, incoming_tails, tables, targets)
+            for metric in metrics:
+                sums[metric][start:start + len(chunk)] = chunk_sums[metric]
+
+        unreachable = np.isinf(costs)
+        for metric in metrics:
+            sums[metric][unreachable] = np.nan
+        return costs[inverse], {metric: values[inverse] for metric, values in sums.items()}
+
+
+    def bounded_costs(self, sources, limit: float, weight: str) -> np.ndarray:
+        """grows one shortest-path tree per source, stopping each search once its cost passes the limit
+
+        Args:
+            sources (array-like): source node indices
+            limit (float): the highest cost searched to
+            weight (str): the edge attribute the routes minimize
+
+        Returns:
+            costs (np.ndarray): (S, N) cost from every source to every node, inf beyond the limit
+        """
+        _, matrix = self.routing_edges(weight)
+        return np.atleast_2d(dijkstra(matrix, directed=True, indices=np.asarray(sources, dtype=np.int64), limit=limit))
+
+
+    def shortest_path(self, source: int, target: int, weight: str = "length", method: str = "bidirectional") -> tuple:
+        """finds the cheapest route between two node indices
+
+        Both searches run over plain python lists prepared once per weight, which avoids the
+        dict-of-dict lookups a networkx graph costs on every edge.
+
+        Args:
+            source (int): source node index
+            target (int): target node index
+            weight (str): the edge attribute to minimize. example: 'length', 'travel_time'
+            method (str): 'bidirectional' for bidirectional dijkstra, 'astar' for A* with a great circle heuristic
+
+        Returns:
+            cost (float): the route cost, inf when the target cannot be reached
+            path (list): node indices from source to target, None when the target cannot be reached
+        """
+        if method == "bidirectional":
+            return self._bidirectional_dijkstra(source, target, weight)
+        elif method == "astar":
+            return self._astar(source, target, weight)
+        raise ValueError(f"Unknown shortest path method '{method}'. Options: 'bidirectional', 'astar'.")
+
+
+    def path_metric(self, path: list, weight: str, metric: str = "length") -> float:
+        """sums a metric along a path of node indices, taking the cheapest parallel edge by weight at each hop"""
+        indptr, heads, costs = self.adjacency(weight)
+        values = np.nan_to_num(self.weights.get(metric, np.zeros(self.edge_count)))
+        total = 0.0
+        for u, v in zip(path, path[1:]):
+            edge = min((e for e in range(indptr[u], indptr[u + 1]) if heads[e] == v), key=costs.__getitem__)
+            total += values[edge]
+        return float(total)
+
+
+    def reverse_edge(self, edge: int, weight: str) -> int:
+        """returns the cheapest edge running back from an edge's head to its tail, -1 when the street is one-way"""
+        indptr, heads, costs = self.adjacency(weight)
+        tail, head = int(self.tails[edge]), int(self.heads[edge])
+        reverse = [e for e in range(indptr[head], indptr[head + 1]) if heads[e] == tail]
+        return min(reverse, key=costs.__getitem__) if reverse else -1
+
+
+    def edge_seeds(self, edge: int, fraction: float, weight: str, metric: str = "length", leaving: bool = True) -> dict:
+        """the nodes a point part-way along an edge connects to, with the partial cost and metric of getting there
+
+        Leaving the point, the route carries on to the edge's head or, on a two-way street, turns back to its
+        tail. Arriving at it, the route comes in from the tail or, on a two-way street, back from the head.
+
+        Returns:
+            seeds (dict): {node index: (cost, metric)}
+        """
+        costs = self.edge_weights(weight)
+        values = np.nan_to_num(self.weights.get(metric, np.zeros(self.edge_count)))
+        reverse = self.reverse_edge(edge, weight)
+        ahead, behind = (1.0 - fraction, fraction) if leaving else (fraction, 1.0 - fraction)
+        near, far = (int(self.heads[edge]), int(self.tails[edge])) if leaving else (int(self.tails[edge]), int(self.heads[edge]))
+        seeds = {near: (ahead * costs[edge], ahead * values[edge])}
+        if reverse >= 0 and behind * costs[reverse] < seeds.get(far, (math.inf,))[0]:
+            seeds[far] = (behind * costs[reverse], behind * values[reverse])
+        return seeds
+
+
+    def along_edge(self, source: tuple, target: tuple, weight: str, metric: str = "length") -> tuple:
+        """the (cost, metric) of going straight from one point to another on the same edge, (inf, nan) otherwise
+
+        Args:
+            source (tuple): (edge, fraction) of the start point
+            target (tuple): (edge, fraction) of the end point
+        """
+        (edge, start), (other, end) = source, target
+        if edge != other:
+            return math.inf, math.nan
+        if end >= start:
+            travelled = edge
+        else:
+            travelled = self.reverse_edge(edge, weight)
+            if travelled < 0:
+                return math.inf, math.nan
+        share = abs(end - start)
+        value = self.weights.get(metric, np.zeros(self.edge_count))[travelled]
+        return share * self.edge_weights(weight)[travelled], share * float(np.nan_to_num(value))
+
+
+    def snapped_route(self, source: tuple, target: tuple, weight: str = "length", metric: str = "length") -> tuple:
+        """finds the cheapest route between two points snapped onto edges, counting only the parts of the end edges used
+
+        Args:
+            source (tuple): (edge, fraction) of the start point, as EdgeIndex.snap returns them
+            target (tuple): (edge, fraction) of the end point
+            weight (str): the edge attribute to minimize
+            metric (str): the edge attribute to report along the route. example: 'length'
+
+        Returns:
+            cost (float): the route cost, inf when there is no route
+            total (float): the metric summed along the route, partial edges included
+            path (list): node indices between the two points, empty when both lie on the same stretch of one edge
+        """
+        leaving = self.edge_seeds(*source, weight, metric, leaving=True)
+        arriving = self.edge_seeds(*target, weight, metric, leaving=False)
+        cost, path = self._seeded_search(
+            {node: seed[0] for node, seed in leaving.items()},
+            {node: seed[0] for node, seed in arriving.items()},
+            weight)
+        total = math.nan
+        if path is not None:
+            total = leaving[path[0]][1] + self.path_metric(path, weight, metric) + arriving[path[-1]][1]
+
+        direct_cost, direct_total = self.along_edge(source, target, weight, metric)
+        if direct_cost <= cost:
+            return direct_cost, direct_total, []
+        return cost, total, path
+
+
+    @property
+    def spatial_index(self) -> NodeIndex:
+        """the spatial index over the nodes, positions in it are node indices"""
+        if "spatial" not in self._routing:
+            self._routing["spatial"] = NodeIndex(np.arange(self.node_count), self.y, self.x)
+        return self._routing["spatial"]
+
+
+    def nearest_nodes(self, lats, lngs) -> np.ndarray:
+        """returns the index of the nearest node to each lat-long point by great circle distance"""
+        positions, _ = self.spatial_index.query(lats, lngs)
+        return np.atleast_1d(positions).astype(np.int64)
+
+
+    def adjacency(self, weight: str, reverse: bool = False) -> tuple:
+        """returns (indptr, neighbours, costs) as python lists, over out-edges or, with reverse, in-edges"""
+        key = ("adjacency", weight, reverse)
+        if key not in self._routing:
+            costs = self.edge_weights(weight)
+            if reverse:
+                order = np.argsort(self.heads, kind="stable")
+                counts = np.bincount(self.heads, minlength=self.node_count)
+                indptr = np.concatenate(([0], np.cumsum(counts)))
+                self._routing[key] = (indptr.tolist(), self.tails[order].tolist(), costs[order].tolist())
+            else:
+                self._routing[key] = (self.indptr.tolist(), self.heads.tolist(), costs.tolist())
+        return self._routing[key]
+
+
+    def heuristic_scale(self, weight: str) -> float:
+        """returns the largest factor that keeps cost >= factor * great circle distance on every edge
+
+        Multiplying the great circle distance to the target by it gives an admissible A* heuristic for any
+        weight: about 1 for length, and 1 / top speed in meters per second for travel time.
+        """
+        key = ("heuristic", weight)
+        if key not in self._routing:
+            straight = great_circle(self.y[self.tails], self.x[self.tails], self.y[self.heads], self.x[self.heads])
+            costs = self.edge_weights(weight)
+            measurable = straight > 1e-6
+            scale = float(np.min(costs[measurable] / straight[measurable])) if measurable.any() else 0.0
+            # shave off rounding so the heuristic never overestimates
+            self._routing[key] = max(scale, 0.0) * (1 - 1e-9)
+        return self._routing[key]
+
+
+    def _bidirectional_dijkstra(self, source: int, target: int, weight: str) -> tuple:
+        return self._seeded_search({source: 0.0}, {target: 0.0}, weight)
+
+
+    def _seeded_search(self, sources: dict, targets: dict, weight: str) -> tuple:
+        """bidirectional dijkstra between sets of nodes that each start at a cost, {node: cost} per side"""
+        searches = (self.adjacency(weight), self.adjacency(weight, reverse=True))
+        distances = ([math.inf] * self.node_count, [math.inf] * self.node_count)
+        parents = ({}, {})
+        heaps = ([], [])
+        for side, seeds in ((0, sources), (1, targets)):
+            for node, cost in seeds.items():
+                distances[side][node] = cost
+                parents[side][node] = -1
+                heaps[side].append((cost, node))
+            heapify(heaps[side])
+        settled = (bytearray(self.node_count), bytearray(self.node_count))
+        best, meeting = math.inf, -1
+        for node in sources.keys() & targets.keys():
+            if sources[node] + targets[node] < best:
+                best, meeting = sources[node] + targets[node], node
+
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            cost, u = heappop(heaps[side])
+            done = settled[side]
+            if done[u]:
+                continue
+            done[u] = 1
+            indptr, neighbours, costs = searches[side]
+            own, other, parent, heap = distances[side], distances[1 - side], parents[side], heaps[side]
+            for e in range(indptr[u], indptr[u + 1]):
+                v = neighbours[e]
+                v_cost = cost + costs[e]
+                if v_cost < own[v]:
+                    own[v] = v_cost
+                    parent[v] = u
+                    heappush(heap, (v_cost, v))
+                    if v_cost + other[v] < best:
+                        best, meeting = v_cost + other[v], v
+
+        if meeting < 0:
+            return math.inf, None
+        path = _walk(parents[0], meeting)[::-1] + _walk(parents[1], meeting)[1:]
+        return best, path
+
+
+    def _astar(self, source: int, target: int, weight: str) -> tuple:
+        indptr, neighbours, costs = self.adjacency(weight)
+        scale = self.heuristic_scale(weight) * EARTH_RADIUS
+        lats, lngs, cosines = self._radians()
+        target_lat, target_lng, cos_target = lats[target], lngs[target], cosines[target]
+        sin, asin, sqrt = math.sin, math.asin, math.sqrt
+
+        distances = [math.inf] * self.node_count
+        distances[source] = 0.0
+        parents = {source: -1}
+        settled = bytearray(self.node_count)
+        heap = [(0.0, 0.0, source)]
+        while heap:
+            _, cost, u = heappop(heap)
+            if u == target:
+                return cost, _walk(parents, target)[::-1]
+            if settled[u]:
+                continue
+            settled[u] = 1
+            for e in range(indptr[u], indptr[u + 1]):
+                v = neighbours[e]
+                v_cost = cost + costs[e]
+                if v_cost < distances[v]:
+                    distances[v] = v_cost
+                    parents[v] = u
+                    h = sin((lats[v] - target_lat) / 2) ** 2 + cosines[v] * cos_target * sin((lngs[v] - target_lng) / 2) ** 2
+                    heappush(heap, (v_cost + scale * 2 * asin(sqrt(min(1.0, h))), v_cost, v))
+        return math.inf, None
+
+
+    def _radians(self) -> tuple:
+        if "radians" not in self._routing:
+            lats = np.radians(self.y)
+            self._routing["radians"] = (lats.tolist(), np.radians(self.x).tolist(), np.cos(lats).tolist())
+        return self._routing["radians"]
+
+
+    def _path_sums(self, predecessors: np.ndarray, incoming_tails: np.ndarray, tables: dict, targets: np.ndarray) -> dict:
+        """sums edge metrics along the tree path from each source to each target
+
+        Every path is walked back from its target one hop per step, all unfinished paths in the
+        same numpy step, so the python loop only runs as many times as the longest route has edges.
+        """
+        rows, columns = np.divmod(np.arange(len(predecessors) * len(targets)), len(targets))
+        current = targets[columns]
+        totals = {metric: np.zeros(len(rows)) for metric in tables}
+        positions = np.arange(len(rows))
+        while len(positions):
+            parents = predecessors[rows, current]
+            active = parents >= 0
+            positions, rows, current, parents = positions[active], rows[active], current[active], parents[active]
+            slots = (incoming_tails[current] == parents[:, None]).argmax(axis=1)
+            for metric, table in tables.items():
+                totals[metric][positions] += table[current, slots]
+            current = parents
+        return {metric: values.reshape(len(predecessors), len(targets)) for metric, values in totals.items()}
+
+
+def _walk(parents: dict, node: int) -> list:
+    """follows parent links from node back to the root of a search, node first"""
+    path = []
+    while node != -1:
+        path.append(node)
+        node = parents[node]
+    return path
+
+
+def close_edges(weights: dict, closed: np.ndarray) -> dict:
+    """makes every weight of the closed edges infinite, so they keep their place (and geometry) but no route uses them"""
+    if closed.any():
+        for name, values in weights.items():
+            weights[name] = np.where(closed, np.inf, values)
+    return weights
+
+
+def _as_float(value) -> float:
+    """reads a numeric edge attribute, NaN when it is missing or not a number"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
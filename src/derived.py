@@ -0,0 +1,41 @@
+import threading
+import weakref
+
+
+# structures built from a graph (routing arrays, spatial indexes, ...), dropped together with the graph
+_derived = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def derived(graph, kind, build):
+    """returns the structure of the given kind built from graph, building it on first use
+
+    Args:
+        graph (object): the street network object the structure is derived from
+        kind (hashable): the name of the structure. example: 'csr'
+        build (callable): build(graph) -> structure, called once per graph and kind
+
+    Returns:
+        structure (object): the cached structure
+    """
+    with _lock:
+        entries = _derived.setdefault(graph, {})
+        if kind in entries:
+            return entries[kind]
+    structure = build(graph)
+    with _lock:
+        return entries.setdefault(kind, structure)
+
+
+def invalidate(graph, *kinds):
+    """drops the cached structures of a graph after it was modified, all of them when no kinds are given
+
+    A kind also drops its variants keyed on it, e.g. 'csr' drops ('csr', 'travel_time') too.
+    """
+    with _lock:
+        entries = _derived.get(graph)
+        if entries is None:
+            return
+        for kind in list(entries):
+            if not kinds or kind in kinds or (isinstance(kind, tuple) and kind[0] in kinds):
+                del entries[kind]
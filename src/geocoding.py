@@ -0,0 +1,306 @@
+import os
+import re
+import asyncio
+import time
+import sqlite3
+import logging
+import threading
+import concurrent.futures
+
+import httpx
+import numpy as np
+import osmnx as ox
+
+from .spatial import EdgeIndex
+
+
+# where a GeocodeCache keeps results between runs when it is not given a path, next to Graph_Network
+GEOCODE_CACHE_PATH = os.path.join("cache", "geocode.sqlite")
+
+# found places rarely move, places that were not found are retried sooner in case the data was fixed upstream
+GEOCODE_TTL = 30 * 24 * 3600
+NEGATIVE_TTL = 24 * 3600
+
+
+def normalize_place(place_name: str) -> str:
+    """the cache key of a place name: case-folded, with runs of whitespace and spacing around commas collapsed"""
+    return re.sub(r"\s*,\s*", ", ", re.sub(r"\s+", " ", place_name)).strip(" ,").casefold()
+
+
+def osmnx_geocoder(place_name: str) -> tuple:
+    """geocodes through Nominatim with osmnx, None when Nominatim has no match
+
+    Any other failure (network, rate limiting) raises, so it is not mistaken for a place that does not exist.
+    """
+    try:
+        return tuple(ox.geocoder.geocode(place_name))
+    except ox._errors.InsufficientResponseError:
+        return None
+
+
+def nominatim_reverse(lat: float, lng: float) -> dict:
+    """reverse-geocodes one point through Nominatim's public API, None when it has no answer
+
+    Returns:
+        street (dict): {'name': road or place name, 'highway': None, 'location': (lat, long), 'distance': None, 'edge': None}
+    """
+    response = httpx.get(
+        "https://nominatim.openstreetmap.org/reverse",
+        params={"format": "jsonv2", "lat": lat, "lon": lng, "zoom": 17},
+        headers={"User-Agent": ox.settings.http_user_agent},
+        timeout=ox.settings.requests_timeout)
+    response.raise_for_status()
+    data = response.json()
+    if "error" in data:
+        return None
+    address = data.get("address", {})
+    return {
+        "name": address.get("road") or data.get("name") or data.get("display_name"),
+        "highway": None,
+        "location": (float(data["lat"]), float(data["lon"])),
+        "distance": None,
+        "edge": None,
+    }
+
+
+async def nominatim_search(client: httpx.AsyncClient, place_name: str) -> tuple:
+    """geocodes one place name through Nominatim's search API on an async client, None when it has no match
+
+    The async counterpart of osmnx_geocoder, for callers on an event loop. Failures raise, as there.
+    """
+    response = await client.get(
+        "https://nominatim.openstreetmap.org/search",
+        params={"format": "json", "q": place_name, "limit": 1},
+        headers={"User-Agent": ox.settings.http_user_agent},
+        timeout=ox.settings.requests_timeout)
+    response.raise_for_status()
+    results = response.json()
+    if not results:
+        return None
+    return (float(results[0]["lat"]), float(results[0]["lon"]))
+
+
+class StreetIndex:
+    """reverse geocoder over the named edges of a street network, answering from memory
+
+    Every edge with a name (or, failing that, a road number in ref) is indexed by an EdgeIndex,
+    so a batch of points resolves to streets in a few vectorized steps.
+
+    Args:
+        graph (object): the street network object, e.g. from Index.load_graph
+        csr (CSRGraph): the routing arrays built from the same graph
+    """
+
+    def __init__(self, graph, csr):
+        names = csr.edge_attribute(graph, "name")
+        refs = csr.edge_attribute(graph, "ref")
+        self.names = np.where(np.array([_present(name) for name in names], dtype=bool), names, refs)
+        self.highways = csr.edge_attribute(graph, "highway")
+        self.nodes, self.tails, self.heads, self.keys = csr.nodes, csr.tails, csr.heads, csr.keys
+        named = np.array([_present(name) for name in self.names], dtype=bool)
+        self.edges = EdgeIndex.from_graph(graph, csr, indexed=named)
+
+
+    def lookup(self, lats, lngs, max_distance: float = None) -> list:
+        """returns the nearest named street to every point, {} where none is within max_distance meters
+
+        Returns:
+            streets (list): {'name', 'highway', 'location': snapped (lat, long), 'distance': meters, 'edge': (u, v, key)} per point
+        """
+        snap = self.edges.snap(lats, lngs, max_distance=max_distance)
+        found = snap.edges >= 0
+        if not found.any():
+            return [{} for _ in found]
+        edges = np.where(found, snap.edges, snap.edges[found][0])
+        return [
+            {"name": name, "highway": highway, "location": (lat, lng), "distance": distance, "edge": (u, v, key)} if hit else {}
+            for hit, name, highway, lat, lng, distance, u, v, key in zip(
+                found.tolist(),
+                self.names[edges].tolist(),
+                self.highways[edges].tolist(),
+                snap.lats.tolist(),
+                snap.lngs.tolist(),
+                snap.distances.tolist(),
+                self.nodes[self.tails[edges]].tolist(),
+                self.nodes[self.heads[edges]].tolist(),
+                self.keys[edges].tolist())
+        ]
+
+
+class GeocodeCache:
+    """SQLite store of geocoding results, shared by every process that opens the same file
+
+    Found places are kept for ttl seconds and places the geocoder could not find for negative_ttl seconds,
+    after which they are looked up again.
+
+    Args:
+        path (str): the database file, created on first use, or ':memory:' to keep results for this process only.
+            example: 'cache/geocode.sqlite'
+        ttl (float): seconds a found place is served from the cache
+        negative_ttl (float): seconds a place that was not found is remembered as missing
+    """
+
+    def __init__(self, path: str = GEOCODE_CACHE_PATH, ttl: float = GEOCODE_TTL, negative_ttl: float = NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._connection = None
+        self._lock = threading.Lock()
+
+
+    def get_many(self, keys: list) -> dict:
+        """returns {key: (lat, long), or None when cached as not found} for the keys that are cached and fresh"""
+        now = time.time()
+        found = {}
+        with self._lock:
+            connection = self._connect()
+            # stay under SQLite's limit on query parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT query, lat, lng, found, created FROM geocodes WHERE query IN ({','.join('?' * len(chunk))})",
+                    chunk)
+                for key, lat, lng, hit, created in rows:
+                    if now - created <= (self.ttl if hit else self.negative_ttl):
+                        found[key] = (lat, lng) if hit else None
+        return found
+
+
+    def put_many(self, results: dict):
+        """stores {key: (lat, long), or None for not found}"""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO geocodes (query, lat, lng, found, created) VALUES (?, ?, ?, ?, ?)",
+                    [(key, *(location or (None, None)), location is not None, now) for key, location in results.items()])
+
+
+    def clear(self):
+        """drops every cached result"""
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM geocodes")
+
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            # readers in other processes are not blocked by a writer
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS geocodes "
+                "(query TEXT PRIMARY KEY, lat REAL, lng REAL, found INTEGER NOT NULL, created REAL NOT NULL)")
+            self._connection = connection
+        return self._connection
+
+
+class RateLimiter:
+    """spaces calls at least 1 / rate seconds apart across threads"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class AsyncRateLimiter:
+    """RateLimiter for coroutines on one event loop, which sleep on the loop instead of blocking it"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def geocode_many(
+    place_names: list,
+    geocoder=osmnx_geocoder,
+    cache: GeocodeCache = None,
+    rate: float = 1.0,
+    max_concurrency: int = 4,
+    limiter: "RateLimiter" = None) -> list:
+
+    """geocodes a batch of place names, each distinct place at most once
+
+    Names are normalized and deduplicated, cached answers are served straight away, and the rest go to
+    the geocoder from a small thread pool, started no faster than rate requests per second. Nominatim's
+    usage policy asks for at most one request per second; raise rate for a geocoder you run yourself.
+
+    Args:
+        place_names (list): the place names. example: ['San Francisco, California', ...]
+        geocoder (callable): geocoder(place_name) -> (lat, long), or None when the place does not exist
+        cache (GeocodeCache): optional cache to read from and write to
+        rate (float): the most geocoder requests started per second, 0 for no limit
+        max_concurrency (int): the most geocoder requests in flight at once
+        limiter (RateLimiter): optional limiter shared with other calls, which then replaces rate, so requests
+            from every call sharing it stay within its rate together
+
+    Returns:
+        locations (list): the lat-long of every place in input order, () where it was not found or failed
+    """
+    keys = [normalize_place(name) if isinstance(name, str) else None for name in place_names]
+    distinct = list(dict.fromkeys(key for key in keys if key))
+    results = cache.get_many(distinct) if cache is not None else {}
+
+    misses = [key for key in distinct if key not in results]
+    if misses:
+        # geocode the first spelling seen for each key, the way the caller wrote it
+        spelling = {}
+        for name, key in zip(place_names, keys):
+            if key:
+                spelling.setdefault(key, name)
+        limiter = limiter or RateLimiter(rate)
+
+        def lookup(key):
+            limiter.wait()
+            return geocoder(spelling[key])
+
+        fresh = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(misses)))) as pool:
+            futures = {pool.submit(lookup, key): key for key in misses}
+            for future in concurrent.futures.as_completed(futures):
+                key = futures[future]
+                try:
+                    location = future.result()
+                    fresh[key] = tuple(location) if location is not None else None
+                except Exception as e:
+                    logging.error(f"Failed to geocode {spelling[key]} : {e}")
+        if cache is not None and fresh:
+            cache.put_many(fresh)
+        results.update(fresh)
+
+    return [(results.get(key) or ()) if key else () for key in keys]
+
+
+def _present(value) -> bool:
+    """whether an edge attribute holds a value, osmnx leaves missing ones out and GraphML round trips can make them NaN"""
+    return value is not None and not (isinstance(value, float) and value != value) and value != ""
@@ -0,0 +1,97 @@
+import math
+
+import numpy as np
+import shapely
+from contourpy import FillType, contour_generator
+from scipy.ndimage import minimum_filter
+
+from .spatial import METERS_PER_DEGREE, great_circle
+
+
+# the raster isochrone areas are traced on is at most this many cells across, whatever the reach
+MAX_CELLS = 1000
+
+
+def reach_samples(csr, costs: np.ndarray, limit: float, weight: str, spacing: float) -> tuple:
+    """samples points along every edge a bounded search got onto, each with the cost of getting there
+
+    Points are spaced at most spacing meters apart on the straight line between an edge's nodes, and only
+    those within the limit are kept, so an edge only partly reached is sampled as far as the search got.
+
+    Args:
+        csr (CSRGraph): the routing arrays searched
+        costs (np.ndarray): (N,) cost of reaching every node, inf where it was not reached
+        limit (float): the highest cost to sample
+        weight (str): the edge attribute the costs are in
+        spacing (float): the largest gap between samples in meters
+
+    Returns:
+        lats, lngs, costs (np.ndarray): the sampled points and their costs, reached nodes included
+    """
+    edges = np.flatnonzero(costs[csr.tails] <= limit)
+    tails, heads = csr.tails[edges], csr.heads[edges]
+    meters = great_circle(csr.y[tails], csr.x[tails], csr.y[heads], csr.x[heads])
+    counts = np.maximum(1, np.ceil(meters / spacing)).astype(np.int64)
+    owners = np.repeat(np.arange(len(edges)), counts)
+    shares = (np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts) + 1) / counts[owners]
+    sample_costs = costs[tails][owners] + shares * csr.edge_weights(weight)[edges][owners]
+    kept = sample_costs <= limit
+    owners, shares = owners[kept], shares[kept]
+    lats = csr.y[tails][owners] + shares * (csr.y[heads][owners] - csr.y[tails][owners])
+    lngs = csr.x[tails][owners] + shares * (csr.x[heads][owners] - csr.x[tails][owners])
+    reached = np.flatnonzero(costs <= limit)
+    return (
+        np.concatenate((csr.y[reached], lats)),
+        np.concatenate((csr.x[reached], lngs)),
+        np.concatenate((costs[reached], sample_costs[kept])))
+
+
+def reach_polygons(lats: np.ndarray, lngs: np.ndarray, costs: np.ndarray, thresholds: list, buffer: float) -> dict:
+    """traces the area within buffer meters of the sampled points cheaper than each threshold, in one pass
+
+    The cheapest cost per cell of a raster is spread over the cells within the buffer, and every threshold
+    is then one filled contour of the same raster, holes included. Cells are half the buffer wide unless
+    that would make the raster more than MAX_CELLS across, in which case they grow to fit it and the areas
+    are correspondingly coarser.
+
+    Args:
+        lats, lngs, costs (np.ndarray): the sampled points and the cost of reaching each
+        thresholds (list): the costs to trace, in increasing order
+        buffer (float): meters around the points each area covers
+
+    Returns:
+        polygons (dict): {threshold: lng-lat shapely geometry}, empty where nothing is reached
+    """
+    if not len(costs):
+        return {threshold: shapely.Polygon() for threshold in thresholds}
+    scale = math.cos(math.radians(float(np.mean(lats))))
+    x, y = lngs * scale * METERS_PER_DEGREE, lats * METERS_PER_DEGREE
+    extent = max(float(x.max() - x.min()), float(y.max() - y.min())) + 4 * buffer
+    cell = max(buffer / 2, extent / MAX_CELLS)
+    radius = max(1, int(math.ceil(buffer / cell)))
+    # room for the buffer and a ring of unreached cells, so every contour closes
+    left, bottom = x.min() - (radius + 2) * cell, y.min() - (radius + 2) * cell
+    columns = ((x - left) / cell).astype(np.int64)
+    rows = ((y - bottom) / cell).astype(np.int64)
+
+    unreached = 2 * float(thresholds[-1]) + 1
+    grid = np.full((rows.max() + radius + 3, columns.max() + radius + 3), unreached)
+    np.minimum.at(grid, (rows, columns), costs)
+    offsets = np.arange(-radius, radius + 1)
+    grid = minimum_filter(grid, footprint=np.hypot(*np.meshgrid(offsets, offsets)) <= radius, mode="constant", cval=unreached)
+
+    generator = contour_generator(
+        x=left + (np.arange(grid.shape[1]) + 0.5) * cell,
+        y=bottom + (np.arange(grid.shape[0]) + 0.5) * cell,
+        z=grid, fill_type=FillType.OuterOffset)
+    polygons = {}
+    for threshold in thresholds:
+        points, offsets = generator.filled(-1.0, float(threshold))
+        shapes = [
+            shapely.Polygon(ring_points[ring_offsets[0]:ring_offsets[1]], [
+                ring_points[start:stop] for start, stop in zip(ring_offsets[1:-1], ring_offsets[2:])])
+            for ring_points, ring_offsets in zip(points, offsets)
+        ]
+        area = shapely.MultiPolygon(shapes) if len(shapes) > 1 else (shapes[0] if shapes else shapely.Polygon())
+        polygons[threshold] = shapely.transform(area, lambda coords: coords / (scale * METERS_PER_DEGREE, METERS_PER_DEGREE))
+    return polygons
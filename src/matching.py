@@ -0,0 +1,401 @@
+import math
+from typing import NamedTuple
+from collections import OrderedDict
+from heapq import heappush, heappop
+
+import numpy as np
+
+from .spatial import EdgeSnap, great_circle
+
+
+# GPS error in meters (the standard deviation of the emission probabilities) and how far from a ping its candidate roads may be
+GPS_SIGMA = 10.0
+SEARCH_RADIUS = 50.0
+
+# meters by which a route between two pings may differ from their straight-line gap per unit of log probability
+TRANSITION_BETA = 20.0
+
+# candidate roads per ping, and how many times the straight-line gap (plus twice the radius) a route between pings may run
+CANDIDATES = 5
+MAX_DETOUR = 2.0
+
+# a ping up to this many sigmas behind the previous one on the same edge is GPS noise, not a U-turn
+NOISE_SIGMAS = 3
+
+
+class MatchedPoint(NamedTuple):
+    """where one GPS ping of a trace was matched, as MapMatcher.stream yields them
+
+    Attributes:
+        index (int): position of the ping in the trace
+        edge (int): CSR position of the matched edge, -1 when no road was in range
+        fraction (float): how far along the edge the ping was placed, from 0 at its tail to 1 at its head
+        lat (float): latitude of the matched position
+        lng (float): longitude of the matched position
+        distance (float): meters driven since the previous matched ping, 0 where the match starts or restarts
+        edges (list): CSR positions of the edges driven since the previous matched ping, ending on this ping's edge
+        restart (bool): no route joins this ping to the previous matched one, or it is the first
+    """
+    index: int
+    edge: int
+    fraction: float
+    lat: float
+    lng: float
+    distance: float
+    edges: list
+    restart: bool
+
+
+class _Ping:
+    """one ping waiting in the matcher's window, with its candidate positions once they are looked up"""
+
+    def __init__(self, index: int, lat: float, lng: float):
+        self.index, self.lat, self.lng = index, lat, lng
+        self.edges = None
+
+
+class MapMatcher:
+    """matches noisy GPS traces to the roads they were driven on, with a hidden Markov model decoded by Viterbi
+
+    Every ping's candidate positions are the nearest points on the roads within a radius (EdgeIndex.candidates),
+    scored by their distance from the ping. Moving from one ping's candidate to the next is scored by how far
+    the route between them strays from the straight-line gap (Newson and Krumm, 2009), so the decoded path
+    follows roads the vehicle could actually have driven. Where no route joins two pings, the match restarts.
+
+    Traces are decoded a window of pings at a time: the window's last pings are decoded again with the next
+    window, and the ping at the seam keeps its decided position, so memory stays bounded on traces of any
+    length and the result matches whole-trace decoding wherever the window is longer than the ambiguity.
+
+    Routes are searched by length, from each candidate's end nodes out to a bound set by the gap, and the
+    bounded shortest-path trees are kept in a least-recently-used cache, so consecutive pings and traces
+    over the same streets reuse them.
+
+    Args:
+        csr (CSRGraph): the routing arrays of the graph
+        edges (EdgeIndex): the edge index of the same graph
+        radius (float): meters from a ping its candidate roads may be
+        candidates (int): candidate roads kept per ping
+        sigma (float): the GPS error in meters
+        beta (float): the route-versus-gap difference in meters that costs one unit of log probability
+        window (int): pings decoded at a time
+        cache_size (int): shortest-path trees kept
+    """
+
+    def __init__(
+        self,
+        csr,
+        edges,
+        radius: float = SEARCH_RADIUS,
+        candidates: int = CANDIDATES,
+        sigma: float = GPS_SIGMA,
+        beta: float = TRANSITION_BETA,
+        window: int = 64,
+        cache_size: int = 4096):
+
+        if window < 4:
+            raise ValueError(f"The window must hold at least 4 pings, got {window}.")
+        self.csr = csr
+        self.edges = edges
+        self.lengths = csr.edge_weights("length")
+        self.radius = radius
+        self.candidates = candidates
+        self.sigma = sigma
+        self.beta = beta
+        self.window = window
+        # the last pings of every window are decoded again with the next one
+        self.lag = max(1, window // 4)
+        self.cache_size = cache_size
+        self._trees = OrderedDict()
+
+
+    def match(self, lats, lngs) -> dict:
+        """matches one trace
+
+        Args:
+            lats (array-like): latitudes of the pings, in time order
+            lngs (array-like): longitudes of the pings
+
+        Returns:
+            match (dict): 'edges' (CSR positions of the edges driven, in order), 'distance' (meters driven between the
+                first and last matched ping), 'points' (an EdgeSnap of the matched position of every ping, edge -1
+                where no road was in range) and 'breaks' (the pings where the match restarted)
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lngs = np.atleast_1d(np.asarray(lngs, dtype=float))
+        points = [None] * len(lats)
+        driven, distance, breaks = [], 0.0, []
+        started = False
+        for point in self.stream(zip(lats.tolist(), lngs.tolist())):
+            points[point.index] = point
+            distance += point.distance
+            if point.restart and started:
+                breaks.append(point.index)
+            started = started or point.edge >= 0
+            for edge in point.edges:
+                if not driven or driven[-1] != edge:
+                    driven.append(edge)
+        snapped = np.array([point[1:5] for point in points], dtype=float).reshape(-1, 4)
+        gaps = great_circle(lats, lngs, snapped[:, 2], snapped[:, 3])
+        return {
+            "edges": np.array(driven, dtype=np.int64),
+            "distance": distance,
+            "points": EdgeSnap(snapped[:, 0].astype(np.int64), snapped[:, 1], gaps, snapped[:, 2], snapped[:, 3]),
+            "breaks": breaks,
+        }
+
+
+    def match_many(self, traces) -> list:
+        """matches every trace in turn, sharing the shortest-path cache between them
+
+        Args:
+            traces (iterable): one (N, 2) array or list of lat-long pings per trace
+
+        Returns:
+            matches (list): a match() result per trace
+        """
+        matches = []
+        for trace in traces:
+            points = np.asarray(trace, dtype=float).reshape(-1, 2)
+            matches.append(self.match(points[:, 0], points[:, 1]))
+        return matches
+
+
+    def stream(self, points):
+        """matches a trace as its pings arrive, yielding each ping in order once its position is decided
+
+        A ping is decided once the window after it fills up, so a live feed is matched with a delay of at
+        most a window of pings and the whole trace never has to be held in memory.
+
+        Args:
+            points (iterable): lat-long pings in time order
+
+        Yields:
+            point (MatchedPoint): every ping, in order
+        """
+        window, anchor, reached = [], None, None
+        for index, (lat, lng) in enumerate(points):
+            window.append(_Ping(index, float(lat), float(lng)))
+            if len(window) >= self.window:
+                decided, window, anchor = self._decode(window, anchor, final=False)
+                for point in decided:
+                    point, reached = self._measured(point, reached)
+                    yield point
+        decided, _, _ = self._decode(window, anchor, final=True)
+        for point in decided:
+            point, reached = self._measured(point, reached)
+            yield point
+
+
+    def _measured(self, point: MatchedPoint, reached: tuple) -> tuple:
+        """counts a ping's distance from the furthest point reached on the edge before, not from the previous ping
+
+        GPS noise puts some pings a little behind the one before on the same edge. Those count as no
+        movement, and the next movement counts from the furthest ping, so the stretch is not driven twice.
+
+        Args:
+            point (MatchedPoint): the decided ping
+            reached (tuple): (edge, fraction, furthest fraction) of the previous matched ping
+
+        Returns:
+            point (MatchedPoint): the ping with its distance counted that way
+            reached (tuple): the same for this ping
+        """
+        if point.edge < 0:
+            return point, reached
+        if point.restart or reached is None:
+            return point, (point.edge, point.fraction, point.fraction)
+        edge, fraction, furthest = reached
+        length = float(self.lengths[edge])
+        if point.edge == edge and len(point.edges) == 1:
+            distance = max(point.fraction - furthest, 0.0) * length
+            return point._replace(distance=distance), (edge, point.fraction, max(furthest, point.fraction))
+        distance = point.distance - (furthest - fraction) * length
+        return point._replace(distance=distance), (point.edge, point.fraction, point.fraction)
+
+
+    def _decode(self, window: list, anchor: int, final: bool) -> tuple:
+        """runs Viterbi over a window and returns the pings it decides, the pings left over and the seam's state
+
+        With an anchor, the first ping of the window was decided (and yielded) by the window before, on
+        the candidate the anchor names.
+        """
+        pending = [ping for ping in window if ping.edges is None]
+        if pending:
+            self._candidates(pending)
+
+        steps = [ping for ping in window if len(ping.edges)]
+        scores, links = [], []
+        for step, ping in enumerate(steps):
+            emission = -0.5 * (ping.distances / self.sigma) ** 2
+            if step == 0 and anchor is not None and ping is window[0]:
+                fixed = np.full(len(ping.edges), -np.inf)
+                fixed[anchor] = 0.0
+                scores.append(fixed)
+                links.append(None)
+                continue
+            if step > 0:
+                transitions, routes = self._transitions(steps[step - 1], ping)
+                totals = scores[-1][:, None] + transitions
+                previous = totals.argmax(axis=0)
+                best = totals[previous, np.arange(len(ping.edges))]
+                if np.isfinite(best).any():
+                    scores.append(best + emission)
+                    links.append((previous, routes))
+                    continue
+            # the first ping, or one no route reaches: the match (re)starts here
+            scores.append(emission)
+            links.append(None)
+
+        states = [0] * len(steps)
+        for step in range(len(steps) - 1, -1, -1):
+            following = step + 1 < len(steps) and links[step + 1] is not None
+            states[step] = int(links[step + 1][0][states[step + 1]]) if following else int(np.argmax(scores[step]))
+
+        # decide up to the last matched ping before the lag, which becomes the next window's anchor
+        cut = len(window) - 1
+        if not final:
+            decidable = [position for position, ping in enumerate(window[:len(window) - self.lag]) if len(ping.edges)]
+            cut = decidable[-1] if decidable and decidable[-1] > 0 else len(window) - self.lag - 1
+        step_of = {id(ping): step for step, ping in enumerate(steps)}
+        decided = []
+        for position, ping in enumerate(window[:cut + 1]):
+            if position == 0 and anchor is not None:
+                continue
+            step = step_of.get(id(ping))
+            if step is None:
+                decided.append(MatchedPoint(ping.index, -1, math.nan, math.nan, math.nan, 0.0, [], False))
+                continue
+            state = states[step]
+            edge = int(ping.edges[state])
+            if links[step] is None:
+                distance, driven, restart = 0.0, [edge], True
+            else:
+                previous = states[step - 1]
+                distance, route = links[step][1][previous, state]
+                driven, restart = self._driven(steps[step - 1], previous, ping, state, route), False
+            decided.append(MatchedPoint(
+                ping.index, edge, float(ping.fractions[state]), float(ping.lats[state]), float(ping.lngs[state]),
+                float(distance), driven, restart))
+
+        # a seam on a ping with no road in range carries nothing over, and the match restarts after it
+        step = step_of.get(id(window[cut]))
+        if step is None:
+            return decided, window[cut + 1:], None
+        return decided, window[cut:], states[step]
+
+
+    def _candidates(self, pings: list):
+        """looks up the candidate positions of pings, once in each direction a street can be driven"""
+        csr, lengths = self.csr, self.lengths
+        found = self.edges.candidates([ping.lat for ping in pings], [ping.lng for ping in pings], self.radius, self.candidates)
+        # the edge index holds one edge of each two-way street, so the other direction is added here
+        reverse = np.array([csr.reverse_edge(edge, "length") if edge >= 0 else -1 for edge in found.edges.ravel().tolist()]).reshape(found.edges.shape)
+        edges = np.concatenate((found.edges, reverse), axis=1)
+        fractions = np.concatenate((found.fractions, 1.0 - found.fractions), axis=1)
+        for row, ping in enumerate(pings):
+            # closed edges cannot be driven, and a street indexed in both directions gives each edge twice
+            valid = np.flatnonzero(edges[row] >= 0)
+            valid = valid[np.isfinite(lengths[edges[row, valid]])]
+            _, first = np.unique(edges[row, valid], return_index=True)
+            valid = np.sort(valid[first])
+            column = valid % found.edges.shape[1]
+            ping.edges = edges[row, valid]
+            ping.fractions = fractions[row, valid]
+            ping.distances = found.distances[row, column]
+            ping.lats, ping.lngs = found.lats[row, column], found.lngs[row, column]
+
+
+    def _transitions(self, ping: _Ping, following: _Ping) -> tuple:
+        """log probabilities of moving between every candidate of two consecutive pings, and the routes behind them
+
+        A candidate is a position on an edge in the direction it is driven, so routes leave through the edge's
+        head and arrive through the next edge's tail, and turning back is only possible at a node. A ping that
+        lands a little behind the previous one on the same edge (within NOISE_SIGMAS) is GPS noise, not a U-turn.
+
+        Returns:
+            transitions (np.ndarray): (A, B) log probabilities, -inf where no route is within reach
+            routes (dict): {(a, b): (meters, (head node, tail node, limit) or None when staying on one edge)}
+        """
+        csr, costs = self.csr, self.lengths
+        gap = float(great_circle(ping.lat, ping.lng, following.lat, following.lng))
+        limit = MAX_DETOUR * gap + 2 * self.radius
+        lengths = np.full((len(ping.edges), len(following.edges)), np.inf)
+        routes = {}
+        tails = csr.tails[following.edges].tolist()
+        entering = (following.fractions * costs[following.edges]).tolist()
+        for a, (edge, fraction) in enumerate(zip(ping.edges.tolist(), ping.fractions.tolist())):
+            length = float(costs[edge])
+            leaving = (1.0 - fraction) * length
+            head = int(csr.heads[edge])
+            distances = self._tree(head, limit)[0] if leaving <= limit else {}
+            for b, (other, end) in enumerate(zip(following.edges.tolist(), following.fractions.tolist())):
+                if other == edge and (end - fraction) * length >= -NOISE_SIGMAS * self.sigma:
+                    route, meters = None, max(end - fraction, 0.0) * length
+                else:
+                    route, meters = (head, tails[b], limit), leaving + distances.get(tails[b], math.inf) + entering[b]
+                if meters <= limit:
+                    lengths[a, b] = meters
+                    routes[a, b] = (meters, route)
+        return -np.abs(lengths - gap) / self.beta, routes
+
+
+    def _tree(self, source: int, limit: float) -> tuple:
+        """the bounded shortest-path tree by length from a node, {node: meters} and {node: parent}, cached"""
+        cached = self._trees.get(source)
+        if cached is not None and cached[0] >= limit:
+            self._trees.move_to_end(source)
+            return cached[1], cached[2]
+        # grow a cached tree geometrically, so a node reached with ever larger gaps is searched a few times at most
+        if cached is not None:
+            limit = max(limit, 2 * cached[0])
+
+        indptr, heads, costs = self.csr.adjacency("length")
+        distances, parents = {source: 0.0}, {source: -1}
+        heap = [(0.0, source)]
+        while heap:
+            cost, u = heappop(heap)
+            if cost > distances[u]:
+                continue
+            for e in range(indptr[u], indptr[u + 1]):
+                v = heads[e]
+                v_cost = cost + costs[e]
+                if v_cost <= limit and v_cost < distances.get(v, math.inf):
+                    distances[v] = v_cost
+                    parents[v] = u
+                    heappush(heap, (v_cost, v))
+
+        self._trees[source] = (limit, distances, parents)
+        self._trees.move_to_end(source)
+        while len(self._trees) > self.cache_size:
+            self._trees.popitem(last=False)
+        return distances, parents
+
+
+    def _driven(self, ping: _Ping, state: int, following: _Ping, next_state: int, route: tuple) -> list:
+        """the CSR positions of the edges driven from one matched position to the next, both end edges included"""
+        edge, other = int(ping.edges[state]), int(following.edges[next_state])
+        if route is None:
+            return [edge]
+        head, tail, limit = route
+        _, parents = self._tree(head, limit)
+        nodes = [tail]
+        while nodes[-1] != head:
+            nodes.append(parents[nodes[-1]])
+        nodes.reverse()
+        indptr, heads, costs = self.csr.adjacency("length")
+        middle = [
+            min((e for e in range(indptr[u], indptr[u + 1]) if heads[e] == v), key=costs.__getitem__)
+            for u, v in zip(nodes, nodes[1:])
+        ]
+        return [edge] + middle + [other]
+
+
+def match_to_ids(csr, match: dict) -> dict:
+    """a MapMatcher.match result in graph terms: edges as (u, v, key) and the matched pings as an (N, 2) lat-long array"""
+    edges = match["edges"]
+    return {
+        "edges": list(zip(csr.nodes[csr.tails[edges]].tolist(), csr.nodes[csr.heads[edges]].tolist(), csr.keys[edges].tolist())),
+        "distance": match["distance"],
+        "points": np.column_stack((match["points"].lats, match["points"].lngs)),
+        "breaks": match["breaks"],
+    }
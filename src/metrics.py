@@ -0,0 +1,151 @@
+import time
+import inspect
+import functools
+import threading
+from collections import deque
+
+import numpy as np
+
+
+def percentiles(latencies) -> dict:
+    """returns the mean, p50, p95 and p99 of a list of latencies, in their unit"""
+    if not len(latencies):
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    return {
+        "mean": float(np.mean(latencies)),
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "p99": float(np.percentile(latencies, 99)),
+    }
+
+
+class Metrics:
+    """per-method call counts, cache hits and wall time of the Index methods, off unless an Index is given one
+
+    Percentiles are computed over the latest window calls of each method, the counts and totals over every
+    call since the last reset. A sink receives each call as it is recorded, for metrics systems that are
+    pushed to (statsd, OpenTelemetry); export() gives flat counters for ones that scrape (Prometheus).
+
+    Args:
+        window (int): the calls per method kept for latency percentiles
+        sink (callable): optional sink(method, seconds, cache_hit) called after every recorded call
+    """
+
+    def __init__(self, window: int = 1024, sink=None):
+        self.window = window
+        self.sink = sink
+        self._methods = {}
+        self._lock = threading.Lock()
+
+
+    def record(self, method: str, seconds: float, cache_hit: bool = False):
+        """counts one call of a method that took seconds of wall time"""
+        with self._lock:
+            entry = self._methods.get(method)
+            if entry is None:
+                entry = self._methods[method] = {"calls": 0, "cache_hits": 0, "seconds": 0.0, "latencies": deque(maxlen=self.window)}
+            entry["calls"] += 1
+            entry["cache_hits"] += cache_hit
+            entry["seconds"] += seconds
+            entry["latencies"].append(seconds * 1000)
+        if self.sink is not None:
+            self.sink(method, seconds, cache_hit)
+
+
+    def stats(self) -> dict:
+        """returns {method: {calls, cache_hits, hit_rate, seconds, latency_ms: {mean, p50, p95, p99}}}"""
+        with self._lock:
+            return {
+                method: {
+                    "calls": entry["calls"],
+                    "cache_hits": entry["cache_hits"],
+                    "hit_rate": entry["cache_hits"] / entry["calls"],
+                    "seconds": entry["seconds"],
+                    "latency_ms": percentiles(list(entry["latencies"])),
+                }
+                for method, entry in self._methods.items()
+            }
+
+
+    def export(self, prefix: str = "index") -> dict:
+        """returns the stats as flat {'<prefix>.<method>.<stat>': number} pairs, e.g. 'index.get_road_distance.p95_ms'"""
+        flat = {}
+        for method, stats in self.stats().items():
+            for stat in ("calls", "cache_hits", "seconds"):
+                flat[f"{prefix}.{method}.{stat}"] = stats[stat]
+            for stat, value in stats["latency_ms"].items():
+                flat[f"{prefix}.{method}.{stat}_ms"] = value
+        return flat
+
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+
+
+def timed(method):
+    """records the calls and wall time of an Index method in the instance's metrics, a no-op when it has none
+
+    Stacked above cached, calls answered from the cache are counted as cache hits.
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        metrics = self.metrics
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        _CACHE_HIT.method = None
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            metrics.record(name, time.perf_counter() - start, cache_hit=_CACHE_HIT.method == name)
+    return wrapper
+
+
+def timed_static(metrics):
+    """timed for static methods, which have no instance: metrics() returns the Metrics to record in, or None
+
+    A generator is timed from its first item until it is exhausted or closed, not just while it is created.
+    """
+    def decorate(method):
+        name = method.__name__
+
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def generator(*args, **kwargs):
+                recorder = metrics()
+                if recorder is None:
+                    return (yield from method(*args, **kwargs))
+                start = time.perf_counter()
+                try:
+                    return (yield from method(*args, **kwargs))
+                finally:
+                    recorder.record(name, time.perf_counter() - start)
+            return generator
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            recorder = metrics()
+            if recorder is None:
+                return method(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                recorder.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+class _LastHit(threading.local):
+    method = None
+
+
+# the method whose value cached last returned from the cache on this thread, which timed checks after a call
+_CACHE_HIT = _LastHit()
+
+
+def count_cache_hit(method: str):
+    _CACHE_HIT.method = method
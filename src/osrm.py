@@ -0,0 +1,263 @@
+import asyncio
+import threading
+
+import httpx
+import numpy as np
+
+
+# the public demo server Index.get_route has always used, point base_url at your own OSRM for real traffic
+OSRM_URL = "http://router.project-osrm.org"
+
+# status codes worth another try: rate limiting and the server or a proxy in front of it being briefly unavailable
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class OSRMError(RuntimeError):
+    """OSRM answered, but with an error code instead of a result"""
+
+    def __init__(self, code: str, message: str = ""):
+        super().__init__(f"OSRM returned {code}: {message}" if message else f"OSRM returned {code}")
+        self.code = code
+
+
+class AsyncOSRMClient:
+    """asyncio client for an OSRM server that keeps one pool of keep-alive connections for all its requests
+
+    Requests beyond max_concurrency wait for a free slot instead of opening more connections, and transport
+    errors and retryable statuses are retried with exponential backoff. Use it as an async context manager,
+    or call aclose when done.
+
+    Args:
+        base_url (str): the OSRM server. example: 'http://localhost:5000'
+        profile (str): the routing profile in the URL. example: 'driving', 'walking', 'cycling'
+        max_concurrency (int): the most requests in flight at once, also the size of the connection pool
+        retries (int): how many times a failed request is retried
+        backoff (float): seconds before the first retry, doubled for each one after it
+        timeout (float): seconds before a request times out
+        table_size (int): the most sources or destinations per table request, OSRM's --max-table-size
+        transport (httpx.AsyncBaseTransport): optional transport, e.g. httpx.MockTransport in tests
+    """
+
+    def __init__(
+        self,
+        base_url: str = OSRM_URL,
+        profile: str = "driving",
+        max_concurrency: int = 32,
+        retries: int = 3,
+        backoff: float = 0.1,
+        timeout: float = 10.0,
+        table_size: int = 100,
+        transport: httpx.AsyncBaseTransport = None):
+
+        self.base_url = base_url.rstrip("/")
+        self.profile = profile
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.table_size = table_size
+        self.transport = transport
+        self._client = None
+        self._slots = None
+
+
+    async def __aenter__(self) -> "AsyncOSRMClient":
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+    async def aclose(self):
+        """closes the pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._slots = None
+
+
+    async def route(self, origin: tuple, destination: tuple) -> tuple:
+        """returns the (distance, duration) of the fastest route between two lat-long points
+
+        Args:
+            origin (tuple): origin lat-long point. example: (37.7749, -122.4194)
+            destination (tuple): destination lat-long point example: (37.7749, -122.4194)
+
+        Returns:
+            distance (float): the distance of the route in meters, None when there is no route
+            duration (float): the travel time in seconds, None when there is no route
+        """
+        try:
+            data = await self._request("route", [origin, destination], {"overview": "false"})
+        except OSRMError as e:
+            if e.code == "NoRoute":
+                return None, None
+            raise
+        routes = data.get("routes", [])
+        if not routes:
+            return None, None
+        return routes[0]["distance"], routes[0]["duration"]
+
+
+    async def routes(self, pairs: list) -> list:
+        """runs route for every (origin, destination) pair concurrently, in order"""
+        return await asyncio.gather(*(self.route(origin, destination) for origin, destination in pairs))
+
+
+    async def table(self, sources: list, destinations: list = None) -> tuple:
+        """returns the road distance and travel time matrices between every source and destination
+
+        Large matrices are split into blocks of at most table_size sources and destinations, and the
+        blocks are requested concurrently.
+
+        Args:
+            sources (list): source lat-long points. example: [(37.7749, -122.4194), ...]
+            destinations (list): destination lat-long points, the sources when omitted
+
+        Returns:
+            distances (np.ndarray): (len(sources), len(destinations)) matrix in meters
+            durations (np.ndarray): matching matrix in seconds. both are -1 where no route exists
+        """
+        sources = list(sources)
+        destinations = sources if destinations is None else list(destinations)
+        distances = np.full((len(sources), len(destinations)), -1.0)
+        durations = np.full((len(sources), len(destinations)), -1.0)
+        # a block sends its sources and destinations together, so each gets half the size limit
+        block = max(1, self.table_size // 2)
+
+        async def fill(row: int, column: int):
+            block_sources = sources[row:row + block]
+            block_destinations = destinations[column:column + block]
+            data = await self._request("table", block_sources + block_destinations, {
+                "sources": ";".join(str(i) for i in range(len(block_sources))),
+                "destinations": ";".join(str(len(block_sources) + i) for i in range(len(block_destinations))),
+                "annotations": "distance,duration",
+            })
+            rows, columns = slice(row, row + len(block_sources)), slice(column, column + len(block_destinations))
+            distances[rows, columns] = _matrix(data.get("distances"), len(block_sources), len(block_destinations))
+            durations[rows, columns] = _matrix(data.get("durations"), len(block_sources), len(block_destinations))
+
+        await asyncio.gather(*(
+            fill(row, column)
+            for row in range(0, len(sources), block)
+            for column in range(0, len(destinations), block)))
+        return distances, durations
+
+
+    async def nearest(self, point: tuple, number: int = 1) -> list:
+        """returns the nearest points on the road network to a lat-long point
+
+        Args:
+            point (tuple): lat-long point. example: (37.7749, -122.4194)
+            number (int): how many snapped points to return
+
+        Returns:
+            points (list): [(lat, long, distance in meters), ...], nearest first
+        """
+        data = await self._request("nearest", [point], {"number": str(number)})
+        return [
+            (waypoint["location"][1], waypoint["location"][0], waypoint["distance"])
+            for waypoint in data.get("waypoints", [])]
+
+
+    async def _request(self, service: str, points: list, params: dict) -> dict:
+        """sends one OSRM request, waiting for a free slot and retrying transient failures"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+                transport=self.transport)
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+
+        coordinates = ";".join(f"{point[1]},{point[0]}" for point in points)
+        url = f"/{service}/v1/{self.profile}/{coordinates}"
+        async with self._slots:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = await self._client.get(url, params=params)
+                    if response.status_code not in RETRY_STATUSES:
+                        break
+                    failure = httpx.HTTPStatusError(
+                        f"OSRM returned status {response.status_code}", request=response.request, response=response)
+                except httpx.TransportError as e:
+                    failure = e
+                if attempt == self.retries:
+                    raise failure
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+        data = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+        if data.get("code", "Ok") != "Ok":
+            raise OSRMError(data["code"], data.get("message", ""))
+        response.raise_for_status()
+        return data
+
+
+class OSRMClient:
+    """blocking wrapper around AsyncOSRMClient for code that is not async
+
+    The async client runs on an event loop in a background thread that lives as long as this object,
+    so its connection pool stays warm between calls instead of being rebuilt for every route.
+
+    Args:
+        **kwargs: passed on to AsyncOSRMClient. example: base_url='http://localhost:5000'
+    """
+
+    def __init__(self, **kwargs):
+        self.client = AsyncOSRMClient(**kwargs)
+        self._loop = None
+        self._lock = threading.Lock()
+
+
+    def route(self, origin: tuple, destination: tuple) -> tuple:
+        """returns the (distance, duration) of the fastest route between two lat-long points, see AsyncOSRMClient.route"""
+        return self._run(self.client.route(origin, destination))
+
+
+    def routes(self, pairs: list) -> list:
+        """returns (distance, duration) for every (origin, destination) pair, requested concurrently"""
+        return self._run(self.client.routes(pairs))
+
+
+    def table(self, sources: list, destinations: list = None) -> tuple:
+        """returns the (distances, durations) matrices between sources and destinations, see AsyncOSRMClient.table"""
+        return self._run(self.client.table(sources, destinations))
+
+
+    def nearest(self, point: tuple, number: int = 1) -> list:
+        """returns [(lat, long, distance), ...] of the nearest road points, see AsyncOSRMClient.nearest"""
+        return self._run(self.client.nearest(point, number))
+
+
+    def close(self):
+        """closes the connections and stops the background event loop"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.client.aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+
+
+    def __enter__(self) -> "OSRMClient":
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def _run(self, coroutine):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="osrm-client", daemon=True).start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+def _matrix(rows: list, height: int, width: int) -> np.ndarray:
+    """turns an OSRM table annotation into a float matrix, -1 where OSRM found no route"""
+    if rows is None:
+        return np.full((height, width), -1.0)
+    return np.array([[-1.0 if value is None else value for value in row] for row in rows], dtype=float)
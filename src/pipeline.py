@@ -0,0 +1,165 @@
+import os
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+
+
+TRIP_COLUMNS = ("origin_lat", "origin_lng", "destination_lat", "destination_lng")
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+
+
+def is_parquet(path: str) -> bool:
+    return os.path.splitext(str(path))[1].lower() in PARQUET_EXTENSIONS
+
+
+def read_chunks(path: str, chunk_size: int):
+    """yields a file's rows as DataFrames of at most chunk_size rows, CSV or, by extension, Parquet"""
+    if not is_parquet(path):
+        yield from pd.read_csv(path, chunksize=chunk_size)
+        return
+    import pyarrow.parquet as pq
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield batch.to_pandas()
+
+
+class ChunkWriter:
+    """appends DataFrames to a CSV or, by extension, Parquet file, so only one chunk is in memory at a time
+
+    Parquet chunks are cast to the schema of the first one, so a column that is all integers in one
+    chunk and has gaps in the next still lands in a single row group schema.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self._writer = None
+        self._started = False
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+
+    def __enter__(self) -> "ChunkWriter":
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def write(self, frame: pd.DataFrame):
+        if not is_parquet(self.path):
+            frame.to_csv(self.path, mode="a" if self._started else "w", header=not self._started, index=False)
+            self._started = True
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self._writer is None:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = pa.Table.from_pandas(frame, schema=self._writer.schema, preserve_index=False)
+        self._writer.write_table(table)
+        self._started = True
+
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def tile_order(origins: np.ndarray, destinations: np.ndarray, tile_size: float) -> tuple:
+    """orders trips by the tiles of their origin and destination, so trips that share a graph are contiguous
+
+    Args:
+        origins (np.ndarray): (N, 2) lat-long points
+        destinations (np.ndarray): (N, 2) lat-long points
+        tile_size (float): tile edge length in degrees, as in GraphTileCache
+
+    Returns:
+        order (np.ndarray): the permutation that groups the trips
+        starts (np.ndarray): where each group begins in the permuted trips, followed by N
+    """
+    keys = _tile_keys(origins, destinations, tile_size)
+    order = np.lexsort(keys.T[::-1])
+    return order, _group_starts(keys[order])
+
+
+def tile_groups(origins: np.ndarray, destinations: np.ndarray, tile_size: float) -> np.ndarray:
+    """where each group of trips sharing origin and destination tiles begins, for trips already in tile_order
+
+    Returns:
+        starts (np.ndarray): the first trip of every group, followed by N
+    """
+    return _group_starts(_tile_keys(origins, destinations, tile_size))
+
+
+def _tile_keys(origins: np.ndarray, destinations: np.ndarray, tile_size: float) -> np.ndarray:
+    return np.floor(np.column_stack((origins, destinations)) / tile_size).astype(np.int64)
+
+
+def _group_starts(keys: np.ndarray) -> np.ndarray:
+    changed = np.any(keys[1:] != keys[:-1], axis=1)
+    return np.concatenate(([0], np.flatnonzero(changed) + 1, [len(keys)]))
+
+
+def log_progress(report: dict):
+    logging.info(
+        f"routed {report['rows']} trips in {report['chunks']} chunks, "
+        f"{report['rows_per_second']:.0f} rows/s, {report['unrouted']} without a route")
+
+
+def route_file(
+    input_path: str,
+    output_path: str,
+    route,
+    columns: tuple = TRIP_COLUMNS,
+    chunk_size: int = 100_000,
+    tile_size: float = 0.05,
+    progress=log_progress) -> dict:
+
+    """routes every trip in a CSV or Parquet file chunk by chunk, appending each routed chunk to the output
+
+    Only one chunk is held at a time, so memory stays flat however long the file is. Within a chunk the
+    trips are grouped by origin and destination tile before routing and written back in input order, with
+    every input column followed by 'distance' and 'duration'.
+
+    Args:
+        input_path (str): the trips file, CSV or Parquet (.parquet, .pq)
+        output_path (str): the results file, CSV or Parquet by extension, overwritten
+        route (callable): route(origins, destinations) -> (distances, durations) for (N, 2) lat-long arrays,
+            -1 where there is no route. the trips come in tile_order, so tile_groups splits them without sorting again
+        columns (tuple): the origin lat, origin lng, destination lat and destination lng column names
+        chunk_size (int): how many rows are read, routed and written at a time
+        tile_size (float): tile edge length in degrees used to group trips
+        progress (callable): progress(report) after every chunk, logs the throughput by default
+
+    Returns:
+        report (dict): rows, chunks, unrouted (rows without a route or with invalid points), seconds and rows_per_second
+    """
+    report = {"rows": 0, "chunks": 0, "unrouted": 0, "seconds": 0.0, "rows_per_second": 0.0}
+    start = time.perf_counter()
+    with ChunkWriter(output_path) as writer:
+        for frame in read_chunks(input_path, chunk_size):
+            points = frame[list(columns)].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+            valid = np.isfinite(points).all(axis=1) & (np.abs(points[:, [0, 2]]) <= 90).all(axis=1)
+            distances = np.full(len(frame), -1.0)
+            durations = np.full(len(frame), -1.0)
+            rows = np.flatnonzero(valid)
+            if len(rows):
+                order, _ = tile_order(points[rows, :2], points[rows, 2:], tile_size)
+                rows = rows[order]
+                distances[rows], durations[rows] = route(points[rows, :2], points[rows, 2:])
+
+            writer.write(frame.assign(distance=distances, duration=durations))
+            report["rows"] += len(frame)
+            report["chunks"] += 1
+            report["unrouted"] += int((distances < 0).sum())
+            report["seconds"] = time.perf_counter() - start
+            report["rows_per_second"] = report["rows"] / report["seconds"] if report["seconds"] else 0.0
+            if progress is not None:
+                progress(dict(report))
+    return report
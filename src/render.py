@@ -0,0 +1,241 @@
+import os
+import math
+import time
+import concurrent.futures
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+
+
+# web mercator tiles are this many pixels square, and stop at this latitude
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798
+
+
+def mercator_pixels(lats, lngs, zoom: int, tile_size: int = TILE_SIZE) -> tuple:
+    """maps lat-long points to global web mercator pixel coordinates at a zoom level, y growing southwards"""
+    lats = np.clip(np.asarray(lats, dtype=float), -MAX_LATITUDE, MAX_LATITUDE)
+    scale = tile_size * 2 ** zoom
+    x = (np.asarray(lngs, dtype=float) + 180) / 360 * scale
+    y = (1 - np.arcsinh(np.tan(np.radians(lats))) / math.pi) / 2 * scale
+    return x, y
+
+
+def tile_range(north: float, south: float, east: float, west: float, zoom: int) -> tuple:
+    """returns the ranges of tile columns and rows covering a bounding box at a zoom level"""
+    (left, right), (top, bottom) = mercator_pixels([north, south], [west, east], zoom, tile_size=1)
+    last = 2 ** zoom - 1
+    return (
+        range(max(0, math.floor(left)), min(last, math.floor(right)) + 1),
+        range(max(0, math.floor(top)), min(last, math.floor(bottom)) + 1))
+
+
+def simplify_segments(segments: np.ndarray, tolerance: float) -> np.ndarray:
+    """snaps segment ends to a grid of tolerance-sized cells, dropping segments that collapse and duplicates
+
+    Consecutive segments of a line share their snapped end, so lines stay connected while detail smaller
+    than a cell, which could not be seen anyway, goes away. Cost and output size stop growing with the
+    graph once there are more segments than cells.
+
+    Args:
+        segments (np.ndarray): (S, 2, 2) segment ends in the drawing's units, e.g. pixels
+        tolerance (float): the cell size, 0 to keep every segment
+
+    Returns:
+        segments (np.ndarray): the simplified (S', 2, 2) segments
+    """
+    if tolerance <= 0 or not len(segments):
+        return segments
+    cells = np.round(segments / tolerance).astype(np.int64)
+    moving = (cells[:, 0] != cells[:, 1]).any(axis=1)
+    cells = cells[moving]
+    # a segment and its reverse draw the same pixels
+    flip = (cells[:, 0, 0] > cells[:, 1, 0]) | ((cells[:, 0, 0] == cells[:, 1, 0]) & (cells[:, 0, 1] > cells[:, 1, 1]))
+    cells[flip] = cells[flip][:, ::-1]
+    return np.unique(cells.reshape(-1, 4), axis=0).reshape(-1, 2, 2) * float(tolerance)
+
+
+def draw_segments(
+    segments: np.ndarray,
+    path: str,
+    limits: tuple,
+    width: int,
+    height: int,
+    line_width: float = 1.0,
+    color: str = "black",
+    background: str = None,
+    title: str = None):
+
+    """draws segments as one line collection and saves the image, without touching pyplot's global state
+
+    Args:
+        segments (np.ndarray): (S, 2, 2) segment ends in the drawing's units
+        path (str): the image file, its format taken from the extension
+        limits (tuple): (left, right, bottom, top) of the drawing in the segments' units
+        width (int): image width in pixels
+        height (int): image height in pixels
+        line_width (float): line width in pixels
+        color (str): line color
+        background (str): background color, transparent when None
+        title (str): optional title drawn above the lines
+    """
+    figure, lines = _canvas(limits, width, height, line_width, color)
+    lines.set_segments(segments)
+    if title:
+        figure.axes[0].set_title(title, y=1.0, pad=-14)
+    figure.savefig(path, transparent=background is None, facecolor=background or "none")
+
+
+def _canvas(limits: tuple, width: int, height: int, line_width: float, color: str) -> tuple:
+    """an off-screen figure filled by one empty line collection, returned as (figure, collection)"""
+    dpi = 100
+    figure = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    FigureCanvasAgg(figure)
+    axes = figure.add_axes((0, 0, 1, 1))
+    axes.set_axis_off()
+    lines = axes.add_collection(LineCollection([], linewidths=line_width * 72 / dpi, colors=color, antialiaseds=True))
+    axes.set_xlim(limits[0], limits[1])
+    axes.set_ylim(limits[2], limits[3])
+    return figure, lines
+
+
+def render_image(
+    segments: np.ndarray,
+    path: str,
+    size: int = 1200,
+    line_width: float = 0.8,
+    color: str = "black",
+    background: str = "white",
+    title: str = None) -> tuple:
+
+    """draws lng-lat segments as a web mercator image, simplified to what the image's resolution can show
+
+    The zoom level is the fractional one at which the segments' extent spans size pixels, so a city graph and a
+    neighbourhood both draw about as many segments as the image has room for.
+
+    Args:
+        segments (np.ndarray): (S, 2, 2) lng-lat segment ends
+        path (str): the image file, its format taken from the extension
+        size (int): the longer side of the image in pixels
+        line_width (float): line width in pixels
+        color (str): line color
+        background (str): background color, transparent when None
+        title (str): optional title drawn at the top
+
+    Returns:
+        shape (tuple): (width, height) of the image in pixels
+    """
+    lngs, lats = segments[:, :, 0], segments[:, :, 1]
+    x, y = mercator_pixels(lats, lngs, 0)
+    extent = max(float(x.max() - x.min()), float(y.max() - y.min())) or 1.0 / TILE_SIZE
+    # pixels at zoom 0 scaled up to the fractional zoom that fits the image
+    scale = (size - 2) / extent
+    pixels = simplify_segments(np.stack(((x - x.min()) * scale + 1, (y - y.min()) * scale + 1), axis=-1), 0.5)
+    width = max(2, int(math.ceil((x.max() - x.min()) * scale)) + 2)
+    height = max(2, int(math.ceil((y.max() - y.min()) * scale)) + 2)
+    draw_segments(pixels, path, limits=(0, width, height, 0), width=width, height=height,
+                  line_width=line_width, color=color, background=background, title=title)
+    return width, height
+
+
+# the segments each tile worker draws from, in global pixels at every zoom, set by _load_tile_worker
+_worker = {}
+
+
+def _load_tile_worker(segments: np.ndarray, zooms: list, tile_size: int, line_width: float, color: str):
+    """process pool initializer: projects and simplifies the lng-lat segments once per zoom, bucketed by tile
+
+    A segment shorter than half a tile is filed under the tile holding its midpoint, so a tile only has to
+    look at its own and its eight neighbours' buckets. Longer segments are checked by every tile.
+    """
+    # one figure per worker, its lines swapped for every tile, spares building a figure per tile
+    _worker.update(
+        tile_size=tile_size, line_width=line_width, zooms={},
+        canvas=_canvas((0, tile_size, tile_size, 0), tile_size, tile_size, line_width, color))
+    for zoom in zooms:
+        x, y = mercator_pixels(segments[:, :, 1], segments[:, :, 0], zoom, tile_size)
+        pixels = simplify_segments(np.stack((x, y), axis=-1), 0.5)
+        low, high = pixels.min(axis=1), pixels.max(axis=1)
+        long = np.flatnonzero(((high - low) > tile_size / 2).any(axis=1))
+        short = np.setdiff1d(np.arange(len(pixels)), long)
+        tiles = np.floor((low[short] + high[short]) / (2 * tile_size)).astype(np.int64)
+        keys = tiles[:, 0] * 2 ** zoom + tiles[:, 1]
+        order = np.argsort(keys, kind="stable")
+        _worker["zooms"][zoom] = (pixels, low, high, keys[order], short[order], long)
+
+
+def _draw_tile(zoom: int, column: int, row: int, path: str) -> bool:
+    """draws one XYZ tile, returning False and writing nothing when no segment crosses it"""
+    tile_size = _worker["tile_size"]
+    pixels, low, high, keys, bucketed, long = _worker["zooms"][zoom]
+    neighbours = np.array([(column + dx) * 2 ** zoom + row + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    starts, stops = np.searchsorted(keys, neighbours, side="left"), np.searchsorted(keys, neighbours, side="right")
+    candidates = np.concatenate([bucketed[a:b] for a, b in zip(starts, stops)] + [long])
+
+    left, top = column * tile_size, row * tile_size
+    # a line width of slack so lines just outside the tile still draw their edge
+    pad = _worker["line_width"]
+    candidates = candidates[
+        (high[candidates, 0] >= left - pad) & (low[candidates, 0] <= left + tile_size + pad) &
+        (high[candidates, 1] >= top - pad) & (low[candidates, 1] <= top + tile_size + pad)]
+    if not len(candidates):
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    figure, lines = _worker["canvas"]
+    lines.set_segments(pixels[candidates] - (left, top))
+    figure.savefig(path, transparent=True)
+    return True
+
+
+def render_tiles(
+    segments: np.ndarray,
+    north: float,
+    south: float,
+    east: float,
+    west: float,
+    zooms: list,
+    output_dir: str,
+    workers: int = None,
+    tile_size: int = TILE_SIZE,
+    line_width: float = 1.0,
+    color: str = "black") -> dict:
+
+    """draws transparent XYZ tiles ({zoom}/{x}/{y}.png) of lng-lat segments for a bounding box, over a process pool
+
+    Every worker projects the segments once per zoom, simplified to half a pixel, and then draws one tile at a
+    time, so memory stays at one copy of the segments per worker however many tiles are drawn.
+
+    Args:
+        segments (np.ndarray): (S, 2, 2) lng-lat segment ends
+        north, south, east, west (float): the bounding box to cover
+        zooms (list): the zoom levels to draw. example: range(12, 17)
+        output_dir (str): where the {zoom}/{x}/{y}.png tree is written
+        workers (int): how many processes draw tiles, one per core by default
+        tile_size (int): tile width and height in pixels
+        line_width (float): line width in pixels
+        color (str): line color
+
+    Returns:
+        report (dict): tiles (written), empty (tiles with nothing to draw, not written) and seconds
+    """
+    start = time.perf_counter()
+    zooms = list(zooms)
+    jobs = []
+    for zoom in zooms:
+        columns, rows = tile_range(north, south, east, west, zoom)
+        jobs += [
+            (zoom, column, row, os.path.join(output_dir, str(zoom), str(column), f"{row}.png"))
+            for column in columns for row in rows]
+
+    if not jobs:
+        return {"tiles": 0, "empty": 0, "seconds": time.perf_counter() - start}
+
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_load_tile_worker,
+            initargs=(np.asarray(segments, dtype=float), zooms, tile_size, line_width, color)) as pool:
+        drawn = list(pool.map(_draw_tile, *zip(*jobs), chunksize=max(1, len(jobs) // (8 * workers))))
+    return {"tiles": sum(drawn), "empty": len(drawn) - sum(drawn), "seconds": time.perf_counter() - start}
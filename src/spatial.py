@@ -0,0 +1,415 @@
+import math
+from typing import NamedTuple
+
+import numpy as np
+import shapely
+from scipy.spatial import cKDTree
+
+
+# same earth radius as Index.get_great_circle_distance
+EARTH_RADIUS = 6371009
+
+
+def great_circle(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """vectorized great circle distance in meters, the formula behind Index.get_great_circle_distance"""
+    lat1, lng1, lat2, lng2 = np.radians(lat1), np.radians(lng1), np.radians(lat2), np.radians(lng2)
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(1, h)))
+
+
+def to_unit_vectors(lats, lngs) -> np.ndarray:
+    """maps lat-long points to 3d points on the unit sphere, where straight-line order matches great circle order"""
+    lats, lngs = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lngs, dtype=float))
+    cos_lats = np.cos(lats)
+    return np.column_stack((cos_lats * np.cos(lngs), cos_lats * np.sin(lngs), np.sin(lats)))
+
+
+def chord_to_meters(chords) -> np.ndarray:
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(np.asarray(chords) / 2, 1.0))
+
+
+def meters_to_chord(meters) -> np.ndarray:
+    return 2 * np.sin(np.minimum(np.asarray(meters, dtype=float) / (2 * EARTH_RADIUS), np.pi / 2))
+
+
+# meters per degree of latitude, to turn meters into the edge index's planar units
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+# the edge index cuts segments into pieces up to this long, and checks this many nearest pieces per point
+SNAP_PIECE_METERS = 25
+SNAP_CANDIDATES = 8
+
+
+def corridor(lats, lngs, meters: float):
+    """returns the lng-lat polygon covering everything within some meters of a line through the points
+
+    The line is buffered in the local equirectangular plane at its mean latitude, which keeps the width
+    true to ground distance over the length of a city route.
+    """
+    lats, lngs = np.asarray(lats, dtype=float), np.asarray(lngs, dtype=float)
+    scale = math.cos(math.radians(float(np.mean(lats))))
+    planar = np.column_stack((lngs * scale, lats))
+    line = shapely.linestrings(planar) if len(planar) > 1 else shapely.points(planar[0])
+    area = shapely.buffer(line, meters / METERS_PER_DEGREE)
+    return shapely.transform(area, lambda coords: coords / (scale, 1.0))
+
+
+class NodeIndex:
+    """spatial index over the nodes of a graph, built once and shared by snapping, routing and extraction
+
+    Nearest, k-nearest and radius queries go through a KD-tree on unit-sphere coordinates, so distances
+    are exact great circle distances with no projection step. Bounding box queries use the nodes sorted
+    by latitude, which narrows every box to one band before the longitude check.
+
+    Args:
+        nodes (array-like): node ids, in the order positions refer to
+        lats (array-like): node latitudes
+        lngs (array-like): node longitudes
+    """
+
+    def __init__(self, nodes, lats, lngs):
+        self.nodes = np.asarray(nodes)
+        self.lats = np.asarray(lats, dtype=float)
+        self.lngs = np.asarray(lngs, dtype=float)
+        self.tree = cKDTree(to_unit_vectors(self.lats, self.lngs)) if len(self.nodes) else None
+        self._by_lat = np.argsort(self.lats, kind="stable")
+        self._sorted_lats = self.lats[self._by_lat]
+
+
+    @classmethod
+    def from_graph(cls, graph) -> "NodeIndex":
+        """builds the index from the x/y attributes of a networkx street network"""
+        nodes = list(graph.nodes)
+        lats = np.fromiter((data["y"] for _, data in graph.nodes(data=True)), dtype=float, count=len(nodes))
+        lngs = np.fromiter((data["x"] for _, data in graph.nodes(data=True)), dtype=float, count=len(nodes))
+        return cls(np.asarray(nodes), lats, lngs)
+
+
+    def query(self, lats, lngs, k: int = 1) -> tuple:
+        """finds the k nearest nodes to every point, in one batch
+
+        Args:
+            lats (array-like): latitudes of the query points
+            lngs (array-like): longitudes of the query points
+            k (int): how many neighbours to return per point
+
+        Returns:
+            positions (np.ndarray): (M,) positions of the nearest nodes, or (M, k) when k > 1
+            distances (np.ndarray): matching great circle distances in meters
+        """
+        if self.tree is None:
+            raise ValueError("The graph has no nodes to snap to.")
+        chords, positions = self.tree.query(to_unit_vectors(np.atleast_1d(lats), np.atleast_1d(lngs)), k=k)
+        return positions, chord_to_meters(chords)
+
+
+    def nearest(self, lats, lngs) -> np.ndarray:
+        """returns the id of the nearest node to every point"""
+        positions, _ = self.query(lats, lngs)
+        return self.nodes[positions]
+
+
+    def k_nearest(self, lats, lngs, k: int) -> np.ndarray:
+        """returns the ids of the k nearest nodes to every point as an (M, k) array, nearest first"""
+        positions, _ = self.query(lats, lngs, k=k)
+        return self.nodes[np.asarray(positions).reshape(-1, k)]
+
+
+    def within_radius(self, lat: float, lng: float, radius: float) -> np.ndarray:
+        """returns the ids of every node within radius meters of a point, nearest first"""
+        if self.tree is None:
+            return self.nodes[:0]
+        center = to_unit_vectors([lat], [lng])[0]
+        positions = np.asarray(self.tree.query_ball_point(center, float(meters_to_chord(radius))), dtype=np.int64)
+        order = np.argsort(np.linalg.norm(self.tree.data[positions] - center, axis=1), kind="stable")
+        return self.nodes[positions[order]]
+
+
+    def positions_in_bbox(self, north: float, south: float, east: float, west: float) -> np.ndarray:
+        """returns the positions of every node inside a bounding box, in graph order"""
+        start = np.searchsorted(self._sorted_lats, south, side="left")
+        stop = np.searchsorted(self._sorted_lats, north, side="right")
+        band = self._by_lat[start:stop]
+        return np.sort(band[(self.lngs[band] >= west) & (self.lngs[band] <= east)])
+
+
+    def in_bbox(self, north: float, south: float, east: float, west: float) -> np.ndarray:
+        """returns the ids of every node inside a bounding box, in graph order"""
+        return self.nodes[self.positions_in_bbox(north, south, east, west)]
+
+
+    def positions_in_polygon(self, polygon) -> np.ndarray:
+        """returns the positions of every node inside or on a lng-lat shapely polygon, in graph order
+
+        Only the nodes inside the polygon's bounding box are tested against its outline.
+        """
+        west, south, east, north = shapely.bounds(polygon)
+        band = self.positions_in_bbox(north, south, east, west)
+        shapely.prepare(polygon)
+        return band[shapely.intersects_xy(polygon, self.lngs[band], self.lats[band])]
+
+
+    def in_polygon(self, polygon) -> np.ndarray:
+        """returns the ids of every node inside or on a lng-lat shapely polygon, in graph order"""
+        return self.nodes[self.positions_in_polygon(polygon)]
+
+
+class EdgeSnap(NamedTuple):
+    """where a batch of points lands on the road network, one row per point
+
+    Attributes:
+        edges (np.ndarray): position of the matched edge in the graph's CSR arrays, -1 when nothing was in range
+        fractions (np.ndarray): how far along the edge the snapped point is, from 0 at its tail to 1 at its head
+        distances (np.ndarray): meters from each point to its snapped point
+        lats (np.ndarray): latitudes of the snapped points
+        lngs (np.ndarray): longitudes of the snapped points
+    """
+    edges: np.ndarray
+    fractions: np.ndarray
+    distances: np.ndarray
+    lats: np.ndarray
+    lngs: np.ndarray
+
+
+class EdgeIndex:
+    """index over the straight segments of every edge geometry, for snapping points onto the roads themselves
+
+    Segments are cut into pieces no longer than SNAP_PIECE_METERS and the piece midpoints go into a KD-tree, in a
+    local equirectangular plane (longitudes scaled by the cosine of the graph's mean latitude) that keeps
+    nearest-segment order true to ground distance across a city-sized graph. A batch query projects every point
+    onto the segments of its nearest few pieces, which is exact whenever the best projection is closer than
+    any piece left out could be; the rare points where that cannot be shown go to a shapely STRtree (an R-tree)
+    over the whole segments. A two-way street stored as two edges with mirrored geometries is indexed once, on
+    the edge whose tail comes first, and routing reaches the other direction through the reverse edge.
+
+    Args:
+        edges (np.ndarray): (S,) CSR position of the edge each segment belongs to
+        starts (np.ndarray): (S, 2) lng-lat start of every segment
+        ends (np.ndarray): (S, 2) lng-lat end of every segment
+        offsets (np.ndarray): (S,) meters along the edge at which each segment starts
+        edge_lengths (np.ndarray): (E,) geometric length of every edge in meters
+    """
+
+    def __init__(self, edges, starts, ends, offsets, edge_lengths):
+        self.edges = np.asarray(edges, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+        self.ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=float)
+        self.edge_lengths = np.asarray(edge_lengths, dtype=float)
+        self.segment_lengths = great_circle(self.starts[:, 1], self.starts[:, 0], self.ends[:, 1], self.ends[:, 0])
+        self.scale = math.cos(math.radians(float(np.mean(self.starts[:, 1])))) if len(self.edges) else 1.0
+        self._starts = self.starts * (self.scale, 1.0)
+        self._directions = self.ends * (self.scale, 1.0) - self._starts
+        self._squared = np.einsum("ij,ij->i", self._directions, self._directions)
+
+        planar_lengths = np.sqrt(self._squared)
+        pieces = np.maximum(1, np.ceil(planar_lengths / (SNAP_PIECE_METERS / METERS_PER_DEGREE))).astype(np.int64)
+        self._piece_segments = np.repeat(np.arange(len(self.edges)), pieces)
+        within = np.arange(len(self._piece_segments)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        middles = (within + 0.5) / pieces[self._piece_segments]
+        self._piece_reach = float(np.max(planar_lengths / (2 * pieces))) if len(pieces) else 0.0
+        self.tree = cKDTree(self._starts[self._piece_segments] + middles[:, None] * self._directions[self._piece_segments]) \
+            if len(self.edges) else None
+        self._segment_tree = None
+
+
+    @classmethod
+    def from_csr(cls, csr, geometry_coords, geometry_offsets, indexed: np.ndarray = None) -> "EdgeIndex":
+        """builds the index from edge geometries laid out in CSR edge order, as the binary graph format stores them
+
+        Args:
+            csr (CSRGraph): the routing arrays of the graph
+            geometry_coords (np.ndarray): (P, 2) lng-lat coordinates of every geometry, concatenated
+            geometry_offsets (np.ndarray): (E + 1,) where each edge's coordinates start, equal offsets for edges
+                without a geometry, which are taken as the straight line between their nodes
+            indexed (np.ndarray): optional (E,) boolean mask of the edges to index, every edge by default
+
+        Returns:
+            index (EdgeIndex): the index
+        """
+        geometry_coords = np.asarray(geometry_coords, dtype=float).reshape(-1, 2)
+        geometry_offsets = np.asarray(geometry_offsets, dtype=np.int64)
+        counts = np.diff(geometry_offsets)
+        straight = counts < 2
+        counts = np.where(straight, 2, counts)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+
+        coords = np.empty((offsets[-1], 2))
+        owners = np.repeat(np.arange(csr.edge_count), counts)
+        within = np.arange(offsets[-1]) - offsets[owners]
+        curved = ~straight[owners]
+        coords[curved] = geometry_coords[geometry_offsets[owners[curved]] + within[curved]]
+        first = offsets[:-1][straight]
+        coords[first] = np.column_stack((csr.x[csr.tails[straight]], csr.y[csr.tails[straight]]))
+        coords[first + 1] = np.column_stack((csr.x[csr.heads[straight]], csr.y[csr.heads[straight]]))
+
+        keep = ~_mirrored_twins(csr.tails, csr.heads, coords, offsets)
+        if indexed is not None:
+            keep &= np.asarray(indexed, dtype=bool)
+        segment_starts = np.arange(offsets[-1] - 1)
+        segment_starts = segment_starts[(owners[segment_starts] == owners[segment_starts + 1]) & keep[owners[segment_starts]]]
+        segment_edges = owners[segment_starts]
+        lengths = great_circle(
+            coords[segment_starts, 1], coords[segment_starts, 0], coords[segment_starts + 1, 1], coords[segment_starts + 1, 0])
+
+        edge_lengths = np.zeros(csr.edge_count)
+        np.add.at(edge_lengths, segment_edges, lengths)
+        # meters from the edge start to each segment start: running total minus the total before the edge
+        running = np.cumsum(lengths) - lengths
+        first_segment = np.searchsorted(segment_edges, segment_edges, side="left")
+        return cls(
+            edges=segment_edges,
+            starts=coords[segment_starts],
+            ends=coords[segment_starts + 1],
+            offsets=running - running[first_segment],
+            edge_lengths=edge_lengths)
+
+
+    @classmethod
+    def from_graph(cls, graph, csr, indexed: np.ndarray = None) -> "EdgeIndex":
+        """builds the index from the geometries of a networkx street network and the CSR arrays built from it"""
+        coords, owners = shapely.get_coordinates(csr.edge_attribute(graph, "geometry"), return_index=True)
+        return cls.from_csr(csr, coords, np.searchsorted(owners, np.arange(csr.edge_count + 1)), indexed=indexed)
+
+
+    def snap(self, lats, lngs, max_distance: float = None) -> EdgeSnap:
+        """projects every point onto its nearest edge, in one batch
+
+        Args:
+            lats (array-like): latitudes of the points
+            lngs (array-like): longitudes of the points
+            max_distance (float): optional search radius in meters, points with no edge inside it get edge -1
+
+        Returns:
+            snap (EdgeSnap): the matched edge, position along it and snapped point of every point
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lngs = np.atleast_1d(np.asarray(lngs, dtype=float))
+        edges = np.full(len(lats), -1, dtype=np.int64)
+        fractions = np.full(len(lats), np.nan)
+        distances = np.full(len(lats), np.nan)
+        snapped_lats = np.full(len(lats), np.nan)
+        snapped_lngs = np.full(len(lats), np.nan)
+        if self.tree is None or not len(lats):
+            return EdgeSnap(edges, fractions, distances, snapped_lats, snapped_lngs)
+
+        planar = np.column_stack((lngs * self.scale, lats))
+        k = min(SNAP_CANDIDATES, len(self._piece_segments))
+        reach, pieces = self.tree.query(planar, k=k)
+        reach, pieces = reach.reshape(len(lats), k), pieces.reshape(len(lats), k)
+        candidates = self._piece_segments[pieces]
+        t, gaps = self._project(planar[:, None, :], candidates)
+        best = gaps.argmin(axis=1)
+        rows = np.arange(len(lats))
+        segments, t, gap = candidates[rows, best], t[rows, best], gaps[rows, best]
+
+        # a piece that was not looked at is no closer than its midpoint minus half a piece
+        doubtful = np.flatnonzero(gap > reach[:, -1] - self._piece_reach) if k < len(self._piece_segments) else rows[:0]
+        if len(doubtful):
+            if self._segment_tree is None:
+                self._segment_tree = shapely.STRtree(
+                    shapely.linestrings(np.stack((self._starts, self._starts + self._directions), axis=1)))
+            found, nearest = self._segment_tree.query_nearest(shapely.points(planar[doubtful]), all_matches=False)
+            segments[doubtful[found]] = nearest
+            t[doubtful[found]], _ = self._project(planar[doubtful[found]], nearest)
+
+        points = self._starts[segments] + t[:, None] * self._directions[segments]
+        snapped_lats[:] = points[:, 1]
+        snapped_lngs[:] = points[:, 0] / self.scale
+        distances[:] = great_circle(lats, lngs, snapped_lats, snapped_lngs)
+        edges[:] = self.edges[segments]
+        edge_lengths = self.edge_lengths[edges]
+        position = self.offsets[segments] + t * self.segment_lengths[segments]
+        fractions[:] = np.clip(np.divide(position, edge_lengths, out=np.zeros_like(position), where=edge_lengths > 0), 0.0, 1.0)
+
+        missed = np.isnan(distances) if max_distance is None else ~(distances <= max_distance)
+        edges[missed] = -1
+        for values in (fractions, distances, snapped_lats, snapped_lngs):
+            values[missed] = np.nan
+        return EdgeSnap(edges, fractions, distances, snapped_lats, snapped_lngs)
+
+
+    def candidates(self, lats, lngs, radius: float, k: int) -> EdgeSnap:
+        """the k nearest distinct edges within a radius of every point, nearest first, for map matching
+
+        Args:
+            lats (array-like): latitudes of the points
+            lngs (array-like): longitudes of the points
+            radius (float): meters from a point an edge may be
+            k (int): the most edges returned per point
+
+        Returns:
+            snap (EdgeSnap): (N, k) arrays of the candidate edges, nearest first, with edge -1 and NaNs past
+                the last one in range
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lngs = np.atleast_1d(np.asarray(lngs, dtype=float))
+        edges = np.full((len(lats), k), -1, dtype=np.int64)
+        fractions, distances, snapped_lats, snapped_lngs = (np.full((len(lats), k), np.nan) for _ in range(4))
+        snap = EdgeSnap(edges, fractions, distances, snapped_lats, snapped_lngs)
+        if self.tree is None or not len(lats):
+            return snap
+
+        # every piece whose midpoint is within the radius plus half a piece may hold a segment in range
+        planar = np.column_stack((lngs * self.scale, lats))
+        found = self.tree.query_ball_point(planar, radius / METERS_PER_DEGREE * 1.01 + self._piece_reach)
+        counts = np.fromiter((len(pieces) for pieces in found), dtype=np.int64, count=len(lats))
+        if not counts.sum():
+            return snap
+        points = np.repeat(np.arange(len(lats)), counts)
+        segments = self._piece_segments[np.concatenate([pieces for pieces in found if pieces]).astype(np.int64)]
+        t, _ = self._project(planar[points], segments)
+        snapped = (self._starts[segments] + t[:, None] * self._directions[segments]) / (self.scale, 1.0)
+        gaps = great_circle(lats[points], lngs[points], snapped[:, 1], snapped[:, 0])
+        position = self.offsets[segments] + t * self.segment_lengths[segments]
+
+        # the nearest segment of each edge, then the k nearest edges of each point
+        rows = np.flatnonzero(gaps <= radius)
+        rows = rows[np.lexsort((gaps[rows], self.edges[segments[rows]], points[rows]))]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (points[rows][1:] != points[rows][:-1]) | (self.edges[segments[rows]][1:] != self.edges[segments[rows]][:-1])
+        rows = rows[first]
+        rows = rows[np.lexsort((gaps[rows], points[rows]))]
+        rank = np.arange(len(rows)) - np.searchsorted(points[rows], points[rows], side="left")
+        rows, rank = rows[rank < k], rank[rank < k]
+
+        at = points[rows], rank
+        edge_lengths = self.edge_lengths[self.edges[segments[rows]]]
+        edges[at] = self.edges[segments[rows]]
+        fractions[at] = np.clip(np.divide(position[rows], edge_lengths, out=np.zeros(len(rows)), where=edge_lengths > 0), 0.0, 1.0)
+        distances[at] = gaps[rows]
+        snapped_lats[at] = snapped[rows, 1]
+        snapped_lngs[at] = snapped[rows, 0]
+        return snap
+
+
+    def _project(self, planar: np.ndarray, segments: np.ndarray) -> tuple:
+        """clamped position along each segment closest to the point, and the squared planar gap to it"""
+        starts, directions, squared = self._starts[segments], self._directions[segments], self._squared[segments]
+        along = np.einsum("...j,...j->...", planar - starts, directions)
+        t = np.clip(np.divide(along, squared, out=np.zeros_like(along), where=squared > 0), 0.0, 1.0)
+        offsets = starts + t[..., None] * directions - planar
+        return t, np.sqrt(np.einsum("...j,...j->...", offsets, offsets))
+
+
+def _mirrored_twins(tails, heads, coords, offsets) -> np.ndarray:
+    """flags edges that are the reverse copy of another edge with the same geometry, keeping the one whose tail is lower"""
+    twins = np.zeros(len(tails), dtype=bool)
+    if not len(tails):
+        return twins
+    firsts, lasts, counts = coords[offsets[:-1]], coords[offsets[1:] - 1], np.diff(offsets)
+    width = int(max(tails.max(), heads.max())) + 1
+    order = np.argsort(tails * width + heads, kind="stable")
+    sorted_keys = (tails * width + heads)[order]
+    candidates = np.flatnonzero(tails > heads)
+    reverse_keys = heads[candidates] * width + tails[candidates]
+    low = np.searchsorted(sorted_keys, reverse_keys, side="left")
+    high = np.searchsorted(sorted_keys, reverse_keys, side="right")
+    # one pass per parallel edge, so this loops once or twice on a street network
+    for step in range(int((high - low).max()) if len(candidates) else 0):
+        has = low + step < high
+        edges, reverse = candidates[has], order[low[has] + step]
+        same = (counts[edges] == counts[reverse]) & \
+            (firsts[edges] == lasts[reverse]).all(axis=1) & (lasts[edges] == firsts[reverse]).all(axis=1)
+        twins[edges[same]] = True
+    return twins
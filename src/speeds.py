@@ -0,0 +1,144 @@
+import re
+import math
+
+import numpy as np
+
+from .derived import invalidate
+
+
+# km/h by OSM highway type for each network type, 'default' covering every type not listed.
+# edit these, or pass a profile to prepare_graph, to match local conditions
+SPEED_PROFILES = {
+    "drive": {
+        "motorway": 100,
+        "motorway_link": 60,
+        "trunk": 80,
+        "trunk_link": 50,
+        "primary": 60,
+        "primary_link": 40,
+        "secondary": 50,
+        "secondary_link": 35,
+        "tertiary": 40,
+        "tertiary_link": 30,
+        "unclassified": 30,
+        "residential": 30,
+        "living_street": 10,
+        "service": 15,
+        "road": 30,
+        "default": 30,
+    },
+    "bike": {
+        "primary": 18,
+        "secondary": 18,
+        "cycleway": 18,
+        "footway": 8,
+        "pedestrian": 8,
+        "path": 12,
+        "track": 12,
+        "steps": 2,
+        "default": 15,
+    },
+    "walk": {
+        "steps": 2.5,
+        "default": 5,
+    },
+}
+
+# network types that travel like one of the profiles above
+PROFILE_ALIASES = {
+    "drive_service": "drive",
+    "all": "drive",
+    "all_private": "drive",
+}
+
+MPH = 1.609344
+
+
+def speed_profile(network_type: str) -> dict:
+    """returns the speed profile of a network type, the drive profile for types without one"""
+    return SPEED_PROFILES.get(PROFILE_ALIASES.get(network_type, network_type), SPEED_PROFILES["drive"])
+
+
+def parse_maxspeed(value) -> float:
+    """reads an OSM maxspeed tag as km/h, averaging lists and ranges, NaN where it is not a number
+
+    example: '50' -> 50.0, '30 mph' -> 48.28, ['40', '60'] -> 50.0, 'signals' -> nan
+    """
+    values = value if isinstance(value, (list, tuple)) else [value]
+    speeds = []
+    for item in values:
+        for part in re.split(r"[;|]", str(item)):
+            match = re.match(r"\s*(\d+(?:\.\d+)?)\s*(mph)?", part)
+            if match:
+                speeds.append(float(match.group(1)) * (MPH if match.group(2) else 1.0))
+    return float(np.mean(speeds)) if speeds else np.nan
+
+
+def _lookup(values: list, convert) -> np.ndarray:
+    """applies convert once per distinct value and spreads the results back over every edge"""
+    keys = [tuple(value) if isinstance(value, list) else value for value in values]
+    distinct = {}
+    codes = np.fromiter((distinct.setdefault(key, len(distinct)) for key in keys), dtype=np.int64, count=len(keys))
+    table = np.array([convert(key) for key in distinct], dtype=float)
+    return table[codes] if len(table) else np.zeros(0)
+
+
+def edge_speeds(edges: list, network_type: str, profile: dict = None) -> tuple:
+    """computes the speed and travel time of edges from their attributes, parsing each distinct value once
+
+    Cars take the posted maxspeed where it can be read and the profile speed of the road's highway type
+    otherwise; walking and cycling follow the profile alone.
+
+    Args:
+        edges (list): the attribute dicts of the edges
+        network_type (str): the type of network, picks the profile. example: 'drive', 'walk', 'bike'
+        profile (dict): optional {highway: km/h} overriding the network type's profile, with a 'default' entry
+
+    Returns:
+        speeds (np.ndarray): km/h per edge
+        times (np.ndarray): seconds per edge, NaN where an edge has no length
+    """
+    profile = profile or speed_profile(network_type)
+    default = float(profile.get("default", 30))
+    highway_speed = lambda highway: float(np.mean([
+        profile.get(item, default) for item in (highway if isinstance(highway, tuple) else (highway,))]))
+    speeds = _lookup([data.get("highway") for data in edges], highway_speed)
+    if PROFILE_ALIASES.get(network_type, network_type) == "drive":
+        posted = _lookup([data.get("maxspeed") for data in edges], lambda value: np.nan if value is None else parse_maxspeed(value))
+        speeds = np.where(np.isfinite(posted) & (posted > 0), posted, speeds)
+    lengths = np.fromiter((data.get("length", np.nan) for data in edges), dtype=float, count=len(edges))
+    return speeds, lengths / (speeds / 3.6)
+
+
+def prepare_graph(graph, network_type: str, profile: dict = None, overwrite: bool = False):
+    """adds speed_kph and travel_time (seconds) to every edge, computed in one vectorized pass
+
+    Speeds are those of edge_speeds. Every distinct highway and maxspeed value is parsed once, so the cost
+    is a single read and write of the edge attributes.
+
+    Args:
+        graph (object): the street network object, changed in place
+        network_type (str): the type of network, picks the profile. example: 'drive', 'walk', 'bike'
+        profile (dict): optional {highway: km/h} overriding the network type's profile, with a 'default' entry
+        overwrite (bool): recompute edges that already have a travel_time
+
+    Returns:
+        graph (object): the same graph
+    """
+    # the flag spares graphs that are prepared on every use a scan of their edges
+    if graph.graph.get("travel_times") and not overwrite:
+        return graph
+    edges = [data for _, _, data in graph.edges(data=True)]
+    if not overwrite and all("travel_time" in data for data in edges):
+        graph.graph["travel_times"] = True
+        return graph
+
+    speeds, times = edge_speeds(edges, network_type, profile)
+    for data, speed, time in zip(edges, speeds.tolist(), times.tolist()):
+        if overwrite or "travel_time" not in data:
+            data["speed_kph"] = speed
+            if not math.isnan(time):
+                data["travel_time"] = time
+    graph.graph["travel_times"] = True
+    invalidate(graph)
+    return graph
@@ -0,0 +1,294 @@
+import os
+import copy
+import json
+import shutil
+
+import numpy as np
+import networkx as nx
+import shapely
+
+from .csr import CSRGraph, ROUTING_ATTRIBUTES, close_edges
+
+
+FORMAT_VERSION = 1
+HEADER_FILE = "header.json"
+TABLES_FILE = "tables.json"
+
+
+def arrays_path(directory: str, graph_name: str) -> str:
+    """returns the directory the binary format of a saved graph lives in"""
+    return os.path.join(directory, f"{graph_name}_arrays")
+
+
+def save_arrays(graph, path: str) -> dict:
+    """writes a street network as plain .npy arrays in CSR layout plus a small JSON header
+
+    Nodes are stored in graph order and edges sorted by tail node, so the out-edges of node i
+    are edges indptr[i]:indptr[i + 1]. Numeric attributes become float columns, every other
+    attribute is dictionary-encoded into integer codes and a table of JSON values, and edge
+    geometries are flattened into one coordinate array with per-edge offsets. The directory is
+    written next to the target and swapped in at the end, so readers never see a partial graph.
+
+    Args:
+        graph (object): the street network object
+        path (str): the directory to write. example: 'Graph_Network/dar_es_salaam/walk/dar_es_salaam_arrays'
+
+    Returns:
+        header (dict): the header written alongside the arrays
+    """
+    staging = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+
+    nodes = list(graph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = list(graph.edges(keys=True, data=True))
+    tails = np.fromiter((index[u] for u, _, _, _ in edges), dtype=np.int64, count=len(edges))
+    order = np.argsort(tails, kind="stable")
+    edges = [edges[i] for i in order]
+
+    arrays = {
+        "indptr": np.concatenate(([0], np.cumsum(np.bincount(tails, minlength=len(nodes))))).astype(np.int64),
+        "heads": np.fromiter((index[v] for _, v, _, _ in edges), dtype=np.int64, count=len(edges)),
+        "keys": np.fromiter((k for _, _, k, _ in edges), dtype=np.int64, count=len(edges)),
+    }
+    tables = {}
+
+    node_ids_kind = "int" if all(isinstance(node, (int, np.integer)) for node in nodes) else "json"
+    if node_ids_kind == "int":
+        arrays["node_ids"] = np.array(nodes, dtype=np.int64)
+    else:
+        arrays["node_ids"], tables["node_ids"] = _encode_values(nodes)
+
+    node_columns = _write_columns(
+        "node", [data for _, data in graph.nodes(data=True)], arrays, tables, skip=())
+    edge_columns = _write_columns(
+        "edge", [data for _, _, _, data in edges], arrays, tables, skip=("geometry",))
+
+    geometries = np.empty(len(edges), dtype=object)
+    geometries[:] = [data.get("geometry") for _, _, _, data in edges]
+    coords, owners = shapely.get_coordinates(geometries, return_index=True)
+    arrays["geometry_coords"] = coords
+    arrays["geometry_offsets"] = np.searchsorted(owners, np.arange(len(edges) + 1)).astype(np.int64)
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "directed": graph.is_directed(),
+        "multigraph": graph.is_multigraph(),
+        "graph": {key: _jsonable(value) for key, value in graph.graph.items()},
+        "node_count": len(nodes),
+        "edge_count": len(edges),
+        "node_ids": node_ids_kind,
+        "node_columns": node_columns,
+        "edge_columns": edge_columns,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), array, allow_pickle=False)
+    with open(os.path.join(staging, TABLES_FILE), "w") as tables_file:
+        json.dump(tables, tables_file)
+    with open(os.path.join(staging, HEADER_FILE), "w") as header_file:
+        json.dump(header, header_file, indent=4)
+
+    if os.path.exists(path):
+        retired = f"{path}.old-{os.getpid()}"
+        os.rename(path, retired)
+        os.rename(staging, path)
+        shutil.rmtree(retired)
+    else:
+        os.rename(staging, path)
+    return header
+
+
+def load_arrays(path: str, mmap: bool = True) -> tuple:
+    """opens the arrays of a saved graph, memory-mapped by default so nothing is read until it is used
+
+    Args:
+        path (str): the directory written by save_arrays
+        mmap (bool): map the arrays read-only instead of reading them into memory
+
+    Returns:
+        header (dict): the JSON header
+        arrays (dict): {name: np.ndarray}
+        tables (dict): {column: list of decoded values} for dictionary-encoded columns
+    """
+    header_path = os.path.join(path, HEADER_FILE)
+    if not os.path.exists(header_path):
+        raise FileNotFoundError(f"The graph arrays '{path}' do not exist.")
+    with open(header_path) as header_file:
+        header = json.load(header_file)
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported graph array format version {header.get('format_version')} in '{path}'.")
+    with open(os.path.join(path, TABLES_FILE)) as tables_file:
+        tables = {name: [json.loads(value) for value in values] for name, values in json.load(tables_file).items()}
+
+    arrays = {}
+    for file_name in os.listdir(path):
+        if file_name.endswith(".npy"):
+            arrays[file_name[:-4]] = np.load(os.path.join(path, file_name), mmap_mode="r" if mmap else None)
+    return header, arrays, tables
+
+
+def arrays_to_graph(header: dict, arrays: dict, tables: dict) -> object:
+    """rebuilds the networkx street network from loaded arrays"""
+    graph_class = nx.MultiDiGraph if header["directed"] else nx.MultiGraph
+    graph = graph_class(**header["graph"])
+
+    if header["node_ids"] == "int":
+        nodes = arrays["node_ids"].tolist()
+    else:
+        nodes = _decode_column(arrays["node_ids"], tables["node_ids"])
+    node_data = _read_columns(header["node_columns"], arrays, tables, header["node_count"])
+    graph.add_nodes_from(zip(nodes, node_data))
+
+    edge_data = _read_columns(header["edge_columns"], arrays, tables, header["edge_count"])
+    offsets = np.asarray(arrays["geometry_offsets"])
+    has_geometry = np.flatnonzero(np.diff(offsets) > 0)
+    if len(has_geometry):
+        owners = np.repeat(np.arange(len(has_geometry)), np.diff(offsets)[has_geometry])
+        lines = shapely.linestrings(np.asarray(arrays["geometry_coords"]), indices=owners)
+        for position, line in zip(has_geometry.tolist(), lines):
+            edge_data[position]["geometry"] = line
+
+    indptr = np.asarray(arrays["indptr"])
+    tails = np.repeat(np.arange(len(nodes)), np.diff(indptr)).tolist()
+    heads = np.asarray(arrays["heads"]).tolist()
+    keys = np.asarray(arrays["keys"]).tolist()
+    if isinstance(graph, nx.MultiDiGraph):
+        # fill the adjacency dicts directly, add_edges_from spends most of its time on per-edge checks
+        succ, pred = graph._succ, graph._pred
+        for u, v, key, data in zip(tails, heads, keys, edge_data):
+            u, v = nodes[u], nodes[v]
+            succ[u].setdefault(v, {})[key] = data
+            pred[v].setdefault(u, {})[key] = data
+    else:
+        graph.add_edges_from(
+            (nodes[u], nodes[v], key, data) for u, v, key, data in zip(tails, heads, keys, edge_data))
+    return graph
+
+
+def arrays_to_csr(header: dict, arrays: dict, tables: dict, attributes: tuple = ROUTING_ATTRIBUTES) -> CSRGraph:
+    """builds the routing arrays straight from loaded arrays, without going through networkx"""
+    if header["node_ids"] == "int":
+        nodes = arrays["node_ids"]
+    else:
+        nodes = np.array(_decode_column(arrays["node_ids"], tables["node_ids"]), dtype=object)
+    columns = {column["name"]: column for column in header["edge_columns"]}
+    node_columns = {column["name"]: column for column in header["node_columns"]}
+    indptr = arrays["indptr"]
+    weights = {
+        name: arrays[columns[name]["file"]] if columns.get(name, {}).get("kind") in ("int", "float", "bool")
+        else np.full(header["edge_count"], np.nan)
+        for name in attributes
+    }
+    closed = np.zeros(header["edge_count"], dtype=bool)
+    if columns.get("closed", {}).get("kind") == "bool":
+        closed = np.asarray(arrays[columns["closed"]["file"]]) == 1
+    return CSRGraph(
+        nodes=nodes,
+        y=arrays[node_columns["y"]["file"]],
+        x=arrays[node_columns["x"]["file"]],
+        indptr=indptr,
+        tails=np.repeat(np.arange(header["node_count"]), np.diff(indptr)),
+        heads=arrays["heads"],
+        keys=arrays["keys"],
+        weights=close_edges(weights, closed))
+
+
+def _write_columns(prefix: str, records: list, arrays: dict, tables: dict, skip: tuple) -> list:
+    """splits attribute dicts into one array per attribute and returns the column descriptions"""
+    names = []
+    for data in records:
+        for name in data:
+            if name not in skip and name not in names:
+                names.append(name)
+
+    columns = []
+    for i, name in enumerate(names):
+        file_name = f"{prefix}_{i}"
+        values = [data.get(name, _MISSING) for data in records]
+        present = [value for value in values if value is not _MISSING]
+        kind = _numeric_kind(present)
+        if kind is None:
+            codes, table = _encode_values(values)
+            arrays[file_name] = codes
+            tables[file_name] = table
+            kind = "json"
+        else:
+            arrays[file_name] = np.array(
+                [np.nan if value is _MISSING else float(value) for value in values], dtype=float)
+        columns.append({"name": name, "kind": kind, "file": file_name})
+    return columns
+
+
+def _read_columns(columns: list, arrays: dict, tables: dict, count: int) -> list:
+    """inverts _write_columns, returning one attribute dict per record"""
+    records = [{} for _ in range(count)]
+    for column in columns:
+        name, kind, array = column["name"], column["kind"], arrays[column["file"]]
+        if kind == "json":
+            values = _decode_column(array, tables[column["file"]])
+        else:
+            values = np.asarray(array).tolist()
+            convert = {"int": int, "bool": bool, "float": float}[kind]
+            values = [_MISSING if value != value else convert(value) for value in values]
+        for record, value in zip(records, values):
+            if value is not _MISSING:
+                record[name] = value
+    return records
+
+
+def _numeric_kind(values: list) -> str:
+    """returns 'bool', 'int' or 'float' when every value fits a float column, None otherwise"""
+    if not values:
+        return "float"
+    if all(isinstance(value, (bool, np.bool_)) for value in values):
+        return "bool"
+    if any(isinstance(value, (bool, np.bool_)) for value in values):
+        return None
+    if all(isinstance(value, (int, np.integer)) and abs(value) < 2 ** 53 for value in values):
+        return "int"
+    if all(isinstance(value, (int, float, np.integer, np.floating)) for value in values):
+        return "float"
+    return None
+
+
+def _encode_values(values: list) -> tuple:
+    """dictionary-encodes arbitrary attribute values as int32 codes into a table of JSON strings, -1 when missing"""
+    table = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for i, value in enumerate(values):
+        if value is _MISSING:
+            codes[i] = -1
+        else:
+            codes[i] = table.setdefault(json.dumps(_jsonable(value)), len(table))
+    return codes, list(table)
+
+
+def _decode_column(codes, table: list) -> list:
+    """the value of every record, each with its own copy of list and dict values so edits never leak between edges"""
+    codes = np.asarray(codes).tolist()
+    if not any(isinstance(value, (list, dict)) for value in table):
+        return [_MISSING if code < 0 else table[code] for code in codes]
+    return [_MISSING if code < 0 else copy.deepcopy(table[code]) for code in codes]
+
+
+def _jsonable(value):
+    """turns numpy scalars and other non-JSON values into something json.dumps accepts"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class _Missing:
+    def __repr__(self):
+        return "<missing>"
+
+
+_MISSING = _Missing()
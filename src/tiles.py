@@ -0,0 +1,196 @@
+import math
+import threading
+import concurrent.futures
+from collections import OrderedDict
+
+import networkx as nx
+import osmnx as ox
+
+from .speeds import prepare_graph
+
+
+def graph_from_bbox(north: float, south: float, east: float, west: float, **kwargs) -> object:
+    """downloads the street network inside a bounding box, keyword arguments are passed on to osmnx
+
+    osmnx 2 takes the box as one (west, south, east, north) tuple where 1.x took four positional bounds,
+    so every download goes through here rather than calling osmnx with the bounds directly.
+    """
+    return ox.graph_from_bbox(bbox=(west, south, east, north), **kwargs)
+
+
+def download_tile(north: float, south: float, east: float, west: float, network_type: str) -> object:
+    """downloads the street network inside one tile's bounds, keeping edges that cross the border, with travel times"""
+    return prepare_graph(graph_from_bbox(north, south, east, west, network_type=network_type, truncate_by_edge=True), network_type)
+
+
+def estimate_graph_bytes(graph) -> int:
+    """rough in-memory size of a networkx street network, used to enforce the cache's byte budget"""
+    return 600 * graph.number_of_nodes() + 1200 * graph.number_of_edges()
+
+
+class GraphTileCache:
+    """keeps street network tiles in memory, keyed on a fixed lat-long grid, with least recently used eviction
+
+    A route is served from the tiles that already cover it, so only the first request in an area pays
+    for the download. When a query spans several tiles they are stitched into one graph, which is
+    cached as well so the same corridor is not composed twice.
+
+    Args:
+        tile_size (float): tile edge length in degrees. example: 0.05 is about 5.5 km at the equator
+        margin (float): how far past its bounds each tile is downloaded, in degrees, so border edges overlap
+        max_tiles (int): the most graphs (tiles and stitched graphs) kept in memory
+        max_bytes (int): optional estimated byte budget across all cached graphs
+        loader (callable): loader(north, south, east, west, network_type) -> graph, defaults to download_tile
+    """
+
+    def __init__(
+        self,
+        tile_size: float = 0.05,
+        margin: float = 0.005,
+        max_tiles: int = 64,
+        max_bytes: int = None,
+        loader=None):
+
+        self.tile_size = tile_size
+        self.margin = margin
+        self.max_tiles = max_tiles
+        self.max_bytes = max_bytes
+        self.loader = loader or download_tile
+        self._graphs = OrderedDict()
+        self._loading = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def tile_key(self, point: tuple, network_type: str) -> tuple:
+        """returns the key of the tile containing a lat-long point"""
+        return (network_type, math.floor(point[0] / self.tile_size), math.floor(point[1] / self.tile_size))
+
+
+    def tile_bounds(self, key: tuple) -> tuple:
+        """returns the (north, south, east, west) download bounds of a tile, margin included"""
+        _, row, col = key
+        return (
+            (row + 1) * self.tile_size + self.margin,
+            row * self.tile_size - self.margin,
+            (col + 1) * self.tile_size + self.margin,
+            col * self.tile_size - self.margin)
+
+
+    def tiles_for(self, north: float, south: float, east: float, west: float, network_type: str) -> list:
+        """returns the keys of every tile overlapping a bounding box"""
+        _, top, right = self.tile_key((north, east), network_type)
+        _, bottom, left = self.tile_key((south, west), network_type)
+        return [(network_type, row, col) for row in range(bottom, top + 1) for col in range(left, right + 1)]
+
+
+    def get_tile(self, key: tuple) -> object:
+        """returns one tile's graph, downloading it on a miss
+
+        A tile the loader finds no streets in, raising osmnx's InsufficientResponseError, is an empty graph.
+        Threads that miss on a tile another thread is already downloading wait for that download
+        instead of starting their own.
+        """
+        with self._lock:
+            graph = self._get(key)
+            if graph is not None:
+                return graph
+            loading = self._loading.get(key)
+            owner = loading is None
+            if owner:
+                loading = self._loading[key] = concurrent.futures.Future()
+        if not owner:
+            return loading.result()
+
+        try:
+            north, south, east, west = self.tile_bounds(key)
+            try:
+                graph = self.loader(north, south, east, west, key[0])
+            except ox._errors.InsufficientResponseError:
+                # a tile without streets, e.g. open sea, is cached as empty so it is not downloaded again
+                graph = nx.MultiDiGraph(crs="epsg:4326")
+            with self._lock:
+                self._put(key, graph)
+            loading.set_result(graph)
+            return graph
+        except BaseException as e:
+            loading.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+
+    def graph_for(self, points: list, network_type: str, buffer: float = 0.0) -> object:
+        """returns a graph covering every point plus a buffer, stitched from cached tiles
+
+        Args:
+            points (list): lat-long points the graph must cover. example: [(37.7749, -122.4194), ...]
+            network_type (str): the type of street network. options: 'drive', 'walk', 'bike', 'all'
+            buffer (float): extra distance around the points, in degrees, to leave room for detours
+
+        Returns:
+            G (object): the street network object
+        """
+        north = max(point[0] for point in points) + buffer
+        south = min(point[0] for point in points) - buffer
+        east = max(point[1] for point in points) + buffer
+        west = min(point[1] for point in points) - buffer
+        keys = self.tiles_for(north, south, east, west, network_type)
+        if len(keys) == 1:
+            return self.get_tile(keys[0])
+
+        stitched_key = ("stitched", network_type, tuple(keys))
+        with self._lock:
+            graph = self._get(stitched_key)
+        if graph is None:
+            graph = nx.compose_all([self.get_tile(key) for key in keys])
+            with self._lock:
+                self._put(stitched_key, graph)
+        return graph
+
+
+    def clear(self):
+        """drops every cached graph"""
+        with self._lock:
+            self._graphs.clear()
+            self._bytes = 0
+
+
+    def info(self) -> dict:
+        """returns hit, miss and eviction counts and the current size of the cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "graphs": len(self._graphs),
+                "bytes": self._bytes,
+            }
+
+
+    def _get(self, key: tuple) -> object:
+        entry = self._graphs.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._graphs.move_to_end(key)
+        return entry[0]
+
+
+    def _put(self, key: tuple, graph):
+        if key in self._graphs:
+            self._bytes -= self._graphs.pop(key)[1]
+        size = estimate_graph_bytes(graph)
+        self._graphs[key] = (graph, size)
+        self._bytes += size
+        while len(self._graphs) > 1 and (
+                len(self._graphs) > self.max_tiles or
+                (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            _, (_, evicted_size) = self._graphs.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
@@ -0,0 +1,272 @@
+import time
+
+import numpy as np
+
+
+# moves must save more than this share of the tour's cost, so rounding never cycles two moves back and forth
+IMPROVEMENT = 1e-9
+
+# improving moves checked against the time windows per position before the search moves on
+WINDOW_CANDIDATES = 8
+
+
+def solve_tours(
+    costs: np.ndarray,
+    durations: np.ndarray = None,
+    demands=None,
+    capacities=None,
+    windows=None,
+    service_times=None,
+    time_budget: float = 1.0) -> dict:
+
+    """orders stops into one tour per vehicle that starts and ends at a depot, minimizing the summed cost
+
+    Stops are added by nearest insertion (the unrouted stop closest to any routed one goes in at its
+    cheapest feasible place), then the tours are improved by 2-opt within each tour and Or-opt moves
+    of one to three stops within and between tours until no move helps or the time budget is spent.
+    Every step is a vectorized pass over all candidate positions, so 500 stops take a few seconds.
+
+    Matrix index 0 is the depot and 1..N the stops. Matrices may be asymmetric; inf marks no route.
+
+    Args:
+        costs (np.ndarray): (N + 1, N + 1) cost the tours minimize, e.g. travel times
+        durations (np.ndarray): (N + 1, N + 1) travel times in seconds the time windows are checked on, costs by default
+        demands (array-like): (N,) load of every stop, needs capacities
+        capacities (array-like): the load every vehicle carries, one vehicle per entry. one vehicle of unlimited capacity by default
+        windows (array-like): (N,) (earliest, latest) service start of every stop in seconds from departure, or
+            (N + 1,) with the depot's (departure, latest return) first. None for a stop without one
+        service_times (array-like): (N,) seconds spent at every stop
+        time_budget (float): seconds the local search may run
+
+    Returns:
+        solution (dict): 'routes' (list of stop lists, 1..N, per vehicle), 'starts' (service start times per route
+            when there are windows), 'unassigned' (stops no vehicle could take) and 'cost'
+    """
+    return _Tours(costs, durations, demands, capacities, windows, service_times).solve(time_budget)
+
+
+class _Tours:
+    """the tours being built and improved, one list of stop indices per vehicle, depot left implicit"""
+
+    def __init__(self, costs, durations, demands, capacities, windows, service_times):
+        costs = np.asarray(costs, dtype=float)
+        size = len(costs)
+        finite = costs[np.isfinite(costs)]
+        # unreachable legs cost far more than any tour, but stay finite so prefix sums never turn into nan
+        self.unreachable = 1e6 * (float(finite.max()) + 1 if len(finite) else 1.0)
+        self.costs = np.where(np.isfinite(costs), costs, self.unreachable)
+
+        self.capacities = np.array([np.inf] if capacities is None else capacities, dtype=float)
+        self.demands = np.zeros(size)
+        if demands is not None:
+            self.demands[1:] = np.asarray(demands, dtype=float)
+        self.routes = [[] for _ in self.capacities]
+        self.loads = np.zeros(len(self.routes))
+
+        self.timed = windows is not None
+        self.service = np.zeros(size)
+        if service_times is not None:
+            self.service[1:] = np.asarray(service_times, dtype=float)
+        if self.timed:
+            durations = self.costs if durations is None else np.asarray(durations, dtype=float)
+            self.durations = np.where(np.isfinite(durations), durations, self.unreachable)
+            windows = list(windows)
+            if len(windows) == size - 1:
+                windows = [None] + windows
+            bounds = [(0.0, np.inf) if window is None else window for window in windows]
+            self.early = np.array([bound[0] for bound in bounds], dtype=float)
+            self.late = np.array([bound[1] for bound in bounds], dtype=float)
+            self.starts = [np.zeros(0) for _ in self.routes]
+            self.latest = [np.zeros(0) for _ in self.routes]
+
+
+    def solve(self, time_budget: float) -> dict:
+        unassigned = self.construct()
+        deadline = time.perf_counter() + time_budget
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = self.two_opt(deadline)
+            improved = self.or_opt(deadline) or improved
+        return {
+            "routes": [list(route) for route in self.routes],
+            "starts": [starts.tolist() for starts in self.starts] if self.timed else None,
+            "unassigned": unassigned,
+            "cost": float(sum(self.route_cost(route) for route in self.routes)),
+        }
+
+
+    def construct(self) -> list:
+        """nearest insertion: the unrouted stop closest to any routed node, at its cheapest feasible position"""
+        size = len(self.costs)
+        nearest = np.minimum(self.costs[0], self.costs[:, 0])
+        done = np.zeros(size, dtype=bool)
+        done[0] = True
+        unassigned = []
+        for _ in range(size - 1):
+            stop = int(np.argmin(np.where(done, np.inf, nearest)))
+            done[stop] = True
+            vehicle, index, delta = self.best_insertion([stop])
+            # a cheapest place that still needs an unreachable leg means no vehicle can get there and back
+            if vehicle is None or delta >= self.unreachable / 2:
+                unassigned.append(stop)
+                continue
+            self.insert(vehicle, index, [stop])
+            nearest = np.minimum(nearest, np.minimum(self.costs[stop], self.costs[:, stop]))
+        return sorted(unassigned)
+
+
+    def positions(self) -> tuple:
+        """every place a stop can go: the (before, after) nodes, vehicle and index in its route of each"""
+        before = [np.array([0] + route, dtype=np.int64) for route in self.routes]
+        after = [np.array(route + [0], dtype=np.int64) for route in self.routes]
+        vehicles = np.repeat(np.arange(len(self.routes)), [len(route) + 1 for route in self.routes])
+        indices = np.concatenate([np.arange(len(route) + 1) for route in self.routes])
+        return np.concatenate(before), np.concatenate(after), vehicles, indices
+
+
+    def insertion_costs(self, segment: list, before, after, vehicles) -> np.ndarray:
+        """the added cost of putting a segment at every position, inf where a capacity or time window forbids it"""
+        first, last = segment[0], segment[-1]
+        deltas = self.costs[before, first] + self.costs[last, after] - self.costs[before, after]
+        deltas = deltas + self.costs[segment[:-1], segment[1:]].sum()
+        load = self.demands[segment].sum()
+        deltas[self.loads[vehicles] + load > self.capacities[vehicles]] = np.inf
+        if self.timed and len(segment) == 1:
+            starts = np.concatenate([np.concatenate(([self.early[0]], starts)) for starts in self.starts])
+            latest = np.concatenate([np.concatenate((latest, [self.late[0]])) for latest in self.latest])
+            arrival = np.maximum(starts + self.service[before] + self.durations[before, first], self.early[first])
+            later = np.maximum(arrival + self.service[first] + self.durations[first, after], self.early[after])
+            deltas[(arrival > self.late[first]) | (later > latest)] = np.inf
+        return deltas
+
+
+    def best_insertion(self, segment: list) -> tuple:
+        before, after, vehicles, indices = self.positions()
+        deltas = self.insertion_costs(segment, before, after, vehicles)
+        for best in np.argsort(deltas, kind="stable")[:WINDOW_CANDIDATES if self.timed and len(segment) > 1 else 1]:
+            if not np.isfinite(deltas[best]):
+                break
+            vehicle, index = int(vehicles[best]), int(indices[best])
+            if len(segment) == 1 or self.feasible(self.routes[vehicle][:index] + segment + self.routes[vehicle][index:]):
+                return vehicle, index, float(deltas[best])
+        return None, None, np.inf
+
+
+    def insert(self, vehicle: int, index: int, segment: list):
+        self.routes[vehicle][index:index] = segment
+        self.update(vehicle)
+
+
+    def update(self, vehicle: int):
+        route = self.routes[vehicle]
+        self.loads[vehicle] = self.demands[route].sum()
+        if self.timed:
+            self.starts[vehicle] = self.schedule(route)[0]
+            latest = np.empty(len(route))
+            bound, following = self.late[0], 0
+            for position in range(len(route) - 1, -1, -1):
+                stop = route[position]
+                bound = min(self.late[stop], bound - self.service[stop] - self.durations[stop, following])
+                latest[position] = bound
+                following = stop
+            self.latest[vehicle] = latest
+
+
+    def schedule(self, route: list) -> tuple:
+        """the service start at every stop of a route, and whether every window and the depot's return is kept"""
+        starts = np.empty(len(route))
+        clock, previous, feasible = self.early[0], 0, True
+        for position, stop in enumerate(route):
+            clock = max(clock + self.service[previous] + self.durations[previous, stop], self.early[stop])
+            feasible = feasible and clock <= self.late[stop]
+            starts[position] = clock
+            previous = stop
+        feasible = feasible and clock + self.service[previous] + self.durations[previous, 0] <= self.late[0]
+        return starts, feasible
+
+
+    def feasible(self, route: list) -> bool:
+        return not self.timed or self.schedule(route)[1]
+
+
+    def route_cost(self, route: list) -> float:
+        tour = [0] + route + [0]
+        return float(self.costs[tour[:-1], tour[1:]].sum())
+
+
+    def two_opt(self, deadline: float) -> bool:
+        """reverses stretches of each tour where that shortens it, with reversed legs priced on asymmetric costs"""
+        improved = False
+        for vehicle, route in enumerate(self.routes):
+            threshold = IMPROVEMENT * max(self.route_cost(route), 1.0)
+            i = 0
+            while i < len(route) - 1 and time.perf_counter() < deadline:
+                tour = np.array([0] + route + [0], dtype=np.int64)
+                forward = np.concatenate(([0.0], np.cumsum(self.costs[tour[:-1], tour[1:]])))
+                backward = np.concatenate(([0.0], np.cumsum(self.costs[tour[1:], tour[:-1]])))
+                # reverse tour[i + 1..j] for every j: swap the two boundary legs and flip every leg between them
+                j = np.arange(i + 2, len(tour) - 1)
+                a, b, c, d = tour[i], tour[i + 1], tour[j], tour[j + 1]
+                deltas = (self.costs[a, c] + self.costs[b, d] - self.costs[a, b] - self.costs[c, d]
+                          + (backward[j] - backward[i + 1]) - (forward[j] - forward[i + 1]))
+                moved = False
+                for best in np.argsort(deltas, kind="stable")[:WINDOW_CANDIDATES if self.timed else 1]:
+                    if deltas[best] >= -threshold:
+                        break
+                    candidate = route[:i] + route[i:j[best]][::-1] + route[j[best]:]
+                    if self.feasible(candidate):
+                        route[:] = candidate
+                        self.update(vehicle)
+                        moved = improved = True
+                        break
+                if not moved:
+                    i += 1
+        return improved
+
+
+    def or_opt(self, deadline: float) -> bool:
+        """moves runs of one to three stops to their cheapest place in any tour where that lowers the total"""
+        improved = False
+        for length in (1, 2, 3):
+            vehicle = 0
+            while vehicle < len(self.routes) and time.perf_counter() < deadline:
+                start = 0
+                while start + length <= len(self.routes[vehicle]) and time.perf_counter() < deadline:
+                    if self.relocate(vehicle, start, length):
+                        improved = True
+                    else:
+                        start += 1
+                vehicle += 1
+        return improved
+
+
+    def relocate(self, vehicle: int, start: int, length: int) -> bool:
+        route = self.routes[vehicle]
+        segment = route[start:start + length]
+        tour = [0] + route + [0]
+        previous, following = tour[start], tour[start + length + 1]
+        saving = (self.costs[previous, segment[0]] + self.costs[segment[-1], following] - self.costs[previous, following]
+                  + self.costs[segment[:-1], segment[1:]].sum())
+
+        # price every position with the segment taken out of its own tour
+        self.routes[vehicle] = route[:start] + route[start + length:]
+        self.update(vehicle)
+        before, after, vehicles, indices = self.positions()
+        deltas = self.insertion_costs(segment, before, after, vehicles) - saving
+        deltas[(vehicles == vehicle) & (indices == start)] = np.inf
+        # durations that break the triangle inequality can make a tour late by taking a stop out
+        if not self.feasible(self.routes[vehicle]):
+            deltas[:] = np.inf
+        threshold = IMPROVEMENT * max(saving, 1.0)
+        for best in np.argsort(deltas, kind="stable")[:WINDOW_CANDIDATES if self.timed else 1]:
+            if deltas[best] >= -threshold:
+                break
+            target, index = int(vehicles[best]), int(indices[best])
+            candidate = self.routes[target][:index] + segment + self.routes[target][index:]
+            if self.feasible(candidate):
+                self.routes[target] = candidate
+                self.update(target)
+                return True
+        self.routes[vehicle] = route
+        self.update(vehicle)
+        return False
@@ -0,0 +1,192 @@
+import concurrent.futures
+
+import networkx as nx
+
+from .derived import invalidate
+from .speeds import edge_speeds
+from .tiles import GraphTileCache, download_tile
+
+
+# what a diff can hold. Edges are (u, v) for every parallel edge between two nodes or (u, v, key) for one,
+# speeds (u, v, km/h) or (u, v, key, km/h), and added edges (u, v, attributes) or (u, v, key, attributes)
+DIFF_KEYS = ("add_nodes", "remove_nodes", "add_edges", "remove_edges", "speeds", "close", "reopen")
+
+# edge attributes whose routing a speed change alters, and so whose contraction hierarchies it makes stale
+SPEED_WEIGHTS = ("speed_kph", "travel_time")
+
+
+def apply_diff(graph, diff: dict, network_type: str, profile: dict = None) -> dict:
+    """applies added and removed nodes and edges, speed changes and closures to a street network in place
+
+    Added edges without a travel_time get one from the speed profile, as prepare_graph would give them. Only
+    the derived structures a change affects are dropped: speed changes and closures keep the spatial indexes
+    and drop the routing arrays, added or removed edges drop everything built from the edges, and only
+    added or removed nodes drop the node index too.
+
+    Closed edges stay in the graph with closed=True, which gives them infinite routing weights, until a
+    later diff reopens them.
+
+    Args:
+        graph (object): the street network object, changed in place
+        diff (dict): any of DIFF_KEYS. example: {'speeds': [(12, 13, 20)], 'close': [(13, 14)],
+            'add_edges': [(14, 15, {'length': 120.0, 'highway': 'residential'})], 'remove_edges': [(15, 16, 0)],
+            'add_nodes': {99: {'y': -6.8, 'x': 39.28}}, 'remove_nodes': [42]}
+        network_type (str): the type of network, picks the speed profile of added edges
+        profile (dict): optional {highway: km/h} for added edges instead of the network type's profile
+
+    Returns:
+        summary (dict): how many nodes and edges each part of the diff changed, and 'stale_weights': the
+            edge attributes whose routes may have changed, ['*'] for all of them
+    """
+    unknown = set(diff) - set(DIFF_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown diff entries {sorted(unknown)}. Options: {', '.join(DIFF_KEYS)}.")
+    _check_speeds(graph, diff)
+
+    summary = {key: 0 for key in DIFF_KEYS}
+    add_nodes = diff.get("add_nodes") or {}
+    for node, data in (add_nodes.items() if isinstance(add_nodes, dict) else add_nodes):
+        if "y" not in data or "x" not in data:
+            raise ValueError(f"Added node {node} needs 'y' and 'x' coordinates.")
+        graph.add_node(node, **data)
+        summary["add_nodes"] += 1
+
+    added = []
+    for item in diff.get("add_edges") or ():
+        u, v, key, data = (*item[:2], None, item[2]) if len(item) == 3 else item
+        for node in (u, v):
+            if node not in graph:
+                raise ValueError(f"Added edge ({u}, {v}) ends at node {node}, which is not in the graph.")
+        key = graph.add_edge(u, v, key=key, **data)
+        added.append(graph.edges[u, v, key])
+    summary["add_edges"] = len(added)
+    if added:
+        missing = [data for data in added if "travel_time" not in data]
+        speeds, times = edge_speeds(missing, network_type, profile)
+        for data, speed, time in zip(missing, speeds.tolist(), times.tolist()):
+            data.setdefault("speed_kph", speed)
+            if time == time:
+                data["travel_time"] = time
+
+    for item in diff.get("remove_edges") or ():
+        for u, v, key in _edges(graph, item):
+            graph.remove_edge(u, v, key)
+            summary["remove_edges"] += 1
+
+    for node in diff.get("remove_nodes") or ():
+        if node not in graph:
+            raise ValueError(f"Removed node {node} is not in the graph.")
+        summary["remove_edges"] += graph.degree(node)
+        graph.remove_node(node)
+        summary["remove_nodes"] += 1
+
+    for item in diff.get("speeds") or ():
+        speed = float(item[-1])
+        for u, v, key in _edges(graph, item[:-1]):
+            data = graph.edges[u, v, key]
+            data["speed_kph"] = speed
+            data["travel_time"] = data["length"] / (speed / 3.6)
+            summary["speeds"] += 1
+
+    for change, closed in (("close", True), ("reopen", False)):
+        for item in diff.get(change) or ():
+            for u, v, key in _edges(graph, item):
+                data = graph.edges[u, v, key]
+                if closed:
+                    data["closed"] = True
+                else:
+                    data.pop("closed", None)
+                summary[change] += 1
+
+    nodes_changed = summary["add_nodes"] or summary["remove_nodes"]
+    edges_changed = summary["add_edges"] or summary["remove_edges"]
+    closures = summary["close"] or summary["reopen"]
+    if nodes_changed:
+        invalidate(graph)
+    elif edges_changed:
+        invalidate(graph, "csr", "edge_index", "edge_bounds", "street_index")
+    elif closures or summary["speeds"]:
+        invalidate(graph, "csr")
+    summary["stale_weights"] = ["*"] if nodes_changed or edges_changed or closures else list(SPEED_WEIGHTS) if summary["speeds"] else []
+    return summary
+
+
+def diff_graphs(old, new) -> dict:
+    """returns the diff that turns one street network into another, e.g. a saved graph into a fresh download
+
+    Edges are matched on (u, v, key) and compared on their speed, so re-downloading unchanged streets
+    yields an empty diff.
+
+    Returns:
+        diff (dict): add_nodes, remove_nodes, add_edges, remove_edges and speeds, as apply_diff takes them
+    """
+    old_edges = {(u, v, key): data for u, v, key, data in old.edges(keys=True, data=True)}
+    new_edges = {(u, v, key): data for u, v, key, data in new.edges(keys=True, data=True)}
+    removed_nodes = [node for node in old.nodes if node not in new]
+    gone = set(removed_nodes)
+    return {
+        "add_nodes": {node: dict(data) for node, data in new.nodes(data=True) if node not in old},
+        "remove_nodes": removed_nodes,
+        "add_edges": [(u, v, key, dict(data)) for (u, v, key), data in new_edges.items() if (u, v, key) not in old_edges],
+        # edges of removed nodes go with them
+        "remove_edges": [edge for edge in old_edges if edge not in new_edges and edge[0] not in gone and edge[1] not in gone],
+        "speeds": [
+            (*edge, data["speed_kph"]) for edge, data in new_edges.items()
+            if edge in old_edges and "speed_kph" in data and data["speed_kph"] != old_edges[edge].get("speed_kph")
+        ],
+    }
+
+
+def fetch_bbox(north: float, south: float, east: float, west: float, network_type: str, tile_size: float = 0.05, workers: int = 8, loader=None) -> object:
+    """downloads a large area as tiles in parallel and merges them into one street network
+
+    Args:
+        north, south, east, west (float): the area's bounds
+        network_type (str): the type of street network. options: 'drive', 'walk', 'bike', 'all'
+        tile_size (float): tile edge length in degrees, as in GraphTileCache
+        workers (int): tiles downloaded at once
+        loader (callable): loader(north, south, east, west, network_type) -> graph, defaults to download_tile
+
+    Returns:
+        graph (object): the merged street network, covering the tiles overlapping the bounds
+    """
+    tiles = GraphTileCache(tile_size=tile_size, max_tiles=1 << 30, loader=loader or download_tile)
+    keys = tiles.tiles_for(north, south, east, west, network_type)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(keys)))) as pool:
+        graphs = list(pool.map(tiles.get_tile, keys))
+    return graphs[0] if len(graphs) == 1 else nx.compose_all(graphs)
+
+
+def _check_speeds(graph, diff: dict):
+    """raises ValueError for a speed change apply_diff could not make, before the diff changes anything
+
+    A speed may be set on an edge the same diff adds, so those count as well as the graph's own.
+    """
+    added = {}
+    for item in diff.get("add_edges") or ():
+        u, v, key, data = (*item[:2], None, item[2]) if len(item) == 3 else item
+        added.setdefault((u, v), []).append((key, data))
+
+    for item in diff.get("speeds") or ():
+        edge, speed = tuple(item[:-1]), float(item[-1])
+        if not speed > 0:
+            raise ValueError(f"Speed of edge {edge} must be positive, got {speed}.")
+        u, v = edge[:2]
+        edges = [data for key, data in graph[u][v].items() if len(edge) == 2 or key == edge[2]] if graph.has_edge(u, v) else []
+        edges += [data for key, data in added.get((u, v), ()) if len(edge) == 2 or key in (None, edge[2])]
+        if not edges:
+            raise ValueError(f"Edge {edge} is not in the graph.")
+        if any("length" not in data for data in edges):
+            raise ValueError(f"Edge {edge} has no length to turn its speed into a travel time.")
+
+
+def _edges(graph, item) -> list:
+    """the (u, v, key) of an edge reference, every parallel edge for (u, v)"""
+    u, v = item[0], item[1]
+    if len(item) > 2:
+        if not graph.has_edge(u, v, item[2]):
+            raise ValueError(f"Edge ({u}, {v}, {item[2]}) is not in the graph.")
+        return [(u, v, item[2])]
+    if not graph.has_edge(u, v):
+        raise ValueError(f"Edge ({u}, {v}) is not in the graph.")
+    return [(u, v, key) for key in list(graph[u][v])]
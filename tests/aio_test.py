@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import numpy as np
+import pytest
+from src import AsyncIndex, Index
+from src.cache import MemoryCache
+from src.geocoding import GeocodeCache
+from src.metrics import Metrics
+from src.osrm import AsyncOSRMClient
+from src.tiles import GraphTileCache
+from tests.osrm_test import stub_osrm
+
+
+@pytest.fixture
+def slow_tiles(grid_graph):
+    loads = []
+
+    def loader(*args):
+        loads.append(args)
+        time.sleep(0.2)
+        return grid_graph
+    return GraphTileCache(tile_size=1.0, loader=loader), loads
+
+
+def test_identical_geocodes_share_one_request(tmp_path):
+    requests = []
+
+    async def geocoder(place_name):
+        requests.append(place_name)
+        await asyncio.sleep(0.05)
+        return None if place_name == "Nowhere" else (-6.8, 39.28)
+
+    async def run():
+        index = Index(geocode_cache=GeocodeCache(path=str(tmp_path / "geocode.sqlite")))
+        async with AsyncIndex(index, geocoder=geocoder, geocode_rate=0) as aio:
+            first = await asyncio.gather(aio.geocode("Kariakoo, Dar es Salaam"), aio.geocode("kariakoo,  dar es salaam"),
+                                         aio.geocode_many(["Kariakoo, Dar es Salaam", "Nowhere", None]))
+            return first, await aio.geocode("KARIAKOO, Dar es Salaam")
+
+    (one, two, many), cached = asyncio.run(run())
+    assert one == two == cached == (-6.8, 39.28)
+    assert many == [(-6.8, 39.28), (), ()]
+    assert sorted(requests) == ["Kariakoo, Dar es Salaam", "Nowhere"]
+
+
+def test_concurrent_road_distances_compute_once_off_the_loop(slow_tiles):
+    tile_cache, loads = slow_tiles
+    metrics = Metrics()
+    origin, destination = (-6.7995, 39.2805), (-6.795, 39.287)
+    ticks = []
+
+    async def heartbeat():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        async with AsyncIndex(Index(tile_cache=tile_cache, cache=MemoryCache(), metrics=metrics)) as aio:
+            beat = asyncio.create_task(heartbeat())
+            distances = await asyncio.gather(*(aio.get_road_distance(origin, destination, "drive", "length") for _ in range(8)))
+            beat.cancel()
+            return distances
+
+    distances = asyncio.run(run())
+    assert len(set(distances)) == 1 and distances[0] > 0
+    assert len(loads) == 1
+    assert metrics.stats()["get_road_distance"]["calls"] == 1
+    # the loop kept running while the tile loaded on a worker thread
+    assert len(ticks) > 10 and max(np.diff(ticks)) < 0.1
+
+
+def test_matrix_and_route(grid_graph):
+    origins, destinations = [(-6.80, 39.28), (-6.795, 39.285)], [(-6.791, 39.289)]
+
+    async def run():
+        osrm = AsyncOSRMClient(transport=httpx.MockTransport(stub_osrm))
+        async with AsyncIndex(Index(cache=MemoryCache()), osrm=osrm) as aio:
+            matrix = await aio.get_distance_matrix(origins, destinations, "drive", graph=grid_graph)
+            routes = await asyncio.gather(aio.route((-6.8, 1.0), (-6.9, 2.0)), aio.run("get_bearing", origins[0], destinations[0]))
+            return matrix, routes
+
+    (distances, durations), (route, bearing) = asyncio.run(run())
+    expected = Index(cache=MemoryCache()).get_distance_matrix(origins, destinations, "drive", graph=grid_graph)
+    np.testing.assert_allclose(distances, expected[0])
+    np.testing.assert_allclose(durations, expected[1])
+    assert route == (3.0, 60.0)
+    assert bearing == pytest.approx(Index().get_bearing(origins[0], destinations[0]))
+
+
+def test_tile_cache_downloads_each_tile_once_across_threads(slow_tiles):
+    tile_cache, loads = slow_tiles
+    graphs = []
+    threads = [threading.Thread(target=lambda: graphs.append(tile_cache.get_tile(("drive", -7, 39)))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1 and len(graphs) == 4 and all(graph is graphs[0] for graph in graphs)
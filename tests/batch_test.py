@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from src import Index
+
+
+@pytest.fixture
+def saved_grid(grid_graph, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for u, v, data in grid_graph.edges(data=True):
+        data["travel_time"] = data["length"] / (5 + (u + v) % 7)
+    grid_graph.remove_edge(0, 1)
+    Index.save_graph(grid_graph, graph_name="grid", network_type="drive")
+    return grid_graph
+
+
+def test_route_many_matches_single_routes(saved_grid):
+    rng = np.random.default_rng(5)
+    points = np.column_stack((rng.uniform(-6.80, -6.791, 40), rng.uniform(39.28, 39.289, 40)))
+    pairs = [(tuple(points[i]), tuple(points[-i - 1])) for i in range(40)]
+
+    routes = list(Index.route_many("grid", "drive", pairs, weight="time", workers=2))
+    assert len(routes) == len(pairs)
+
+    csr = Index.load_csr_graph("grid", "drive")
+    for (origin, destination), (distance, duration) in zip(pairs, routes):
+        source, target = csr.nearest_nodes([origin[0], destination[0]], [origin[1], destination[1]]).tolist()
+        cost, path = csr.shortest_path(source, target, weight="travel_time")
+        assert duration == pytest.approx(cost)
+        assert distance == pytest.approx(csr.path_metric(path, "travel_time", "length"))
+
+
+def test_route_many_uses_saved_hierarchy(saved_grid):
+    pairs = [((-6.80, 39.281), (-6.80, 39.28)), ((-6.791, 39.289), (-6.80, 39.28))]
+    plain = list(Index.route_many("grid", "drive", pairs, workers=1))
+    Index.build_contraction_hierarchy("grid", "drive", weight="length", benchmark_queries=5)
+    assert list(Index.route_many("grid", "drive", pairs, workers=2)) == pytest.approx(plain)
+
+
+def test_stream_distance_matrix_matches_in_process(saved_grid):
+    origins = [(-6.80, 39.28), (-6.795, 39.285), (-6.791, 39.289)]
+    destinations = [(-6.80, 39.281), (-6.792, 39.28)]
+    rows = list(Index.stream_distance_matrix("grid", "drive", origins, destinations, weight="time", workers=2))
+    distances, durations = Index().get_distance_matrix(origins, destinations, mode="drive", weight="time", graph=saved_grid)
+    np.testing.assert_allclose(np.array([row[0] for row in rows]), distances)
+    np.testing.assert_allclose(np.array([row[1] for row in rows]), durations)
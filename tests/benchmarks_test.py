@@ -0,0 +1,22 @@
+from src.benchmarks import CASES, format_report, grid_graph, run_benchmarks
+
+
+def test_grid_graph_shape():
+    graph = grid_graph(4, 5, arterial_every=2)
+    assert graph.number_of_nodes() == 20
+    assert graph.number_of_edges() == 2 * (4 * 4 + 3 * 5)
+    assert graph[0][1][0]["highway"] == "primary" and graph[5][6][0]["highway"] == "residential"
+    assert graph[6][11][0]["name"] == "Column 1" and graph[11][6][0]["length"] > 110
+
+
+def test_run_benchmarks_offline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    report = run_benchmarks(grid_graph(12, 12), queries=6, repeats=2, matrix_size=3)
+    assert list(report["cases"]) == list(CASES)
+    for name, case in report["cases"].items():
+        assert case["latency_ms"]["p50"] <= case["latency_ms"]["p99"]
+        assert case["items_per_second"] > 0 and case["peak_bytes"] >= 0
+    assert report["cases"]["distance_matrix"]["items"] == 9
+    assert report["graph"] == {"nodes": 144, "edges": 528}
+    assert list(tmp_path.iterdir()) == []
+    assert "road_distance" in format_report(report)
@@ -0,0 +1,120 @@
+import time
+import numpy as np
+import pytest
+from src import Index
+from src.cache import MISSING, MemoryCache, SQLiteCache, cached
+from src.tiles import GraphTileCache
+
+
+class Counter:
+    """an object with cached methods that counts how often they really run"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.calls = 0
+
+    @cached
+    def double(self, value, scale=2):
+        self.calls += 1
+        return np.full(value, scale)
+
+    @cached
+    def fail(self, value):
+        self.calls += 1
+        return None, None
+
+
+def test_entries_are_shared_and_bounded():
+    cache = MemoryCache(max_entries=2)
+    first, second = Counter(cache), Counter(cache)
+    first.double(3)
+    second.double(3)
+    assert first.calls == 1 and second.calls == 0
+
+    second.double(4)
+    second.double(5)
+    assert cache.get(("double", (3,), ())) is MISSING
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1
+    assert stats["hits"] == 1 and stats["hit_rate"] == pytest.approx(1 / 5)
+
+
+def test_byte_budget_and_clear():
+    cache = MemoryCache(max_entries=100, max_bytes=800)
+    counter = Counter(cache)
+    counter.double(50)
+    counter.double(40, scale=3)
+    # arrays of 400 and 320 bytes fit, one of 240 more pushes the oldest out
+    counter.double(30)
+    assert cache.stats()["entries"] == 2 and cache.stats()["bytes"] == 560
+
+    cache.clear("double")
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+
+
+def test_ttl_per_method():
+    cache = MemoryCache(ttls={"double": 0.01})
+    counter = Counter(cache)
+    counter.double(1)
+    time.sleep(0.02)
+    counter.double(1)
+    assert counter.calls == 2 and cache.stats()["expirations"] == 1
+
+
+def test_failures_and_unhashable_arguments_are_not_cached():
+    cache = MemoryCache()
+    counter = Counter(cache)
+    counter.fail(1)
+    counter.fail(1)
+    assert counter.calls == 2 and cache.stats()["entries"] == 0
+    counter.double([2])
+    assert cache.stats()["entries"] == 0
+
+
+def test_sqlite_cache_is_shared_between_processes(tmp_path):
+    # two caches on one file stand in for two processes
+    writer = SQLiteCache(tmp_path / "cache.sqlite", max_entries=2)
+    reader = SQLiteCache(tmp_path / "cache.sqlite", max_entries=2)
+    Counter(writer).double(3)
+    counter = Counter(reader)
+    assert counter.double(3).tolist() == [2, 2, 2] and counter.calls == 0
+
+    counter.double(4)
+    counter.double(5)
+    assert reader.stats()["entries"] == 2 and reader.stats()["evictions"] == 1
+    reader.clear()
+    assert writer.stats()["entries"] == 0
+
+
+def test_index_methods_use_the_instance_cache():
+    origin, destination = (-6.8096036, 39.2854829), (-6.867255, 39.310245)
+    cache = MemoryCache()
+    Index(cache=cache).get_bearing(origin, destination)
+    Index(cache=cache).get_bearing(origin, destination)
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+
+def test_keys_bind_arguments_to_the_signature():
+    cache = MemoryCache()
+    counter = Counter(cache)
+    counter.double(3)
+    counter.double(3, 2)
+    counter.double(3, scale=2)
+    counter.double(value=3)
+    assert counter.calls == 1 and cache.stats()["entries"] == 1
+    counter.double(3, scale=3)
+    assert counter.calls == 2
+
+
+def test_instances_with_other_sources_do_not_share_entries(grid_graph):
+    cache, loads = MemoryCache(), []
+
+    def tiles(name):
+        return GraphTileCache(loader=lambda *args: loads.append(name) or grid_graph.copy())
+
+    first, second = Index(cache=cache, tile_cache=tiles("first")), Index(cache=cache, tile_cache=tiles("second"))
+    for index in (first, second, first):
+        index.get_shortest_route((-6.799, 39.281), (-6.795, 39.285), "drive", "length")
+    assert set(loads) == {"first", "second"} and cache.stats()["hits"] == 1
+    assert Index(cache=cache).cache_scope == (None, None, None)
@@ -0,0 +1,68 @@
+import math
+import random
+import networkx as nx
+import pytest
+from src import Index
+from src.ch import build_contraction_hierarchy, ContractionHierarchy
+from src.csr import CSRGraph
+
+
+@pytest.fixture
+def weighted_graph(grid_graph):
+    rng = random.Random(7)
+    for u, v, data in grid_graph.edges(data=True):
+        data["travel_time"] = data["length"] / rng.uniform(5, 20)
+    for u, v in [(0, 1), (45, 46), (77, 67)]:
+        grid_graph.remove_edge(u, v)
+    return grid_graph
+
+
+@pytest.mark.parametrize("weight", ["length", "travel_time"])
+def test_queries_match_dijkstra(weighted_graph, weight, tmp_path):
+    csr = CSRGraph.from_graph(weighted_graph)
+    build_contraction_hierarchy(csr, weight).save(tmp_path / "ch.npz")
+    hierarchy = ContractionHierarchy.load(tmp_path / "ch.npz")
+
+    rng = random.Random(3)
+    for _ in range(50):
+        source, target = rng.randrange(csr.node_count), rng.randrange(csr.node_count)
+        cost, length = hierarchy.query(source, target)
+        expected_path = nx.shortest_path(weighted_graph, csr.nodes[source], csr.nodes[target], weight=weight)
+        assert cost == pytest.approx(nx.path_weight(weighted_graph, expected_path, weight))
+
+        nodes = csr.nodes[hierarchy.path(source, target)].tolist()
+        assert nodes[0] == csr.nodes[source] and nodes[-1] == csr.nodes[target]
+        assert nx.path_weight(weighted_graph, nodes, weight) == pytest.approx(cost)
+        assert csr.path_metric(hierarchy.path(source, target), weight) == pytest.approx(length)
+
+
+def test_road_distance_uses_saved_hierarchy(weighted_graph, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Index.save_graph(weighted_graph, graph_name="grid", network_type="drive")
+    origin, destination = (-6.8, 39.28), (-6.792, 39.288)
+
+    plain = Index().get_road_distance(origin, destination, mode="drive", weight="time", graph_name="grid")
+    report = Index.build_contraction_hierarchy("grid", "drive", weight="time", benchmark_queries=20)
+    assert report["shortcuts"] >= 0 and report["ch_query_ms"]["p50"] > 0
+    assert (tmp_path / "Graph_Network/grid/drive/grid_ch_travel_time.npz").exists()
+
+    assert Index().get_road_distance(origin, destination, mode="drive", weight="time", graph_name="grid") == pytest.approx(plain)
+    assert not math.isclose(plain, -1)
+
+
+def test_edge_snapped_road_distance(weighted_graph, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Index.save_graph(weighted_graph, graph_name="grid", network_type="drive")
+    # both points sit halfway along a block, where snapping to a node would be off by half an edge
+    origin, destination = (-6.79995, 39.2825), (-6.7940, 39.28795)
+
+    plain = Index().get_road_distance(origin, destination, mode="drive", weight="length", graph_name="grid", snap="edge")
+    Index.build_contraction_hierarchy("grid", "drive", weight="length", benchmark_queries=5)
+    fast = Index().get_road_distance(origin, destination, mode="drive", weight="length", graph_name="grid", snap="edge")
+    assert fast == pytest.approx(plain)
+
+    csr = Index.get_csr_graph(weighted_graph)
+    snap = Index.get_edge_index(weighted_graph).snap([origin[0], destination[0]], [origin[1], destination[1]])
+    _, expected, _ = csr.snapped_route(
+        (snap.edges[0], snap.fractions[0]), (snap.edges[1], snap.fractions[1]), weight="length")
+    assert plain == pytest.approx(expected) and plain > 0
@@ -0,0 +1,7 @@
+import pytest
+from src import benchmarks
+
+
+@pytest.fixture
+def grid_graph():
+    return benchmarks.grid_graph(rows=10, cols=10)
@@ -0,0 +1,90 @@
+import numpy as np
+import networkx as nx
+import pytest
+from src.csr import CSRGraph
+
+
+def test_from_graph_layout(grid_graph):
+    csr = CSRGraph.from_graph(grid_graph)
+    assert csr.node_count == grid_graph.number_of_nodes()
+    assert csr.edge_count == grid_graph.number_of_edges()
+    assert csr.indptr[-1] == csr.edge_count
+    assert (np.diff(csr.tails) >= 0).all()
+
+
+def test_cost_matrix_uses_cheapest_parallel_edge():
+    graph = nx.MultiDiGraph()
+    for node in range(3):
+        graph.add_node(node, x=0.0, y=float(node))
+    graph.add_edge(0, 1, key=0, length=10.0, travel_time=1.0)
+    graph.add_edge(0, 1, key=1, length=5.0, travel_time=4.0)
+    graph.add_edge(1, 2, key=0, length=2.0, travel_time=2.0)
+
+    csr = CSRGraph.from_graph(graph)
+    costs, sums = csr.cost_matrix([0, 2], [2, 0], weight="travel_time")
+    assert costs[0, 0] == 3.0
+    assert sums["length"][0, 0] == 12.0
+    assert np.isinf(costs[1, 1]) and np.isnan(sums["length"][1, 1])
+
+    costs, sums = csr.cost_matrix([0], [2], weight="length")
+    assert costs[0, 0] == sums["length"][0, 0] == 7.0
+    assert sums["travel_time"][0, 0] == pytest.approx(6.0)
+
+
+@pytest.mark.parametrize("method", ["bidirectional", "astar"])
+@pytest.mark.parametrize("weight", ["length", "travel_time"])
+def test_shortest_path_matches_networkx(grid_graph, method, weight):
+    for u, v, data in grid_graph.edges(data=True):
+        data["travel_time"] = data["length"] / (5 + (u * 7 + v * 3) % 11)
+    csr = CSRGraph.from_graph(grid_graph)
+
+    for source, target in [(0, 99), (12, 87), (55, 4), (31, 31)]:
+        cost, path = csr.shortest_path(csr.node_index[source], csr.node_index[target], weight=weight, method=method)
+        assert cost == pytest.approx(nx.shortest_path_length(grid_graph, source, target, weight=weight))
+        nodes = csr.nodes[path].tolist()
+        assert nodes[0] == source and nodes[-1] == target
+        assert sum(min(d[weight] for d in grid_graph[a][b].values()) for a, b in zip(nodes, nodes[1:])) == pytest.approx(cost)
+
+
+@pytest.mark.parametrize("method", ["bidirectional", "astar"])
+def test_shortest_path_unreachable(method):
+    graph = nx.MultiDiGraph()
+    graph.add_node(0, x=39.0, y=-6.0)
+    graph.add_node(1, x=39.001, y=-6.0)
+    graph.add_edge(1, 0, key=0, length=110.0)
+    csr = CSRGraph.from_graph(graph)
+    assert csr.shortest_path(0, 1, method=method) == (float("inf"), None)
+
+
+def _edge(csr, u, v):
+    return int(np.flatnonzero((csr.tails == csr.node_index[u]) & (csr.heads == csr.node_index[v]))[0])
+
+
+def test_snapped_route_counts_partial_edges(grid_graph):
+    csr = CSRGraph.from_graph(grid_graph)
+    length = grid_graph[0][1][0]["length"]
+
+    # halfway along 0 -> 1 to a quarter of the way along 2 -> 3, straight along row 0
+    cost, total, path = csr.snapped_route((_edge(csr, 0, 1), 0.5), (_edge(csr, 2, 3), 0.25))
+    assert cost == total == pytest.approx(1.75 * length)
+    assert csr.nodes[path].tolist() == [1, 2]
+
+    # the other way round turns back onto the reverse edges
+    cost, _, path = csr.snapped_route((_edge(csr, 2, 3), 0.25), (_edge(csr, 0, 1), 0.5))
+    assert cost == pytest.approx(1.75 * length)
+    assert csr.nodes[path].tolist() == [2, 1]
+
+    # on the same edge, backwards along a two-way street
+    cost, _, path = csr.snapped_route((_edge(csr, 0, 1), 0.75), (_edge(csr, 0, 1), 0.25))
+    assert cost == pytest.approx(0.5 * length) and path == []
+
+
+def test_snapped_route_respects_one_way_edges(grid_graph):
+    grid_graph.remove_edge(1, 0)
+    csr = CSRGraph.from_graph(grid_graph)
+    length = grid_graph[0][1][0]["length"]
+
+    # going backwards along 0 -> 1 means driving round the block 1 -> 11 -> 10 -> 0 -> 1
+    cost, _, path = csr.snapped_route((_edge(csr, 0, 1), 0.75), (_edge(csr, 0, 1), 0.25))
+    assert cost == pytest.approx(0.25 * length + nx.shortest_path_length(grid_graph, 1, 0, weight="length") + 0.25 * length)
+    assert csr.nodes[path].tolist() == [1, 11, 10, 0]
@@ -0,0 +1,132 @@
+import threading
+import time
+import pytest
+from src import Index
+from src.geocoding import GeocodeCache, geocode_many, normalize_place
+
+
+class StubGeocoder:
+    """answers from a fixed table, counting calls, and fails on names containing 'offline'"""
+
+    places = {
+        "kigamboni ferry terminal": (-6.8218, 39.3017),
+        "ubungo maji, dar es salaam": (-6.787, 39.2044),
+    }
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, place_name):
+        with self._lock:
+            self.calls.append(place_name)
+        if "offline" in place_name.lower():
+            raise ConnectionError("no network")
+        return self.places.get(normalize_place(place_name))
+
+
+def test_normalize_place():
+    assert normalize_place("  Ubungo  Maji ,Dar es Salaam, ") == "ubungo maji, dar es salaam"
+
+
+def test_geocode_many_dedupes_and_caches(tmp_path):
+    geocoder = StubGeocoder()
+    cache = GeocodeCache(tmp_path / "geocode.sqlite")
+    names = ["Kigamboni Ferry Terminal", "kigamboni  ferry terminal", "Nowhere", "Ubungo Maji,Dar es Salaam", None, "Offline place"]
+
+    locations = geocode_many(names, geocoder, cache, rate=0)
+    assert locations == [(-6.8218, 39.3017), (-6.8218, 39.3017), (), (-6.787, 39.2044), (), ()]
+    assert sorted(geocoder.calls) == ["Kigamboni Ferry Terminal", "Nowhere", "Offline place", "Ubungo Maji,Dar es Salaam"]
+
+    # a new process sees the same file: hits and the negative result are served without the geocoder,
+    # the failure was not cached and is retried
+    geocoder = StubGeocoder()
+    assert geocode_many(names, geocoder, GeocodeCache(tmp_path / "geocode.sqlite"), rate=0) == locations
+    assert geocoder.calls == ["Offline place"]
+
+
+def test_expired_entries_are_refreshed(tmp_path):
+    geocoder = StubGeocoder()
+    cache = GeocodeCache(tmp_path / "geocode.sqlite", ttl=60, negative_ttl=0)
+    geocode_many(["Kigamboni Ferry Terminal", "Nowhere"], geocoder, cache, rate=0)
+    time.sleep(0.01)
+    geocode_many(["Kigamboni Ferry Terminal", "Nowhere"], geocoder, cache, rate=0)
+    assert geocoder.calls.count("Kigamboni Ferry Terminal") == 1
+    assert geocoder.calls.count("Nowhere") == 2
+
+
+def test_misses_are_rate_limited(tmp_path):
+    geocoder = StubGeocoder()
+    start = time.monotonic()
+    geocode_many([f"place {i}" for i in range(5)], geocoder, GeocodeCache(tmp_path / "geocode.sqlite"), rate=50, max_concurrency=5)
+    assert len(geocoder.calls) == 5
+    assert time.monotonic() - start >= 4 / 50
+
+
+def test_index_geocode_uses_pluggable_geocoder(tmp_path):
+    geocoder = StubGeocoder()
+    index = Index(geocoder=geocoder, geocode_cache=GeocodeCache(tmp_path / "geocode.sqlite"))
+    assert index.geocode("Kigamboni Ferry Terminal") == (-6.8218, 39.3017)
+    assert index.geocode_many(["Kigamboni ferry terminal", "Nowhere"], rate=0) == [(-6.8218, 39.3017), ()]
+    assert geocoder.calls == ["Kigamboni Ferry Terminal", "Nowhere"]
+
+
+def test_index_calls_share_one_rate_limit(tmp_path):
+    geocoder = StubGeocoder()
+    index = Index(geocoder=geocoder, geocode_cache=GeocodeCache(tmp_path / "geocode.sqlite"), geocode_rate=20)
+    start = time.monotonic()
+    threads = [threading.Thread(target=index.geocode, args=(f"place {i}",)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    index.geocode("place 3")
+    assert len(geocoder.calls) == 4
+    assert time.monotonic() - start >= 3 / 20
+
+
+def test_default_geocode_cache_stays_in_memory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    geocoder = StubGeocoder()
+    for _ in range(2):
+        assert Index(geocoder=geocoder).geocode("Somewhere only cached in memory") == ()
+    assert geocoder.calls == ["Somewhere only cached in memory"]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_reverse_geocode_from_graph(grid_graph):
+    # the stretch of row 0 between columns 0 and 1 has no name, only a road number
+    for u, v in [(0, 1), (1, 0)]:
+        del grid_graph[u][v][0]["name"]
+        grid_graph[u][v][0]["ref"] = "A7"
+    # and column 5 has neither, so its points go to the next street over
+    for u, v, data in grid_graph.edges(data=True):
+        if u % 10 == 5 and v % 10 == 5:
+            del data["name"]
+
+    index = Index(reverse_geocoder=lambda lat, lng: None)
+    streets = index.reverse_geocode_many(
+        [(-6.79998, 39.2805), (-6.7955, 39.28501), (-6.7955, 39.2853), None, (10.0, 10.0)], grid_graph, max_distance=60)
+    assert streets[0]["name"] == "A7" and streets[0]["edge"] == (0, 1, 0)
+    assert streets[0]["location"] == pytest.approx((-6.80, 39.2805)) and streets[0]["distance"] == pytest.approx(2.2, abs=0.1)
+    # a meter from column 5, but the nearest named streets are the rows 55 meters either side
+    assert streets[1]["name"] in ("Row 4", "Row 5") and streets[1]["distance"] == pytest.approx(55.6, abs=0.5)
+    assert streets[2]["name"] in ("Row 4", "Row 5") and streets[2]["highway"] == "residential"
+    assert streets[3] == {} and streets[4] == {}
+
+
+def test_reverse_geocode_remote_fallback(grid_graph):
+    calls = []
+
+    def remote(lat, lng):
+        calls.append((lat, lng))
+        return {"name": "Far away road", "highway": None, "location": (lat, lng), "distance": None, "edge": None}
+
+    index = Index(reverse_geocoder=remote, geocode_rate=20)
+    start = time.monotonic()
+    assert index.reverse_geocode((-6.79995, 39.2805), grid_graph, remote=True)["name"] == "Row 0"
+    assert index.reverse_geocode((10.0, 10.0), grid_graph, remote=True)["name"] == "Far away road"
+    assert index.reverse_geocode((10.0, 10.0), None, remote=True)["name"] == "Far away road"
+    assert calls == [(10.0, 10.0), (10.0, 10.0)]
+    # separate calls share the Index's limiter, so the second remote request waited for its slot
+    assert time.monotonic() - start >= 1 / 20
@@ -1,5 +1,8 @@
 import pytest
+import networkx as nx
+import osmnx as ox
 from src import Index
+from src.tiles import GraphTileCache
 
 
 
@@ -40,7 +43,56 @@ def test_geocode(index, single_target):
     assert index.geocode("Kigamboni Ferry Terminal") == single_target
 
 
-def test_get_road_distance(index, origin, destination):
-    _distance = index.get_road_distance(origin, destination, mode='drive', weight='time')
-    print("Road Distance: ",_distance)
-    assert _distance == 12348.612000000001
\ No newline at end of file
+def test_get_road_distance(grid_graph):
+    # the primary streets on row 0 are twice as fast, so the quickest way along row 1 detours over them
+    tiles = GraphTileCache(loader=lambda north, south, east, west, network_type: grid_graph.copy())
+    index = Index(tile_cache=tiles)
+    start, end = (-6.799, 39.282), (-6.799, 39.288)
+    shortest = index.get_road_distance(start, end, mode='drive', weight='length')
+    quickest = index.get_road_distance(start, end, mode='drive', weight='time')
+    assert shortest == pytest.approx(6 * grid_graph[12][13][0]["length"])
+    assert quickest == pytest.approx(6 * grid_graph[2][3][0]["length"] + 2 * grid_graph[2][12][0]["length"])
+
+
+def test_get_distances_matches_scalar(index, origin, destination, single_target):
+    origins = [origin, single_target, origin]
+    destinations = [destination, destination, single_target]
+    great_circle = index.get_distances(origins, destinations, 'great_circle')
+    euclidean = index.get_distances(origins, destinations, 'euclidean')
+    bearings = index.get_bearings(origins, destinations)
+    for i, (o, d) in enumerate(zip(origins, destinations)):
+        assert great_circle[i] == pytest.approx(index.get_great_circle_distance(o, d))
+        assert euclidean[i] == pytest.approx(index.get_euclidean_distance(o, d))
+        assert bearings[i] == pytest.approx(index.get_bearing(o, d))
+
+
+def test_get_distances_sentinel_per_element(index, origin, destination):
+    distances = index.get_great_circle_distances([origin, None, (1.0, "x")], destination)
+    assert distances[0] == pytest.approx(6969.148899790171)
+    assert list(distances[1:]) == [-1, -1]
+    assert list(index.get_distances([origin, None], destination, 'euclidean')[1:]) == [-1]
+
+
+def test_get_distances_errors_raise_like_the_other_batch_methods(index, origin, destination):
+    with pytest.raises(ValueError):
+        index.get_distances([origin, origin], [destination] * 3, 'great_circle')
+    with pytest.raises(ValueError):
+        index.get_bearings([origin, origin], [destination] * 3)
+    with pytest.raises(ValueError):
+        index.get_distances([origin], [destination], 'manhattan')
+
+
+def test_get_distance_matrix(index, grid_graph):
+    origins = [(-6.80, 39.28), (-6.795, 39.285)]
+    destinations = [(-6.80, 39.28), (-6.792, 39.288), (-6.80, 39.289)]
+    distances, durations = index.get_distance_matrix(origins, destinations, mode='drive', weight='length', graph=grid_graph)
+
+    assert distances.shape == durations.shape == (2, 3)
+    assert distances[0, 0] == 0
+    for i, origin in enumerate(origins):
+        for j, destination in enumerate(destinations):
+            source = ox.nearest_nodes(grid_graph, origin[1], origin[0])
+            target = ox.nearest_nodes(grid_graph, destination[1], destination[0])
+            expected = nx.shortest_path_length(grid_graph, source, target, weight='length')
+            assert distances[i, j] == pytest.approx(expected)
+    assert (durations[distances > 0] > 0).all()
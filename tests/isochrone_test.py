@@ -0,0 +1,52 @@
+import networkx as nx
+import numpy as np
+import pytest
+import shapely
+from src import Index
+
+
+@pytest.fixture
+def timed_grid(grid_graph):
+    for u, v, data in grid_graph.edges(data=True):
+        data["travel_time"] = data["length"] / (5 + (u + v) % 7)
+    return grid_graph
+
+
+def test_nodes_match_networkx(timed_grid):
+    origin = (-6.7955, 39.2845)
+    isochrones = Index().get_isochrones(origin, [300, 60, 120], mode="drive", weight="time", graph=timed_grid)
+    assert list(isochrones) == [60, 120, 300]
+
+    source = Index.get_node_index(timed_grid).nearest([origin[0]], [origin[1]])[0]
+    for threshold, reach in isochrones.items():
+        expected = nx.single_source_dijkstra_path_length(timed_grid, source, cutoff=threshold, weight="travel_time")
+        assert sorted(reach["nodes"].tolist()) == sorted(expected)
+    assert isochrones[300]["polygon"].contains(isochrones[60]["polygon"].buffer(-1e-6))
+
+
+def test_polygon_covers_partly_reached_edges(grid_graph):
+    # from the corner node, 250 m reaches two blocks along each side and about 30 m into the third
+    isochrones = Index().get_isochrones((-6.80, 39.28), [250], mode="walk", weight="length", graph=grid_graph, buffer=5)
+    reach = isochrones[250]
+    assert sorted(reach["nodes"].tolist()) == [0, 1, 2, 10, 11, 20]
+
+    polygon = reach["polygon"]
+    node = lambda n: (grid_graph.nodes[n]["x"], grid_graph.nodes[n]["y"])
+    assert all(shapely.contains_xy(polygon, *node(n)) for n in reach["nodes"].tolist())
+    x2, y2 = node(2)
+    x3, _ = node(3)
+    assert shapely.contains_xy(polygon, x2 + 0.2 * (x3 - x2), y2)
+    assert not shapely.contains_xy(polygon, x2 + 0.6 * (x3 - x2), y2)
+    assert not shapely.contains_xy(polygon, *node(22))
+
+
+def test_batch_matches_single_origins(timed_grid):
+    index = Index()
+    origins = [(-6.80, 39.28), None, (-6.791, 39.289)]
+    many = index.get_isochrones_many(origins, [90, 45], mode="drive", graph=timed_grid)
+    assert len(many) == 3 and many[1] == {}
+    for origin, isochrones in zip([origins[0], origins[2]], [many[0], many[2]]):
+        single = index.get_isochrones(origin, [45, 90], mode="drive", graph=timed_grid)
+        for threshold in (45, 90):
+            np.testing.assert_array_equal(isochrones[threshold]["nodes"], single[threshold]["nodes"])
+            assert isochrones[threshold]["polygon"].equals(single[threshold]["polygon"])
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from src import Index
+from src.matching import MapMatcher
+from src.versions import apply_diff
+
+
+# a drive through the grid, turning at several corners
+PATH = [0, 1, 2, 12, 22, 23, 24, 34, 44, 45, 46, 56, 66, 67, 68, 78, 88, 89]
+
+
+def _trace(graph, path, per_edge=5, noise=8.0, seed=0):
+    """pings every few meters along the path, starting and ending half way along its end edges, with GPS noise"""
+    lats = np.array([graph.nodes[n]["y"] for n in path])
+    lngs = np.array([graph.nodes[n]["x"] for n in path])
+    steps = np.linspace(0.5, len(path) - 1.5, per_edge * (len(path) - 2) + 1)
+    rng = np.random.default_rng(seed)
+    return np.column_stack((
+        np.interp(steps, np.arange(len(path)), lats) + rng.normal(0, noise / 111_000, len(steps)),
+        np.interp(steps, np.arange(len(path)), lngs) + rng.normal(0, noise / 111_000, len(steps))))
+
+
+def _driven(graph, path):
+    # the trace starts and ends half way along the first and last edges
+    lengths = [graph[u][v][0]["length"] for u, v in zip(path, path[1:])]
+    return sum(lengths) - lengths[0] / 2 - lengths[-1] / 2
+
+
+def test_candidates_are_distinct_nearest_edges(grid_graph):
+    edges = Index.get_edge_index(grid_graph)
+    csr = Index.get_csr_graph(grid_graph)
+    ends = lambda found: [frozenset((int(csr.nodes[csr.tails[e]]), int(csr.nodes[csr.heads[e]]))) for e in found.edges[0] if e >= 0]
+
+    # 20 m north of the middle of the street between 11 and 12, which is indexed once for both directions
+    found = edges.candidates([-6.799 + 0.00018], [39.2815], radius=30, k=3)
+    assert ends(found) == [frozenset((11, 12))]
+    assert found.distances[0, 0] == pytest.approx(20, abs=0.5)
+    assert found.fractions[0, 0] == pytest.approx(0.5, abs=0.01)
+
+    # 22 m east of node 11 the street through it comes next, then the one towards 1, and k cuts the rest
+    found = edges.candidates([-6.799 + 0.00018], [39.2812], radius=60, k=3)
+    assert ends(found)[0] == frozenset((11, 12)) and ends(found)[1:] == [frozenset((11, 21)), frozenset((1, 11))]
+    assert np.all(np.diff(found.distances[0]) >= 0)
+    assert (found.edges[0] >= 0).sum() == 3
+
+
+def test_match_follows_the_driven_roads(grid_graph):
+    match = Index().match_trace(_trace(grid_graph, PATH), graph=grid_graph)
+    assert [(u, v) for u, v, _ in match["edges"]] == list(zip(PATH, PATH[1:]))
+    assert match["distance"] == pytest.approx(_driven(grid_graph, PATH), abs=15)
+    assert match["breaks"] == []
+    assert np.isfinite(match["points"]).all()
+
+
+def test_windows_match_like_the_whole_trace(grid_graph):
+    trace = _trace(grid_graph, PATH, seed=3)
+    csr, edges = Index.get_csr_graph(grid_graph), Index.get_edge_index(grid_graph)
+    whole = MapMatcher(csr, edges, window=len(trace) + 1).match(trace[:, 0], trace[:, 1])
+    windowed = MapMatcher(csr, edges, window=16).match(trace[:, 0], trace[:, 1])
+    np.testing.assert_array_equal(windowed["edges"], whole["edges"])
+    assert windowed["distance"] == pytest.approx(whole["distance"])
+
+    streamed = list(MapMatcher(csr, edges, window=16).stream(trace.tolist()))
+    assert [point.index for point in streamed] == list(range(len(trace)))
+    assert sum(point.distance for point in streamed) == pytest.approx(whole["distance"])
+
+
+def test_pings_off_the_roads_and_closed_streets(grid_graph):
+    trace = _trace(grid_graph, PATH, noise=0)
+    # two pings in the middle of a block, 50 m from every street
+    trace[20] = trace[21] = (-6.7955, 39.2815)
+    match = Index().match_trace(trace, graph=grid_graph, radius=30)
+    assert np.isnan(match["points"][20:22]).all()
+    assert [(u, v) for u, v, _ in match["edges"]] == list(zip(PATH, PATH[1:]))
+
+    # with every way out of the first stretch closed, the match restarts after it
+    Index.prepare_graph(grid_graph, "drive")
+    apply_diff(grid_graph, {"close": [(2, 3), (2, 12), (12, 2)]}, "drive")
+    match = Index().match_trace(_trace(grid_graph, PATH, noise=0), graph=grid_graph)
+    assert len(match["breaks"]) == 1
+
+
+def test_match_traces_on_saved_graph(grid_graph, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Index.save_graph(grid_graph, graph_name="grid", network_type="drive")
+    traces = [_trace(grid_graph, PATH, seed=seed) for seed in range(3)] + [_trace(grid_graph, PATH[::-1], seed=4)]
+
+    matches = list(Index.match_traces("grid", "drive", traces, workers=2))
+    assert len(matches) == len(traces)
+    for trace, match in zip(traces, matches):
+        assert match["edges"] == Index().match_trace(trace, graph_name="grid")["edges"]
+    assert [(u, v) for u, v, _ in matches[-1]["edges"]] == list(zip(PATH[::-1], PATH[-2::-1]))
+
+
+def test_saved_matches_follow_graph_diffs(grid_graph, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Index.save_graph(grid_graph, graph_name="grid", network_type="drive")
+    trace = _trace(grid_graph, PATH, noise=0)
+    before = Index().match_trace(trace, graph_name="grid")
+    assert (12, 22) in [(u, v) for u, v, _ in before["edges"]]
+
+    Index.apply_graph_diff("grid", "drive", {"close": [(12, 22), (22, 12)]})
+    after = Index().match_trace(trace, graph_name="grid")
+    assert (12, 22) not in [(u, v) for u, v, _ in after["edges"]]
+    fresh = Index().match_trace(trace, graph=Index.load_graph("grid", "drive"))
+    assert after["edges"] == fresh["edges"] and after["distance"] == pytest.approx(fresh["distance"])
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+from src import Index
+from src.cache import MemoryCache
+from src.metrics import Metrics, timed_static
+from src.tiles import GraphTileCache
+
+
+@pytest.fixture
+def class_metrics():
+    Index.metrics = Metrics()
+    yield Index.metrics
+    Index.metrics = None
+
+
+def test_instance_metrics_count_calls_and_cache_hits():
+    calls = []
+    metrics = Metrics(sink=lambda *call: calls.append(call))
+    index = Index(cache=MemoryCache(), metrics=metrics)
+    for _ in range(3):
+        index.get_great_circle_distance((-6.80, 39.28), (-6.81, 39.29))
+    index.get_great_circle_distances([(-6.80, 39.28)] * 4, (-6.81, 39.29))
+
+    stats = metrics.stats()
+    assert stats["get_great_circle_distance"]["calls"] == 3
+    assert stats["get_great_circle_distance"]["cache_hits"] == 2
+    assert stats["get_great_circle_distances"]["cache_hits"] == 0
+    assert stats["get_great_circle_distances"]["latency_ms"]["p99"] >= 0
+    assert [(method, hit) for method, _, hit in calls] == [
+        ("get_great_circle_distance", False), ("get_great_circle_distance", True),
+        ("get_great_circle_distance", True), ("get_great_circle_distances", False)]
+    assert metrics.export()["index.get_great_circle_distance.calls"] == 3
+
+    metrics.reset()
+    assert metrics.stats() == {}
+    assert Index().metrics is None
+
+
+def test_nested_cache_hits_count_for_the_inner_method_only(grid_graph):
+    metrics = Metrics()
+    index = Index(tile_cache=GraphTileCache(loader=lambda *args: grid_graph), cache=MemoryCache(), metrics=metrics)
+    for _ in range(2):
+        index.get_road_distance((-6.80, 39.28), (-6.795, 39.285), "drive", "length")
+
+    stats = metrics.stats()
+    assert stats["get_road_distance"]["calls"] == 2 and stats["get_road_distance"]["cache_hits"] == 0
+    assert stats["get_shortest_route"]["calls"] == 2 and stats["get_shortest_route"]["cache_hits"] == 1
+
+
+def test_static_methods_record_in_class_metrics(grid_graph, class_metrics):
+    Index.get_subgraph(grid_graph, bbox=(-6.795, -6.80, 39.285, 39.28))
+    Index.snap_to_roads(grid_graph, [(-6.7995, 39.2805)])
+    assert {"get_subgraph", "snap_to_roads"} <= set(class_metrics.stats())
+    index = Index(cache=MemoryCache())
+    index.get_bearing((-6.80, 39.28), (-6.81, 39.29))
+    assert class_metrics.stats()["get_bearing"]["calls"] == 1
+
+
+def test_static_generators_are_timed_until_exhausted_or_closed():
+    metrics = Metrics()
+
+    @timed_static(lambda: metrics)
+    def results(count):
+        for i in range(count):
+            time.sleep(0.02)
+            yield i
+
+    stream = results(3)
+    assert metrics.stats() == {}
+    assert list(stream) == [0, 1, 2]
+    assert metrics.stats()["results"]["calls"] == 1
+    assert metrics.stats()["results"]["seconds"] >= 0.06
+
+    stream = results(100)
+    next(stream)
+    stream.close()
+    stats = metrics.stats()["results"]
+    assert stats["calls"] == 2 and stats["seconds"] < 1.0
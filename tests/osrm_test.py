@@ -0,0 +1,97 @@
+import asyncio
+import httpx
+import numpy as np
+import pytest
+from src import Index
+from src.osrm import AsyncOSRMClient, OSRMClient, OSRMError
+
+
+def stub_osrm(request: httpx.Request) -> httpx.Response:
+    """answers like OSRM, with every distance the sum of the longitudes it is asked about"""
+    service, _, profile, coordinates = request.url.path.strip("/").split("/")
+    points = [tuple(map(float, pair.split(","))) for pair in coordinates.split(";")]
+    if service == "route":
+        if points[0] == points[1]:
+            return httpx.Response(400, json={"code": "NoRoute", "message": "Impossible route"})
+        return httpx.Response(200, json={"code": "Ok", "routes": [{"distance": points[0][0] + points[1][0], "duration": 60.0}]})
+    if service == "table":
+        sources = [int(i) for i in request.url.params["sources"].split(";")]
+        destinations = [int(i) for i in request.url.params["destinations"].split(";")]
+        distances = [[None if points[s] == points[d] else points[s][0] + points[d][0] for d in destinations] for s in sources]
+        return httpx.Response(200, json={"code": "Ok", "distances": distances, "durations": distances})
+    if service == "nearest":
+        waypoints = [{"location": [points[0][0] + i, points[0][1]], "distance": float(i)} for i in range(int(request.url.params["number"]))]
+        return httpx.Response(200, json={"code": "Ok", "waypoints": waypoints})
+    return httpx.Response(400, json={"code": "InvalidService"})
+
+
+def test_route_and_no_route():
+    with OSRMClient(transport=httpx.MockTransport(stub_osrm)) as client:
+        assert client.route((-6.8, 39.2), (-6.9, 39.3)) == (pytest.approx(78.5), 60.0)
+        assert client.route((-6.8, 39.2), (-6.8, 39.2)) == (None, None)
+        assert Index.get_route((-6.8, 1.0), (-6.9, 2.0), client=client) == (3.0, 60.0)
+
+
+def test_table_is_split_into_blocks():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return stub_osrm(request)
+
+    sources = [(0.0, float(i)) for i in range(5)]
+    destinations = [(0.0, float(i)) for i in range(3, 6)]
+    with OSRMClient(transport=httpx.MockTransport(handler), table_size=4) as client:
+        distances, durations = client.table(sources, destinations)
+
+    expected = np.array([[s[1] + d[1] for d in destinations] for s in sources])
+    expected[3, 0] = expected[4, 1] = -1
+    np.testing.assert_array_equal(distances, expected)
+    np.testing.assert_array_equal(durations, expected)
+    # blocks of 2 sources by 2 destinations
+    assert len(requests) == 3 * 2
+
+
+def test_nearest_and_errors():
+    with OSRMClient(transport=httpx.MockTransport(stub_osrm)) as client:
+        assert client.nearest((-6.8, 39.2), number=2) == [(-6.8, 39.2, 0.0), (-6.8, 40.2, 1.0)]
+        with pytest.raises(OSRMError):
+            client._run(client.client._request("trip", [(0.0, 0.0)], {}))
+
+
+def test_retries_with_backoff_then_gives_up():
+    calls = []
+
+    def flaky(request):
+        calls.append(request)
+        if len(calls) < 3:
+            return httpx.Response(503)
+        return stub_osrm(request)
+
+    with OSRMClient(transport=httpx.MockTransport(flaky), retries=2, backoff=0.001) as client:
+        assert client.route((0.0, 1.0), (0.0, 2.0)) == (3.0, 60.0)
+    assert len(calls) == 3
+
+    with OSRMClient(transport=httpx.MockTransport(lambda request: httpx.Response(503)), retries=1, backoff=0.001) as client:
+        with pytest.raises(httpx.HTTPStatusError):
+            client.route((0.0, 1.0), (0.0, 2.0))
+
+
+def test_concurrency_is_bounded():
+    active, peak = 0, 0
+
+    async def slow(request):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.005)
+        active -= 1
+        return stub_osrm(request)
+
+    async def run():
+        async with AsyncOSRMClient(transport=httpx.MockTransport(slow), max_concurrency=4) as client:
+            return await client.routes([((0.0, float(i)), (0.0, 1.0)) for i in range(2, 22)])
+
+    results = asyncio.run(run())
+    assert [distance for distance, _ in results] == [float(i) + 1 for i in range(2, 22)]
+    assert peak == 4
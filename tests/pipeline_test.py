@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src import Index
+from src.pipeline import route_file, tile_groups, tile_order
+from src.tiles import GraphTileCache
+
+
+@pytest.fixture
+def trips(tmp_path):
+    rng = np.random.default_rng(11)
+    frame = pd.DataFrame({
+        "trip_id": np.arange(50),
+        "origin_lat": rng.uniform(-6.80, -6.791, 50),
+        "origin_lng": rng.uniform(39.28, 39.289, 50),
+        "destination_lat": rng.uniform(-6.80, -6.791, 50),
+        "destination_lng": rng.uniform(39.28, 39.289, 50),
+    })
+    frame.loc[7, "origin_lat"] = np.nan
+    frame.loc[8, "destination_lat"] = 95.0
+    path = tmp_path / "trips.csv"
+    frame.to_csv(path, index=False)
+    return path
+
+
+def test_tile_order_groups_trips():
+    origins = np.array([[0.12, 0.0], [0.01, 0.0], [0.13, 0.0], [0.02, 0.0]])
+    destinations = np.zeros((4, 2))
+    order, starts = tile_order(origins, destinations, tile_size=0.05)
+    assert order.tolist() == [1, 3, 0, 2] and starts.tolist() == [0, 2, 4]
+    assert tile_groups(origins[order], destinations[order], tile_size=0.05).tolist() == [0, 2, 4]
+
+
+def test_route_file_streams_chunks_in_order(trips, tmp_path):
+    reports = []
+    seen = []
+
+    def route(origins, destinations):
+        seen.append(len(origins))
+        return origins[:, 0] * 0 + 1, origins[:, 1] * 0 + 2
+
+    report = route_file(trips, tmp_path / "out.csv", route, chunk_size=16, progress=reports.append)
+    out = pd.read_csv(tmp_path / "out.csv")
+    assert out["trip_id"].tolist() == list(range(50))
+    assert out.loc[[7, 8], "distance"].tolist() == [-1, -1]
+    assert (out.drop([7, 8])["duration"] == 2).all()
+    assert seen == [14, 16, 16, 2]
+    assert [r["rows"] for r in reports] == [16, 32, 48, 50]
+    assert report["chunks"] == 4 and report["unrouted"] == 2 and report["rows_per_second"] > 0
+
+
+def test_route_trips_on_saved_graph(grid_graph, trips, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Index.save_graph(grid_graph, graph_name="grid", network_type="drive")
+    report = Index().route_trips(trips, "out.csv", mode="drive", graph_name="grid", chunk_size=20, workers=1, progress=None)
+    assert report["rows"] == 50
+
+    out = pd.read_csv("out.csv")
+    for row in out.drop([7, 8]).itertuples():
+        expected = Index().get_road_distance(
+            (row.origin_lat, row.origin_lng), (row.destination_lat, row.destination_lng), "drive", "length", graph_name="grid")
+        assert row.distance == pytest.approx(expected)
+
+
+def test_route_trips_on_tile_cache(grid_graph, trips, tmp_path):
+    loads = []
+
+    def loader(north, south, east, west, network_type):
+        loads.append((north, south, east, west))
+        return grid_graph
+
+    index = Index(tile_cache=GraphTileCache(loader=loader))
+    report = index.route_trips(trips, tmp_path / "out.csv", mode="drive", weight="time", chunk_size=20, progress=None)
+    out = pd.read_csv(tmp_path / "out.csv")
+    # three chunks, but every tile is downloaded once
+    assert report["unrouted"] == 2 and len(loads) == len(set(loads))
+    assert (out.drop([7, 8])[["distance", "duration"]] >= 0).all().all()
+
+    distances, durations = index.get_distance_matrix(
+        out.loc[[0], ["origin_lat", "origin_lng"]].to_numpy().tolist(),
+        out.loc[[0], ["destination_lat", "destination_lng"]].to_numpy().tolist(),
+        mode="drive", weight="time", graph=grid_graph)
+    assert out.loc[0, "distance"] == pytest.approx(distances[0, 0])
+    assert out.loc[0, "duration"] == pytest.approx(durations[0, 0])
+
+
+def test_parquet_round_trip(trips, tmp_path):
+    pytest.importorskip("pyarrow")
+    pd.read_csv(trips).to_parquet(tmp_path / "trips.parquet")
+    route_file(tmp_path / "trips.parquet", tmp_path / "out.parquet", lambda o, d: (o[:, 0] * 0, o[:, 0] * 0), chunk_size=16, progress=None)
+    assert len(pd.read_parquet(tmp_path / "out.parquet")) == 50
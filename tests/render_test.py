@@ -0,0 +1,49 @@
+import os
+import numpy as np
+import pytest
+from matplotlib.image import imread
+from src import Index
+from src.render import mercator_pixels, simplify_segments, tile_range
+
+
+def test_mercator_pixels():
+    x, y = mercator_pixels([0.0, 85.0511287798], [0.0, -180.0], zoom=0)
+    assert x.tolist() == pytest.approx([128, 0]) and y.tolist() == pytest.approx([128, 0], abs=1e-6)
+    # the grid straddles the border between two zoom 12 tiles at 39.2871 degrees east
+    assert [list(r) for r in tile_range(-6.791, -6.80, 39.289, 39.28, 12)] == [[2494, 2495], [2125]]
+
+
+def test_simplify_segments():
+    segments = np.array([
+        [[0.0, 0.0], [10.0, 0.0]],
+        [[10.0, 0.0], [0.1, 0.1]],    # the first one reversed, once snapped
+        [[10.0, 0.0], [10.2, 0.2]],   # shorter than a cell
+        [[10.0, 0.0], [10.0, 10.0]],
+    ])
+    simplified = simplify_segments(segments, 1.0)
+    assert simplified.tolist() == [[[0.0, 0.0], [10.0, 0.0]], [[10.0, 0.0], [10.0, 10.0]]]
+    assert simplify_segments(segments, 0) is segments
+
+
+def test_geographic_visualization(grid_graph, tmp_path):
+    path = Index.visualize_network(grid_graph, file_name="grid.png", output_dir=str(tmp_path), layout="geographic", size=400)
+    image = imread(path)
+    assert max(image.shape[:2]) == 400
+    # a ten by ten grid of black streets on white
+    assert (image[:, :, :3] < 0.5).any() and (image[:, :, :3] > 0.5).any()
+    assert len(Index.get_edge_segments(grid_graph)) == 180
+
+    with pytest.raises(ValueError):
+        Index.visualize_network(grid_graph, output_dir=str(tmp_path), layout="circle")
+
+
+def test_render_tiles(grid_graph, tmp_path):
+    report = Index.render_tiles(grid_graph, -6.78, -6.82, 39.30, 39.26, zooms=[12, 16], output_dir=str(tmp_path), workers=2)
+    written = sorted(os.path.relpath(os.path.join(root, name), tmp_path) for root, _, names in os.walk(tmp_path) for name in names)
+    # two tiles at zoom 12 and six at zoom 16 hold the grid, the rest of the box is empty
+    assert report["tiles"] == len(written) == 8
+    assert written[:2] == [os.path.join("12", "2494", "2125.png"), os.path.join("12", "2495", "2125.png")]
+    columns, rows = tile_range(-6.78, -6.82, 39.30, 39.26, 16)
+    assert report["empty"] == len(columns) * len(rows) - 6
+    tile = imread(tmp_path / written[1])
+    assert tile.shape == (256, 256, 4) and tile[:, :, 3].max() > 0 and tile[:, :, 3].min() == 0
@@ -0,0 +1,106 @@
+import numpy as np
+import osmnx as ox
+import pytest
+from shapely.geometry import LineString
+from src import Index, benchmarks
+from src.spatial import NodeIndex, great_circle
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(7)
+    return rng.uniform(-6.801, -6.790, 500), rng.uniform(39.279, 39.290, 500)
+
+
+def test_nearest_matches_brute_force(grid_graph, points):
+    lats, lngs = points
+    index = NodeIndex.from_graph(grid_graph)
+    positions, meters = index.query(lats, lngs)
+
+    brute = great_circle(lats[:, None], lngs[:, None], index.lats[None, :], index.lngs[None, :])
+    np.testing.assert_allclose(meters, brute.min(axis=1), rtol=1e-9, atol=1e-6)
+    assert (index.nearest(lats, lngs) == index.nodes[brute.argmin(axis=1)]).all()
+
+
+def test_nearest_matches_osmnx(grid_graph, points):
+    lats, lngs = points
+    # off-grid points so no query is equidistant to two nodes
+    lats, lngs = lats + 0.00013, lngs + 0.00021
+    expected = ox.nearest_nodes(grid_graph, X=lngs, Y=lats)
+    assert (NodeIndex.from_graph(grid_graph).nearest(lats, lngs) == expected).all()
+
+
+def test_k_nearest_and_radius(grid_graph):
+    index = NodeIndex.from_graph(grid_graph)
+    lat, lng = grid_graph.nodes[55]["y"], grid_graph.nodes[55]["x"]
+
+    nearest = index.k_nearest([lat], [lng], k=5)
+    assert nearest.shape == (1, 5)
+    assert nearest[0, 0] == 55 and set(nearest[0, 1:].tolist()) == {45, 54, 56, 65}
+
+    within = index.within_radius(lat, lng, 120).tolist()
+    assert within[0] == 55 and set(within) == {55, 45, 54, 56, 65}
+    assert index.within_radius(lat, lng, 1).tolist() == [55]
+
+
+def test_in_bbox_matches_scan():
+    graph = benchmarks.grid_graph(rows=30, cols=30)
+    index = NodeIndex.from_graph(graph)
+    north, south, east, west = -6.785, -6.795, 39.292, 39.285
+    expected = [
+        node for node, data in graph.nodes(data=True)
+        if south <= data["y"] <= north and west <= data["x"] <= east]
+    assert index.in_bbox(north, south, east, west).tolist() == expected
+    assert index.in_bbox(0, -1, 1, 0).tolist() == []
+
+
+def test_index_is_shared_per_graph(grid_graph):
+    assert Index.get_node_index(grid_graph) is Index.get_node_index(grid_graph)
+    subgraph = Index.get_subgraph_from_bbox(grid_graph, -6.7965, -6.7985, 39.2835, 39.2805)
+    assert sorted(subgraph.nodes) == [21, 22, 23, 31, 32, 33]
+
+
+def test_snap_matches_brute_force(grid_graph):
+    edges = Index.get_edge_index(grid_graph)
+    rng = np.random.default_rng(3)
+    lats, lngs = rng.uniform(-6.803, -6.788, 2000), rng.uniform(39.277, 39.292, 2000)
+    snap = edges.snap(lats, lngs)
+    assert (snap.edges >= 0).all()
+
+    # as close as the nearest of all segments, checked one point against every segment
+    planar = np.column_stack((lngs * edges.scale, lats))
+    _, gaps = edges._project(planar[:, None, :], np.arange(len(edges.edges))[None, :])
+    snapped = np.column_stack((snap.lngs * edges.scale, snap.lats))
+    np.testing.assert_allclose(np.linalg.norm(snapped - planar, axis=1), gaps.min(axis=1), rtol=1e-9, atol=1e-12)
+    # two-way streets are indexed once
+    assert len(edges.edges) == grid_graph.number_of_edges() // 2
+
+
+def test_snap_fraction_and_radius(grid_graph):
+    index = Index.get_edge_index(grid_graph)
+    csr = Index.get_csr_graph(grid_graph)
+    # 30% of the way from node 0 to node 1, a few meters off the road
+    snap = index.snap([-6.80 + 0.00003, 0.0], [39.28 + 0.0003, 0.0], max_distance=50)
+    assert csr.nodes[csr.tails[snap.edges[0]]] == 0 and csr.nodes[csr.heads[snap.edges[0]]] == 1
+    assert snap.fractions[0] == pytest.approx(0.3, abs=1e-6)
+    assert snap.distances[0] == pytest.approx(3.3, abs=0.1)
+    assert snap.lats[0] == pytest.approx(-6.80) and snap.lngs[0] == pytest.approx(39.2803)
+    assert snap.edges[1] == -1 and np.isnan(snap.distances[1])
+
+
+def test_snap_follows_curved_geometry():
+    graph = benchmarks.grid_graph(rows=1, cols=2)
+    # a detour north of the straight line: two equal legs, so the bend is halfway
+    bend = LineString([(39.28, -6.80), (39.2805, -6.7995), (39.281, -6.80)])
+    for u, v in [(0, 1), (1, 0)]:
+        graph[u][v][0]["geometry"] = bend if u == 0 else LineString(bend.coords[::-1])
+    snap = Index.get_edge_index(graph).snap([-6.7994], [39.2805])
+    assert snap.fractions[0] == pytest.approx(0.5, abs=1e-3)
+    assert snap.lats[0] == pytest.approx(-6.7995)
+
+
+def test_snap_to_roads_keeps_rows(grid_graph):
+    snapped, distances = Index.snap_to_roads(grid_graph, [(-6.79995, 39.2805), None, (10.0, 10.0)], max_distance=100)
+    assert snapped[0] == pytest.approx((-6.80, 39.2805))
+    assert distances[0] == pytest.approx(5.5, abs=0.1)
+    assert np.isnan(snapped[1:]).all() and (distances[1:] == -1).all()
@@ -0,0 +1,48 @@
+import math
+import pytest
+from src import Index
+from src.speeds import SPEED_PROFILES, parse_maxspeed, prepare_graph
+from src.tiles import GraphTileCache
+
+
+def test_parse_maxspeed():
+    assert parse_maxspeed("50") == 50
+    assert parse_maxspeed("30 mph") == pytest.approx(48.28, abs=0.01)
+    assert parse_maxspeed(["40", "60"]) == 50
+    assert parse_maxspeed("30;50") == 40
+    assert math.isnan(parse_maxspeed("signals"))
+
+
+def test_speeds_follow_profile_and_maxspeed(grid_graph):
+    grid_graph[11][12][0]["maxspeed"] = "20 mph"
+    grid_graph[21][22][0]["highway"] = ["residential", "living_street"]
+    prepare_graph(grid_graph, "drive")
+
+    primary, residential = grid_graph[0][1][0], grid_graph[11][21][0]
+    assert primary["speed_kph"] == SPEED_PROFILES["drive"]["primary"] == 60
+    assert residential["speed_kph"] == 30
+    assert residential["travel_time"] == pytest.approx(residential["length"] / (30 / 3.6))
+    assert grid_graph[11][12][0]["speed_kph"] == pytest.approx(32.19, abs=0.01)
+    assert grid_graph[21][22][0]["speed_kph"] == 20
+    assert all("travel_time" in data for _, _, data in grid_graph.edges(data=True))
+
+
+def test_prepare_keeps_existing_times_unless_overwritten(grid_graph):
+    prepare_graph(grid_graph, "walk")
+    assert grid_graph[0][1][0]["speed_kph"] == 5
+    prepare_graph(grid_graph, "drive")
+    assert grid_graph[0][1][0]["speed_kph"] == 5
+
+    Index.prepare_graph(grid_graph, "drive", profile={"primary": 90, "default": 45}, overwrite=True)
+    assert grid_graph[0][1][0]["speed_kph"] == 90 and grid_graph[11][12][0]["speed_kph"] == 45
+
+
+def test_time_weight_routes_on_travel_times(grid_graph):
+    index = Index(tile_cache=GraphTileCache(loader=lambda *args: grid_graph))
+    origin = (grid_graph.nodes[11]["y"], grid_graph.nodes[11]["x"])
+    destination = (grid_graph.nodes[18]["y"], grid_graph.nodes[18]["x"])
+    # seven residential blocks along row 1, or one block down to the primary row 0, seven along and one back up
+    by_length = index.get_road_distance(origin, destination, "drive", "length")
+    by_time = index.get_road_distance(origin, destination, "drive", "time")
+    assert by_length == pytest.approx(7 * grid_graph[11][12][0]["length"])
+    assert by_time == pytest.approx(by_length + 2 * grid_graph[1][11][0]["length"], rel=1e-3)
@@ -0,0 +1,61 @@
+import json
+import numpy as np
+import pytest
+from shapely.geometry import LineString
+from src import Index
+from src.csr import CSRGraph
+
+
+@pytest.fixture
+def saved_graph(grid_graph, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    grid_graph.edges[0, 1, 0]["geometry"] = LineString([(39.28, -6.80), (39.2805, -6.7999), (39.281, -6.80)])
+    grid_graph.edges[0, 1, 0]["osmid"] = [1, 2]
+    grid_graph.edges[1, 0, 0]["maxspeed"] = "50"
+    return grid_graph
+
+
+def test_binary_round_trip(saved_graph):
+    Index.save_graph(saved_graph, graph_name="grid", network_type="drive")
+    loaded = Index.load_graph("grid", "drive")
+
+    assert loaded.graph == saved_graph.graph
+    assert dict(loaded.nodes(data=True)) == dict(saved_graph.nodes(data=True))
+    for u, v, key, data in saved_graph.edges(keys=True, data=True):
+        assert loaded.edges[u, v, key] == data
+    assert isinstance(loaded.edges[0, 1, 0]["osmid"], list)
+    assert "maxspeed" not in loaded.edges[0, 1, 0]
+
+
+def test_loaded_lists_are_not_shared_between_edges(saved_graph):
+    saved_graph.edges[1, 0, 0]["osmid"] = [1, 2]
+    Index.save_graph(saved_graph, graph_name="grid", network_type="drive")
+    loaded = Index.load_graph("grid", "drive")
+
+    loaded.edges[0, 1, 0]["osmid"].append(3)
+    assert loaded.edges[1, 0, 0]["osmid"] == [1, 2]
+
+
+def test_save_updates_metadata(saved_graph):
+    Index.save_graph(saved_graph, graph_name="grid", network_type="drive", fmt="graphml")
+    first = json.load(open("Graph_Network/grid/drive/grid_metadata.json"))
+    metadata = Index.save_graph(saved_graph, graph_name="grid", network_type="drive")
+
+    assert metadata["date_created"] == first["date_created"]
+    assert set(metadata["formats"]) == {"binary", "graphml"}
+    assert metadata["file_path"] == metadata["formats"]["binary"]
+    assert Index.load_graph("grid", "drive", fmt="graphml").number_of_edges() == saved_graph.number_of_edges()
+
+
+def test_load_csr_graph_matches_graph(saved_graph):
+    Index.save_graph(saved_graph, graph_name="grid", network_type="drive")
+    loaded = Index.load_csr_graph("grid", "drive")
+    built = CSRGraph.from_graph(saved_graph)
+
+    assert isinstance(loaded.heads, np.memmap) or isinstance(loaded.heads.base, np.memmap)
+    assert list(loaded.nodes) == list(built.nodes)
+    assert (loaded.heads == built.heads).all()
+    assert np.allclose(loaded.weights["length"], built.weights["length"])
+    # travel times are added on save and stored with the arrays
+    assert np.allclose(loaded.weights["travel_time"], built.weights["travel_time"])
+    assert not np.isnan(loaded.weights["travel_time"]).any()
@@ -0,0 +1,65 @@
+import networkx as nx
+import pytest
+from shapely.geometry import Polygon
+from src import Index
+from src.csr import CSRGraph
+
+
+# rows 2-3 and columns 1-3 of the grid
+BBOX = (-6.7965, -6.7985, 39.2835, 39.2805)
+
+
+def test_bbox_view_shares_the_graph(grid_graph):
+    view = Index.get_subgraph(grid_graph, bbox=BBOX)
+    assert sorted(view.nodes) == [21, 22, 23, 31, 32, 33]
+    assert view.number_of_edges() == 14
+    assert nx.is_frozen(view) and view[21][22][0] is grid_graph[21][22][0]
+
+    copy = Index.get_subgraph_from_bbox(grid_graph, *BBOX)
+    assert not nx.is_frozen(copy) and sorted(copy.edges) == sorted(view.edges)
+
+
+def test_touching_edges_keep_their_outside_ends(grid_graph):
+    view = Index.get_subgraph(grid_graph, bbox=BBOX, edges="touching")
+    assert view.number_of_edges() == 34
+    assert sorted(view.nodes) == [11, 12, 13, 20, 21, 22, 23, 24, 30, 31, 32, 33, 34, 41, 42, 43]
+    # an edge between two outside nodes stays out even though both its ends are in the view
+    assert not view.has_edge(11, 12)
+
+
+def test_crossing_edges_without_nodes_inside(grid_graph):
+    # a thin box across the middle of the row 2 street between columns 3 and 4, no node inside
+    bbox = (-6.7979, -6.7981, 39.2838, 39.2832)
+    assert Index.get_subgraph(grid_graph, bbox=bbox, edges="touching").number_of_nodes() == 0
+    view = Index.get_subgraph(grid_graph, bbox=bbox, edges="crossing")
+    assert sorted(view.edges(keys=True)) == [(23, 24, 0), (24, 23, 0)]
+
+
+def test_csr_output_routes_like_the_copy(grid_graph):
+    csr = Index.get_subgraph(grid_graph, bbox=BBOX, edges="touching", output="csr")
+    expected = CSRGraph.from_graph(Index.get_subgraph(grid_graph, bbox=BBOX, edges="touching", output="graph"))
+    assert csr.node_count == 16 and csr.edge_count == 34
+    assert sorted(csr.nodes.tolist()) == sorted(expected.nodes.tolist())
+    source, target = csr.node_index[11], csr.node_index[43]
+    cost, _ = csr.shortest_path(source, target)
+    assert cost == pytest.approx(expected.shortest_path(expected.node_index[11], expected.node_index[43])[0])
+
+
+def test_polygon_and_route_corridor(grid_graph):
+    triangle = Polygon([(39.2795, -6.8005), (39.2830, -6.8005), (39.2795, -6.7970)])
+    assert sorted(Index.get_subgraph(grid_graph, polygon=triangle).nodes) == [0, 1, 2, 10, 11, 20]
+
+    route = [0, 1, 2, 12, 22]
+    corridor = Index.get_subgraph(grid_graph, route=route, buffer=30)
+    assert sorted(corridor.nodes) == route and corridor.number_of_edges() == 8
+    points = [(grid_graph.nodes[node]["y"], grid_graph.nodes[node]["x"]) for node in route]
+    assert sorted(Index.get_subgraph(grid_graph, route=points, buffer=30).nodes) == route
+    # 120 meters reaches the next street over on either side, about 111 meters away
+    assert {3, 10, 11, 13, 21, 23, 32}.issubset(Index.get_subgraph(grid_graph, route=route, buffer=120).nodes)
+
+
+def test_invalid_arguments(grid_graph):
+    assert Index.get_subgraph(grid_graph) is None
+    assert Index.get_subgraph(grid_graph, bbox=BBOX, route=[0, 1]) is None
+    assert Index.get_subgraph(grid_graph, bbox=BBOX, edges="all") is None
+    assert Index.get_subgraph(grid_graph, bbox=BBOX, output="dict") is None
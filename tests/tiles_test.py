@@ -0,0 +1,106 @@
+import networkx as nx
+import osmnx as ox
+import pytest
+from src import Index, benchmarks
+from src.tiles import GraphTileCache
+
+
+@pytest.fixture
+def city():
+    # 40 x 40 grid at 0.0025 degree spacing, spanning about 0.1 degrees and several 0.05 degree tiles
+    return benchmarks.grid_graph(rows=40, cols=40, spacing=0.0025, origin=(-6.85, 39.20))
+
+
+@pytest.fixture
+def loads():
+    return []
+
+
+@pytest.fixture
+def tile_cache(city, loads):
+    def loader(north, south, east, west, network_type):
+        loads.append((north, south, east, west, network_type))
+        nodes = [
+            node for node, data in city.nodes(data=True)
+            if south <= data["y"] <= north and west <= data["x"] <= east
+        ]
+        return city.subgraph(nodes).copy()
+    return GraphTileCache(tile_size=0.05, margin=0.005, max_tiles=8, loader=loader)
+
+
+def test_tile_reused_for_nearby_queries(tile_cache, loads):
+    first = tile_cache.graph_for([(-6.84, 39.21), (-6.83, 39.22)], network_type="drive")
+    second = tile_cache.graph_for([(-6.845, 39.215), (-6.835, 39.225)], network_type="drive")
+    assert first is second
+    assert len(loads) == 1
+    assert tile_cache.info()["hits"] == 1
+
+
+def test_adjacent_tiles_are_stitched(tile_cache, loads, city):
+    graph = tile_cache.graph_for([(-6.84, 39.21), (-6.84, 39.28)], network_type="drive")
+    assert len(loads) == 2
+    assert nx.has_path(graph, 1, 38)
+    assert tile_cache.graph_for([(-6.84, 39.21), (-6.84, 39.28)], network_type="drive") is graph
+    assert len(loads) == 2
+
+
+def test_least_recently_used_tiles_are_evicted(tile_cache, loads):
+    tile_cache.max_tiles = 2
+    for lng in (39.21, 39.26, 39.31):
+        tile_cache.graph_for([(-6.84, lng)], network_type="drive")
+    assert tile_cache.info()["evictions"] == 1
+    tile_cache.graph_for([(-6.84, 39.21)], network_type="drive")
+    assert len(loads) == 4
+
+
+def test_shortest_route_served_from_tiles(tile_cache, loads):
+    index = Index(tile_cache=tile_cache)
+    G, route = index.get_shortest_route((-6.84, 39.21), (-6.83, 39.22), 'drive', 'length')
+    assert route[0] != route[-1]
+    assert len(loads) == 1
+
+
+def test_tiles_without_streets_are_cached_empty(city, loads):
+    def loader(north, south, east, west, network_type):
+        loads.append((north, south, east, west, network_type))
+        # the eastern tile is open sea
+        if west > 39.23:
+            raise ox._errors.InsufficientResponseError("No data elements in server response.")
+        nodes = [
+            node for node, data in city.nodes(data=True)
+            if south <= data["y"] <= north and west <= data["x"] <= east
+        ]
+        return city.subgraph(nodes).copy()
+
+    tile_cache = GraphTileCache(tile_size=0.05, margin=0.005, loader=loader)
+    index = Index(tile_cache=tile_cache)
+    for _ in range(2):
+        graph = tile_cache.graph_for([(-6.84, 39.21), (-6.84, 39.26)], network_type="drive")
+        assert graph.number_of_nodes() > 0
+        assert index.get_road_distance((-6.84, 39.21), (-6.83, 39.22), mode='drive', weight='length') > 0
+    assert len(loads) == 2
+    assert tile_cache.get_tile(("drive", -137, 785)).number_of_nodes() == 0
+    assert len(loads) == 2
+
+
+def test_default_loader_passes_bbox_to_osmnx(city, monkeypatch):
+    requests = []
+
+    def graph_from_bbox(bbox, **kwargs):
+        # osmnx 2 takes only the (west, south, east, north) tuple positionally
+        requests.append((bbox, kwargs))
+        west, south, east, north = bbox
+        nodes = [
+            node for node, data in city.nodes(data=True)
+            if south <= data["y"] <= north and west <= data["x"] <= east
+        ]
+        return city.subgraph(nodes).copy()
+
+    monkeypatch.setattr("osmnx.graph_from_bbox", graph_from_bbox)
+    index = Index(tile_cache=GraphTileCache())
+    G, route = index.get_shortest_route((-6.82, 39.23), (-6.81, 39.24), 'drive', 'length')
+    assert route != -1 and route[0] != route[-1]
+    assert index.get_road_distance((-6.82, 39.23), (-6.81, 39.24), mode='drive', weight='length') > 0
+    west, south, east, north = requests[0][0]
+    assert west < east and south < north
+    assert requests[0][1]["network_type"] == "drive"
@@ -0,0 +1,96 @@
+import itertools
+import time
+
+import networkx as nx
+import numpy as np
+from src import Index
+from src.tours import solve_tours
+
+
+def _points(graph, nodes):
+    return [(graph.nodes[n]["y"], graph.nodes[n]["x"]) for n in nodes]
+
+
+def test_small_tour_is_optimal():
+    rng = np.random.default_rng(3)
+    for _ in range(5):
+        points = rng.uniform(0, 100, (8, 2))
+        costs = np.linalg.norm(points[:, None] - points[None], axis=2)
+        # one-way detours make the matrix asymmetric
+        costs = costs + rng.uniform(0, 20, costs.shape) * (1 - np.eye(8))
+        solution = solve_tours(costs, time_budget=0.5)
+        optimal = min(
+            sum(costs[a, b] for a, b in zip((0,) + order, order + (0,)))
+            for order in itertools.permutations(range(1, 8)))
+        assert sorted(solution["routes"][0]) == list(range(1, 8))
+        assert solution["cost"] <= optimal * 1.05
+
+
+def test_capacities_and_time_windows_are_kept():
+    rng = np.random.default_rng(4)
+    points = rng.uniform(0, 1000, (41, 2))
+    costs = np.linalg.norm(points[:, None] - points[None], axis=2)
+    demands = rng.integers(1, 5, 40)
+    windows = [(0, 3000)] * 40
+    windows[7] = (1500, 1600)
+    solution = solve_tours(costs, demands=demands, capacities=[40, 40, 40], windows=windows, service_times=[10] * 40)
+
+    assert sorted(sum(solution["routes"], []) + solution["unassigned"]) == list(range(1, 41))
+    for route, starts in zip(solution["routes"], solution["starts"]):
+        assert demands[np.array(route, dtype=int) - 1].sum() <= 40
+        clock, previous = 0.0, 0
+        for stop, start in zip(route, starts):
+            clock = max(clock + (10 if previous else 0) + costs[previous, stop], windows[stop - 1][0])
+            assert start == clock <= windows[stop - 1][1]
+            previous = stop
+
+
+def test_unreachable_stop_is_unassigned():
+    costs = np.array([[0, 1, 2, np.inf], [1, 0, 1, np.inf], [2, 1, 0, np.inf], [np.inf, np.inf, np.inf, 0]])
+    solution = solve_tours(costs)
+    assert solution["unassigned"] == [3]
+    assert solution["cost"] == 4
+
+
+def test_five_hundred_stops_within_seconds():
+    rng = np.random.default_rng(5)
+    points = rng.uniform(0, 10_000, (501, 2))
+    costs = np.linalg.norm(points[:, None] - points[None], axis=2)
+    start = time.perf_counter()
+    solution = solve_tours(costs, time_budget=2.0)
+    assert time.perf_counter() - start < 10
+    assert sorted(solution["routes"][0]) == list(range(1, 501))
+    # random uniform tours are about 0.7124 * sqrt(N * area) at best
+    assert solution["cost"] < 0.7124 * np.sqrt(500 * 10_000 ** 2) * 1.25
+
+
+def test_optimize_route_on_graph(grid_graph):
+    stops = [99, 9, 90, 55, 22, 77]
+    tours = Index().optimize_route(_points(grid_graph, [0])[0], _points(grid_graph, stops), mode="drive", weight="length", graph=grid_graph)
+
+    route = tours["routes"][0]
+    assert sorted(route["stops"]) == list(range(len(stops)))
+    assert tours["unassigned"] == []
+    path = route["path"]
+    assert path[0] == path[-1] == 0
+    assert all(grid_graph.has_edge(u, v) for u, v in zip(path, path[1:]))
+    visits = [path.index(stops[i]) for i in route["stops"]]
+    assert visits == sorted(visits)
+    length = sum(min(data["length"] for data in grid_graph[u][v].values()) for u, v in zip(path, path[1:]))
+    assert np.isclose(route["distance"], length) and np.isclose(tours["distance"], length)
+    lengths = dict(nx.all_pairs_dijkstra_path_length(grid_graph, weight="length"))
+    optimal = min(
+        sum(lengths[a][b] for a, b in zip((0,) + order, order + (0,)))
+        for order in itertools.permutations(stops))
+    assert np.isclose(length, optimal)
+
+
+def test_optimize_route_splits_by_capacity(grid_graph):
+    stops = [9, 19, 29, 90, 91, 92]
+    tours = Index().optimize_route(
+        _points(grid_graph, [0])[0], _points(grid_graph, stops), mode="drive",
+        capacities=[3, 3], demands=[1] * 6, graph=grid_graph)
+    groups = sorted(sorted(stops[i] for i in route["stops"]) for route in tours["routes"])
+    assert groups == [[9, 19, 29], [90, 91, 92]]
+    assert [route["load"] for route in tours["routes"]] == [3.0, 3.0]
+    assert all(np.all(np.diff(route["arrivals"]) > 0) for route in tours["routes"])
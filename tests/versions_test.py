@@ -0,0 +1,174 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from src import Index, _saved_edge_index
+from src.derived import derived
+from src.versions import apply_diff, diff_graphs, fetch_bbox
+
+
+def route_cost(graph, source, target, weight="length"):
+    csr = Index.get_csr_graph(graph)
+    cost, _ = csr.shortest_path(csr.node_index[source], csr.node_index[target], weight=weight)
+    return cost
+
+
+@pytest.fixture
+def saved(grid_graph, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Index.save_graph(grid_graph, "grid", "drive", source="test")
+    return grid_graph
+
+
+def test_speed_changes_keep_spatial_indexes(grid_graph):
+    Index.prepare_graph(grid_graph, "drive")
+    node_index, edge_index, csr = Index.get_node_index(grid_graph), Index.get_edge_index(grid_graph), Index.get_csr_graph(grid_graph)
+    summary = apply_diff(grid_graph, {"speeds": [(11, 12, 10), (12, 11, 0, 10)]}, "drive")
+
+    assert summary["speeds"] == 2 and summary["stale_weights"] == ["speed_kph", "travel_time"]
+    assert grid_graph[11][12][0]["travel_time"] == pytest.approx(grid_graph[11][12][0]["length"] / (10 / 3.6))
+    assert Index.get_node_index(grid_graph) is node_index and Index.get_edge_index(grid_graph) is edge_index
+    assert Index.get_csr_graph(grid_graph) is not csr
+
+    with pytest.raises(ValueError):
+        apply_diff(grid_graph, {"speeds": [(11, 13, 10)]}, "drive")
+    with pytest.raises(ValueError):
+        apply_diff(grid_graph, {"detours": []}, "drive")
+
+
+def test_invalid_speed_changes_leave_the_graph_untouched(grid_graph):
+    Index.prepare_graph(grid_graph, "drive")
+    del grid_graph[12][13][0]["length"]
+    with pytest.raises(ValueError, match=r"\(12, 13\)"):
+        apply_diff(grid_graph, {"close": [(11, 12)], "speeds": [(11, 12, 10), (12, 13, 10)]}, "drive")
+    assert "closed" not in grid_graph[11][12][0] and grid_graph[11][12][0]["speed_kph"] != 10
+
+    summary = apply_diff(grid_graph, {"add_edges": [(11, 22, {"length": 150.0})], "speeds": [(11, 22, 20)]}, "drive")
+    assert summary["speeds"] == 1 and grid_graph[11][22][0]["travel_time"] == pytest.approx(150.0 / (20 / 3.6))
+
+
+def test_closures_and_edge_changes(grid_graph):
+    Index.prepare_graph(grid_graph, "drive")
+    node_index = Index.get_node_index(grid_graph)
+    straight = route_cost(grid_graph, 11, 13)
+
+    apply_diff(grid_graph, {"close": [(11, 12), (12, 11)]}, "drive")
+    assert route_cost(grid_graph, 11, 13) > straight
+    assert np.isinf(Index.get_csr_graph(grid_graph).edge_weights("travel_time")).sum() == 2
+    apply_diff(grid_graph, {"reopen": [(11, 12)]}, "drive")
+    assert route_cost(grid_graph, 11, 13) == pytest.approx(straight)
+
+    summary = apply_diff(grid_graph, {
+        "add_edges": [(11, 22, {"length": 50.0, "highway": "primary"})],
+        "remove_edges": [(0, 1, 0), (1, 0)],
+    }, "drive")
+    assert summary["add_edges"] == 1 and summary["remove_edges"] == 2 and summary["stale_weights"] == ["*"]
+    assert grid_graph[11][22][0]["speed_kph"] == 60 and grid_graph[11][22][0]["travel_time"] == pytest.approx(3.0)
+    assert not grid_graph.has_edge(0, 1) and route_cost(grid_graph, 11, 22) == 50.0
+    assert Index.get_node_index(grid_graph) is node_index
+
+    apply_diff(grid_graph, {"add_nodes": [(100, {"y": -6.7995, "x": 39.2795})], "add_edges": [(100, 0, {"length": 60.0})], "remove_nodes": [99]}, "drive")
+    assert Index.get_node_index(grid_graph) is not node_index and 99 not in grid_graph
+    assert Index.get_node_index(grid_graph).nearest([-6.7995], [39.2795])[0] == 100
+
+
+def test_diffs_on_saved_graphs_are_versioned(saved, monkeypatch):
+    metadata = json.load(open("Graph_Network/grid/drive/grid_metadata.json"))
+    assert metadata["version"] == 1 and metadata["source"] == "test"
+    assert metadata["bbox"] == pytest.approx([-6.791, -6.80, 39.289, 39.28])
+    Index.build_contraction_hierarchy("grid", "drive", weight="length", benchmark_queries=0)
+    Index.build_contraction_hierarchy("grid", "drive", weight="time", benchmark_queries=0)
+
+    metadata = Index.apply_graph_diff("grid", "drive", {"speeds": [(11, 12, 10)]})
+    assert metadata["version"] == 2 and metadata["source"] == "test"
+    assert metadata["history"][-1]["change"] == "diff" and metadata["history"][-1]["speeds"] == 1
+    assert os.path.exists("Graph_Network/grid/drive/grid_ch_length.npz")
+    assert not os.path.exists("Graph_Network/grid/drive/grid_ch_travel_time.npz")
+    assert list(metadata["contraction_hierarchies"]) == ["length"]
+    assert Index.load_graph("grid", "drive")[11][12][0]["speed_kph"] == 10
+
+    origin, destination = (-6.799, 39.281), (-6.799, 39.283)
+    before = Index().get_road_distance(origin, destination, "drive", "length", graph_name="grid")
+    metadata = Index.apply_graph_diff("grid", "drive", {"close": [(11, 12), (12, 11)]})
+    assert "contraction_hierarchies" not in metadata
+    assert Index().get_road_distance(origin, destination, "drive", "length", graph_name="grid") > before
+    assert Index.load_graph("grid", "drive")[11][12][0]["closed"] is True
+
+    changes = [json.loads(line) for line in open("Graph_Network/grid/drive/grid_changes.jsonl")]
+    assert [change["version"] for change in changes] == [2, 3]
+    assert changes[1]["diff"] == {"close": [[11, 12], [12, 11]]}
+
+
+def test_saved_edge_index_survives_speed_and_closure_diffs(saved):
+    edges = _saved_edge_index("grid", "drive")
+    Index.apply_graph_diff("grid", "drive", {"speeds": [(11, 12, 10)], "close": [(55, 56)]})
+    assert _saved_edge_index("grid", "drive") is edges
+    kept = Index().get_road_distance((-6.7985, 39.2805), (-6.7945, 39.2875), "drive", "length", graph_name="grid", snap="edge")
+    _saved_edge_index.cache_clear()
+    fresh = Index().get_road_distance((-6.7985, 39.2805), (-6.7945, 39.2875), "drive", "length", graph_name="grid", snap="edge")
+    assert kept == pytest.approx(fresh) and kept > 0
+
+    edges = _saved_edge_index("grid", "drive")
+    Index.apply_graph_diff("grid", "drive", {"remove_edges": [(55, 56)]})
+    assert _saved_edge_index("grid", "drive") is not edges
+
+
+def test_refresh_fetches_tiles_in_parallel(saved):
+    loads = []
+
+    def loader(north, south, east, west, network_type):
+        loads.append((north, south, east, west))
+        fresh = saved.copy()
+        fresh.remove_edge(55, 56)
+        fresh[11][12][0]["speed_kph"] = 5.0
+        return fresh
+
+    metadata = Index.refresh_graph("grid", "drive", tile_size=0.005, workers=4, loader=loader)
+    assert len(loads) == 4
+    assert metadata["version"] == 2
+    assert metadata["history"][-1] == {**metadata["history"][-1], "change": "refresh", "remove_edges": 1, "speeds": 1, "add_edges": 0}
+    assert not Index.load_graph("grid", "drive").has_edge(55, 56)
+
+
+def test_diff_graphs_round_trip(grid_graph):
+    Index.prepare_graph(grid_graph, "drive")
+    new = grid_graph.copy()
+    new.remove_node(99)
+    new.add_node(100, y=-6.79, x=39.29)
+    new.add_edge(98, 100, length=100.0, speed_kph=30.0, travel_time=12.0)
+    new.remove_edge(0, 1, 0)
+    new[5][6][0]["speed_kph"] = 15.0
+
+    diff = diff_graphs(grid_graph, new)
+    assert len(diff["remove_edges"]) == 1 and diff["remove_nodes"] == [99] and list(diff["add_nodes"]) == [100]
+    apply_diff(grid_graph, diff, "drive")
+    assert set(grid_graph.edges(keys=True)) == set(new.edges(keys=True))
+    assert grid_graph[5][6][0]["speed_kph"] == 15.0
+    assert diff_graphs(grid_graph, new) == {"add_nodes": {}, "remove_nodes": [], "add_edges": [], "remove_edges": [], "speeds": []}
+
+
+def test_fetch_bbox_merges_tiles(grid_graph):
+    tiles = []
+
+    def loader(north, south, east, west, network_type):
+        tiles.append(network_type)
+        return Index.get_subgraph(grid_graph, bbox=(north, south, east, west), output="graph")
+
+    merged = fetch_bbox(-6.791, -6.80, 39.289, 39.28, "drive", tile_size=0.004, workers=3, loader=loader)
+    assert len(tiles) > 4 and set(merged.edges(keys=True)) == set(grid_graph.edges(keys=True))
+
+
+def test_fetch_bbox_downloads_through_osmnx(grid_graph, monkeypatch):
+    boxes = []
+
+    def graph_from_bbox(bbox, **kwargs):
+        boxes.append(bbox)
+        west, south, east, north = bbox
+        return Index.get_subgraph(grid_graph, bbox=(north, south, east, west), output="graph")
+
+    monkeypatch.setattr("osmnx.graph_from_bbox", graph_from_bbox)
+    merged = fetch_bbox(-6.791, -6.80, 39.289, 39.28, "drive", tile_size=0.004, workers=3)
+    assert len(boxes) > 4 and all(west < east and south < north for west, south, east, north in boxes)
+    assert set(merged.edges(keys=True)) == set(grid_graph.edges(keys=True))
+    assert all("travel_time" in data for _, _, data in merged.edges(data=True))